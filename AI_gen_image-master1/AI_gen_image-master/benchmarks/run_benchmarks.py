@@ -0,0 +1,293 @@
+"""Throughput and latency benchmark of the API clients against the stand-in server.
+
+Run from the application directory:
+
+    python -m benchmarks.run_benchmarks
+    python -m benchmarks.run_benchmarks --save-baseline
+    python -m benchmarks.run_benchmarks --providers openai --concurrency 1,8,32
+
+Each provider is benchmarked in serial, threaded (APIClient on a thread pool)
+and async (AsyncAPIClient) mode at each concurrency level. Every case runs in
+a fresh process, so its peak RSS is its own and not the high-water mark of
+the cases before it. Results are
+compared against benchmarks/baseline.json; the exit code is 1 if throughput
+or p95 latency regressed by more than the tolerance.
+"""
+import sys
+import json
+import queue
+import time
+import asyncio
+import logging
+import argparse
+import platform
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Any
+
+from core.api_client import APIClient, close_sessions
+from core.async_client import AsyncAPIClient
+from core.providers import get_provider
+from core.rate_limit import set_rate_limit
+from benchmarks.standin_server import serve
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+BASELINE_FILE = Path(__file__).parent / "baseline.json"
+MODES = ("serial", "threaded", "async")
+
+# Sizes the stand-in server is asked for; each provider accepts these
+BENCHMARK_SIZES = {
+    "openai": (512, 512),
+    "stability": (1024, 1024),
+    "gemini": (1024, 1024),
+}
+
+
+def peak_rss_mb() -> Optional[float]:
+    """Peak resident set size of this process so far, in MB."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def make_client(provider: str) -> APIClient:
+    client = APIClient(api_key="benchmark", provider=provider)
+    client.use_cache = False
+    client.failover = False
+    client.coalesce = False
+    client.cassette = None
+    return client
+
+
+def timed_call(client: APIClient, provider: str, index: int) -> float:
+    started = time.perf_counter()
+    images = client.generate_images(f"benchmark image {index}", BENCHMARK_SIZES[provider])
+    if not images:
+        raise RuntimeError(f"{provider} request {index} failed")
+    return time.perf_counter() - started
+
+
+def run_serial(provider: str, requests: int, concurrency: int) -> List[float]:
+    client = make_client(provider)
+    return [timed_call(client, provider, i) for i in range(requests)]
+
+
+def run_threaded(provider: str, requests: int, concurrency: int) -> List[float]:
+    client = make_client(provider)
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        return list(pool.map(lambda i: timed_call(client, provider, i), range(requests)))
+
+
+def run_async(provider: str, requests: int, concurrency: int) -> List[float]:
+    async def main():
+        async with AsyncAPIClient(api_key="benchmark", provider=provider,
+                                  concurrency={provider: concurrency}) as client:
+            client._client.use_cache = False
+            client._client.failover = False
+            client._client.coalesce = False
+            client._client.cassette = None
+            # Like the thread pool, only start the clock once a slot is free
+            slots = asyncio.Semaphore(concurrency)
+
+            async def call(index):
+                async with slots:
+                    started = time.perf_counter()
+                    images = await client.generate_images(f"benchmark image {index}",
+                                                          BENCHMARK_SIZES[provider])
+                    if not images:
+                        raise RuntimeError(f"{provider} request {index} failed")
+                    return time.perf_counter() - started
+
+            return await asyncio.gather(*(call(i) for i in range(requests)))
+
+    return asyncio.run(main())
+
+
+RUNNERS = {
+    "serial": run_serial,
+    "threaded": run_threaded,
+    "async": run_async,
+}
+
+
+def run_case(provider: str, mode: str, concurrency: int, requests: int) -> Dict[str, Any]:
+    """Run one benchmark case and summarize it."""
+    cpu_started = time.process_time()
+    started = time.perf_counter()
+    latencies = RUNNERS[mode](provider, requests, concurrency)
+    elapsed = time.perf_counter() - started
+    cpu = time.process_time() - cpu_started
+
+    return {
+        "provider": provider,
+        "mode": mode,
+        "concurrency": concurrency,
+        "requests": requests,
+        "seconds": round(elapsed, 4),
+        "requests_per_second": round(requests / elapsed, 2),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "cpu_ms_per_image": round(cpu / requests * 1000, 2),
+        "peak_rss_mb": round(peak_rss_mb(), 1) if resource is not None else None,
+    }
+
+
+def _case_process(results: "multiprocessing.Queue", url: str, provider: str, mode: str,
+                  concurrency: int, requests: int):
+    """Entry point of the child process that runs one case."""
+    logging.getLogger().setLevel(logging.WARNING)
+    get_provider(provider).base_url = url
+    set_rate_limit(provider, None)
+    try:
+        results.put(run_case(provider, mode, concurrency, requests))
+    finally:
+        close_sessions()
+
+
+def run_case_isolated(url: str, provider: str, mode: str, concurrency: int, requests: int) -> Dict[str, Any]:
+    """Run one case in a freshly spawned process, so no state or memory carries over between cases."""
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target=_case_process, args=(results, url, provider, mode, concurrency, requests))
+    process.start()
+    try:
+        while True:
+            try:
+                return results.get(timeout=1.0)
+            except queue.Empty:
+                if not process.is_alive():
+                    raise RuntimeError(f"Benchmark case {provider}/{mode}/{concurrency} failed "
+                                       f"(exit code {process.exitcode})")
+    finally:
+        process.join()
+
+
+def case_key(result: Dict[str, Any]) -> str:
+    return f"{result['provider']}/{result['mode']}/{result['concurrency']}"
+
+
+def compare(results: List[Dict[str, Any]], baseline: Dict[str, Dict[str, Any]],
+            tolerance: float) -> List[str]:
+    """Describe every case that is slower than the baseline by more than the tolerance."""
+    regressions = []
+    for result in results:
+        base = baseline.get(case_key(result))
+        if base is None:
+            continue
+        if result["requests_per_second"] < base["requests_per_second"] * (1 - tolerance):
+            regressions.append(f"{case_key(result)}: {result['requests_per_second']} req/s "
+                               f"(baseline {base['requests_per_second']})")
+        if result["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{case_key(result)}: p95 {result['p95_ms']} ms "
+                               f"(baseline {base['p95_ms']})")
+    return regressions
+
+
+def print_table(results: List[Dict[str, Any]], baseline: Dict[str, Dict[str, Any]]):
+    header = (f"{'case':<28}{'req/s':>9}{'base':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+              f"{'cpu ms/img':>12}{'rss MB':>9}")
+    print(header)
+    print("-" * len(header))
+    for result in results:
+        base = baseline.get(case_key(result), {}).get("requests_per_second", "-")
+        rss = result["peak_rss_mb"] if result["peak_rss_mb"] is not None else "-"
+        print(f"{case_key(result):<28}{result['requests_per_second']:>9}{base:>9}"
+              f"{result['p50_ms']:>9}{result['p95_ms']:>9}{result['p99_ms']:>9}"
+              f"{result['cpu_ms_per_image']:>12}{rss:>9}")
+
+
+def start_server(latency: float, image_size: int):
+    """Run the stand-in server in its own process so it does not skew CPU and memory figures."""
+    ready = multiprocessing.Queue()
+    process = multiprocessing.Process(target=serve, args=(ready, latency, (image_size, image_size)))
+    process.daemon = True
+    process.start()
+    return process, ready.get(timeout=30)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the API clients against a local stand-in server")
+    parser.add_argument("--providers", default="openai,stability,gemini")
+    parser.add_argument("--modes", default=",".join(MODES))
+    parser.add_argument("--concurrency", default="1,4,16", help="comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=64, help="requests per case")
+    parser.add_argument("--latency", type=float, default=0.05, help="server-side latency in seconds")
+    parser.add_argument("--image-size", type=int, default=512, help="width/height of the served image")
+    parser.add_argument("--baseline", type=Path, default=BASELINE_FILE)
+    parser.add_argument("--save-baseline", action="store_true", help="store these results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="allowed regression before failing")
+    parser.add_argument("--output", type=Path, help="also write the results as JSON to this file")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+
+    providers = [p for p in args.providers.split(",") if p]
+    modes = [m for m in args.modes.split(",") if m]
+    levels = [int(c) for c in args.concurrency.split(",") if c]
+
+    process, url = start_server(args.latency, args.image_size)
+    print(f"Stand-in server at {url} (latency {args.latency}s, image {args.image_size}px)")
+    try:
+        results = []
+        for provider in providers:
+            for mode in modes:
+                # Serial mode has a single concurrency level
+                for concurrency in ([1] if mode == "serial" else levels):
+                    results.append(run_case_isolated(url, provider, mode, concurrency, args.requests))
+    finally:
+        process.terminate()
+
+    baseline = {}
+    if args.baseline.exists():
+        baseline = json.loads(args.baseline.read_text(encoding="utf-8")).get("results", {})
+
+    print()
+    print_table(results, baseline)
+
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2), encoding="utf-8")
+
+    if args.save_baseline:
+        args.baseline.write_text(json.dumps({
+            "machine": platform.platform(),
+            "python": platform.python_version(),
+            "latency": args.latency,
+            "image_size": args.image_size,
+            "results": {case_key(r): r for r in results},
+        }, indent=2), encoding="utf-8")
+        print(f"\nBaseline saved to {args.baseline}")
+        return 0
+
+    if not baseline:
+        print(f"\nNo baseline at {args.baseline}; run with --save-baseline to create one.")
+        return 0
+
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print(f"\nRegressions beyond {args.tolerance:.0%}:")
+        for regression in regressions:
+            print(f"  {regression}")
+        return 1
+    print(f"\nNo regressions beyond {args.tolerance:.0%} against the baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
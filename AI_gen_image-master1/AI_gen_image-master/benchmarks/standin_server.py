@@ -0,0 +1,120 @@
+"""Local HTTP server that answers like the OpenAI, Stability and Gemini image APIs.
+
+Every response carries the same pre-encoded PNG, so the client does the same
+download, JSON, base64 and image work as against the real providers without
+network access or per-image cost.
+"""
+import io
+import os
+import json
+import time
+import base64
+import logging
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Tuple
+
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+
+def make_png(size: Tuple[int, int]) -> bytes:
+    """A noise PNG: compresses about as badly as a real generated image."""
+    image = Image.frombytes("RGB", size, os.urandom(size[0] * size[1] * 3))
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG", compress_level=1)
+    return buffer.getvalue()
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive, like the real APIs
+
+    def do_HEAD(self):
+        # Connection warm-up
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        server = self.server
+
+        if server.latency:
+            time.sleep(server.latency)
+
+        if "/images/generations" in self.path:
+            samples = payload.get("n", 1)
+            body = {"created": int(time.time()),
+                    "data": [{"b64_json": server.image_b64}] * samples}
+        elif "/text-to-image" in self.path:
+            samples = payload.get("samples", 1)
+            body = {"artifacts": [{"base64": server.image_b64, "finishReason": "SUCCESS", "seed": 0}] * samples}
+        elif ":generateContent" in self.path:
+            body = {"candidates": [{"content": {"role": "model", "parts": [
+                {"inlineData": {"mimeType": "image/png", "data": server.image_b64}}
+            ]}}]}
+        else:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address=("127.0.0.1", 0), latency: float = 0.0, image_size: Tuple[int, int] = (512, 512)):
+        super().__init__(address, StandInHandler)
+        self.latency = latency
+        self.image_b64 = base64.b64encode(make_png(image_size)).decode("ascii")
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "StandInServer":
+        """Serve on a background thread."""
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+
+def serve(ready, latency: float, image_size: Tuple[int, int]):
+    """Process target: run the server and report its URL through the `ready` queue."""
+    server = StandInServer(latency=latency, image_size=image_size)
+    ready.put(server.url)
+    server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stand-in image generation API server")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds before each response")
+    parser.add_argument("--image-size", type=int, default=512, help="width/height of the returned image")
+    args = parser.parse_args()
+
+    server = StandInServer(("127.0.0.1", args.port), args.latency, (args.image_size, args.image_size))
+    print(f"Stand-in API server on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,200 @@
 import os
 import time
 import logging
-import base64
-import io
-from typing import Optional, Tuple, Dict, Any, Union
+import json
+import copy
+import uuid
+import threading
+from email.utils import parsedate_to_datetime
+from contextlib import nullcontext
+from typing import Optional, Tuple, Dict, Any, List, Union, Callable
 from pathlib import Path
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
 from PIL import Image
 
-from core.settings import AI_API_KEY, API_PROVIDER, DEFAULT_IMAGE_SIZE, APP_CONFIG
+from core.cache import get_cache
+from core.cassette import get_cassette, REPLAY
+from core import metrics
+from core.cancel import CancelToken, GenerationCancelled
+from core.rate_limit import get_rate_limiter
+from core.router import get_router, OPEN
+from core.generated_image import GeneratedImage
+from core.db import HistoryRecorder, history_row
+from core.image_writer import get_image_writer, output_format, unique_filename
+from core.providers import ImageProvider, get_provider
+from core.stream_decode import decode_stream
+from core.singleflight import SingleFlight
+from core.settings import (AI_API_KEY, API_PROVIDER, DEFAULT_IMAGE_SIZE, APP_CONFIG,
+                           HTTP_POOL_SIZE, HTTP_KEEP_ALIVE, HTTP_WARM_UP, CACHE_ENABLED,
+                           COALESCE_REQUESTS, STREAM_RESPONSES, FAILOVER_ENABLED,
+                           FAILOVER_PROVIDERS, API_KEYS, REQUEST_TIMEOUT)
 
 logger = logging.getLogger(__name__)
 
+# HTTP status codes worth retrying; any other 4xx means the request itself is wrong
+RETRYABLE_STATUS_CODES = {408, 409, 425, 429, 500, 502, 503, 504}
+
+# Size of the chunks read from a streamed response body
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Identical requests in flight at the same time are sent only once
+_single_flight = SingleFlight()
+
+# Connection setup times of the current thread's last request (see TimedHTTPAdapter)
+_connect_timings = threading.local()
+
+
+def _connect_timing_record(stage: str, seconds: float):
+    timings = getattr(_connect_timings, "stages", None)
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+
+class _TimedConnectionMixin:
+    """Measures TCP connect and TLS handshake of new connections."""
+
+    def _new_conn(self):
+        started = time.perf_counter()
+        sock = super()._new_conn()
+        _connect_timing_record("connect", time.perf_counter() - started)
+        return sock
+
+    def connect(self):
+        started = time.perf_counter()
+        super().connect()
+        elapsed = time.perf_counter() - started
+        tcp = (getattr(_connect_timings, "stages", None) or {}).get("connect", 0.0)
+        if isinstance(self, HTTPSConnection):
+            _connect_timing_record("tls", max(0.0, elapsed - tcp))
+
+
+class _TimedHTTPConnection(_TimedConnectionMixin, HTTPConnection):
+    pass
+
+
+class _TimedHTTPSConnection(_TimedConnectionMixin, HTTPSConnection):
+    pass
+
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter whose new connections report their connect and TLS times."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _TimedHTTPConnectionPool,
+            "https": _TimedHTTPSConnectionPool,
+        }
+
+
+# One long-lived session (connection pool) per provider, shared process-wide
+_sessions: Dict[str, requests.Session] = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(provider: str, pool_size: int = None, keep_alive: bool = None,
+                warm_up: bool = None) -> requests.Session:
+    """Get the shared pooled HTTP session for a provider, creating it on first use."""
+    with _sessions_lock:
+        session = _sessions.get(provider)
+        if session is not None:
+            return session
+
+        pool_size = pool_size or HTTP_POOL_SIZE
+        keep_alive = HTTP_KEEP_ALIVE if keep_alive is None else keep_alive
+        warm_up = HTTP_WARM_UP if warm_up is None else warm_up
+
+        session = requests.Session()
+        adapter = TimedHTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=False)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        session.headers["Connection"] = "keep-alive" if keep_alive else "close"
+        _sessions[provider] = session
+        logger.info(f"Created HTTP session for {provider} (pool size: {pool_size})")
+
+    plugin = get_provider(provider)
+    if warm_up and keep_alive and plugin is not None and plugin.base_url:
+        thread = threading.Thread(
+            target=_warm_up_session,
+            args=(session, plugin.base_url)
+        )
+        thread.daemon = True
+        thread.start()
+
+    return session
+
+
+def _warm_up_session(session: requests.Session, base_url: str):
+    """Open a connection in the background so the first real request skips the handshake."""
+    try:
+        session.head(base_url, timeout=10)
+        logger.debug(f"Warmed up connection to {base_url}")
+    except Exception as e:
+        logger.debug(f"Connection warm-up to {base_url} failed: {str(e)}")
+
+
+def map_size(size: Tuple[int, int], provider: str) -> Tuple[int, int]:
+    """Closest size the provider supports: nearest aspect ratio first, then nearest area."""
+    plugin = get_provider(provider)
+    sizes = plugin.supported_sizes if plugin is not None else None
+    if not sizes or tuple(size) in sizes:
+        return tuple(size)
+    ratio = size[0] / size[1]
+    area = size[0] * size[1]
+    return min(sizes, key=lambda s: (round(abs(s[0] / s[1] - ratio), 2), abs(s[0] * s[1] - area)))
+
+
+class APIError(Exception):
+    """A provider returned a non-200 response."""
+    
+    def __init__(self, status_code: int, message: str = None, retry_after: float = None):
+        super().__init__(message or f"API request failed with status {status_code}")
+        self.status_code = status_code
+        self.retry_after = retry_after
+    
+    @property
+    def retryable(self) -> bool:
+        return self.status_code in RETRYABLE_STATUS_CODES
+
+
+class RequestRejected(Exception):
+    """The provider rejected the request itself (a 4xx that is not worth retrying)."""
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parse a Retry-After header (delay in seconds or an HTTP date) into seconds."""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+def close_sessions():
+    """Close all pooled HTTP sessions."""
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+
+
 class APIClient:
     """Client for interacting with AI image generation APIs."""
     
@@ -22,220 +204,456 @@ class APIClient:
         self.provider = (provider or APP_CONFIG.get("api_provider", API_PROVIDER)).lower()
         self.max_retries = 3
         self.retry_delay = 2  # seconds
+        self.cassette = get_cassette()
+        # Cassette traffic bypasses the generation cache so every request is recorded or replayed
+        self.use_cache = CACHE_ENABLED and self.cassette is None
+        self.coalesce = COALESCE_REQUESTS
+        self.stream_responses = STREAM_RESPONSES
+        self.failover = FAILOVER_ENABLED
         
-        if not self.api_key:
+        if not self.api_key and (self.plugin is None or self.plugin.requires_api_key):
             logger.warning("No API key provided. Set API key in Settings.")
     
+    @property
+    def plugin(self) -> Optional[ImageProvider]:
+        """Registered provider implementation for the current provider, or None if unknown."""
+        return get_provider(self.provider)
+    
+    @property
+    def session(self) -> requests.Session:
+        """Pooled HTTP session for the current provider."""
+        return get_session(self.provider)
+    
     def generate_image(self, 
                       prompt: str, 
                       size: Tuple[int, int] = DEFAULT_IMAGE_SIZE,
-                      negative_prompt: str = None) -> Optional[Image.Image]:
+                      negative_prompt: str = None) -> Optional[GeneratedImage]:
         """Generate an image based on text prompt using the selected provider."""
-        if not self.api_key:
-            logger.error("API key is required")
-            return None
+        images = self.generate_images(prompt, size, negative_prompt, samples=1)
+        return images[0] if images else None
+    
+    def generate_images(self,
+                        prompt: str,
+                        size: Tuple[int, int] = DEFAULT_IMAGE_SIZE,
+                        negative_prompt: str = None,
+                        samples: int = 1,
+                        use_cache: bool = None,
+                        progress: Callable[[int, Optional[int]], None] = None,
+                        timeout: float = None,
+                        cancel_token: CancelToken = None) -> List[GeneratedImage]:
+        """Generate several images for one prompt in a single API call.
         
-        retry_count = 0
-        while retry_count < self.max_retries:
-            try:
-                if self.provider == "openai":
-                    return self._call_openai(prompt, size)
-                elif self.provider == "stability":
-                    return self._call_stability(prompt, size, negative_prompt)
-                elif self.provider == "gemini":
-                    return self._call_gemini(prompt, size)
-                else:
-                    logger.error(f"Unsupported API provider: {self.provider}")
-                    return None
-            except Exception as e:
-                retry_count += 1
-                wait_time = self.retry_delay * (2 ** (retry_count - 1))  # Exponential backoff
-                
-                logger.warning(f"API call failed ({retry_count}/{self.max_retries}): {str(e)}")
-                logger.info(f"Retrying in {wait_time} seconds...")
-                
-                time.sleep(wait_time)
+        The sample count is capped at the provider's limit (ImageProvider.max_samples).
+        Identical requests are served from the generation cache unless
+        use_cache (or self.use_cache) is False, and identical requests that
+        are already in flight are shared rather than sent again. progress is
+        called with (bytes_received, total_bytes) while the response downloads;
+        for a shared request only the caller that sent it gets progress.
         
-        logger.error(f"Failed to generate image after {self.max_retries} attempts")
-        return None
-    
-    def _call_openai(self, prompt: str, size: Tuple[int, int]) -> Optional[Image.Image]:
-        """Call OpenAI's DALL-E API."""
-        logger.info(f"Calling OpenAI DALL-E with prompt: {prompt[:50]}...")
+        If failover is enabled and the provider fails (or its circuit breaker
+        is open), the other configured providers with an API key are tried in
+        order of recent latency, with the size mapped to one they support.
+        Each returned image's `provider` says who generated it.
         
-        # Convert size to OpenAI format (e.g. 512x512)
-        size_str = f"{size[0]}x{size[1]}"
+        timeout bounds the whole call, retries and failover included, and
+        cancel_token lets another thread abort it; either raises
+        GenerationCancelled (DeadlineExceeded for the timeout) promptly,
+        including during backoff sleeps and response downloads.
+        Returns an empty list if generation failed.
+        """
+        if cancel_token is not None:
+            token = cancel_token.child(timeout)
+        else:
+            token = CancelToken(timeout)
         
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {self.api_key}"
-        }
+        try:
+            if not self.failover:
+                try:
+                    return self._generate_from_provider(prompt, size, negative_prompt, samples, use_cache,
+                                                        progress, token)
+                except RequestRejected:
+                    return []
+            
+            router = get_router()
+            for provider in router.candidates(self.provider, self.failover_providers()):
+                if not router.health(provider).allow_request():
+                    logger.info(f"Circuit for {provider} is open, skipping")
+                    continue
+            
+                client = self if provider == self.provider else self.for_provider(provider)
+                provider_size = tuple(size) if provider == self.provider else map_size(size, provider)
+                if provider != self.provider:
+                    logger.info(f"Failing over to {provider} at {provider_size[0]}x{provider_size[1]}")
+            
+                token.check()
+                try:
+                    images = client._generate_from_provider(prompt, provider_size, negative_prompt,
+                                                            samples, use_cache, progress, token)
+                except RequestRejected:
+                    # Sending the same request to another (paid) provider would not fix it
+                    logger.error(f"{provider} rejected the request, not failing over")
+                    return []
+                if images:
+                    return images
+            
+            logger.error("No provider could generate the image")
+            return []
+        finally:
+            # Stop the parent token from holding on to this call's token
+            token.release()
+    
+    def failover_providers(self) -> List[str]:
+        """Providers that can serve a request: the selected one plus configured fallbacks with a key."""
+        providers = [self.provider]
+        for provider in FAILOVER_PROVIDERS:
+            plugin = get_provider(provider)
+            if provider in providers or plugin is None:
+                continue
+            if API_KEYS.get(provider) or not plugin.requires_api_key:
+                providers.append(provider)
+        return providers
+    
+    def for_provider(self, provider: str) -> "APIClient":
+        """A copy of this client that sends requests to another provider."""
+        client = copy.copy(self)
+        client.provider = provider
+        client.api_key = API_KEYS.get(provider) or ""
+        return client
+    
+    def _generate_from_provider(self,
+                                prompt: str,
+                                size: Tuple[int, int],
+                                negative_prompt: str = None,
+                                samples: int = 1,
+                                use_cache: bool = None,
+                                progress: Callable[[int, Optional[int]], None] = None,
+                                cancel_token: CancelToken = None) -> List[GeneratedImage]:
+        """Generate images with this client's provider only."""
+        plugin = self.plugin
+        if plugin is None:
+            logger.error(f"Unsupported API provider: {self.provider}")
+            return []
         
-        payload = {
-            "prompt": prompt,
-            "size": size_str,
-            "n": 1,
-            "response_format": "b64_json"
-        }
+        if plugin.requires_api_key and not self.api_key:
+            logger.error("API key is required")
+            return []
         
-        response = requests.post(
-            "https://api.openai.com/v1/images/generations",
-            headers=headers,
-            json=payload,
-            timeout=60
-        )
+        if use_cache is None:
+            use_cache = self.use_cache
+        use_cache = use_cache and plugin.cacheable
         
-        if response.status_code != 200:
-            logger.error(f"OpenAI API error: {response.status_code} - {response.text}")
-            raise Exception(f"API request failed with status {response.status_code}")
+        samples = max(1, min(samples, plugin.max_samples))
+        
+        request_key = self.cache_key(prompt, size, negative_prompt, samples)
+        if use_cache:
+            cached = get_cache().get(request_key)
+            if cached is not None:
+                try:
+                    images = self.parse_response(json.loads(cached))
+                except Exception as e:
+                    # A corrupt entry must not block the request: drop it and ask the provider
+                    logger.warning(f"Discarding unreadable cache entry {request_key[:12]}: {str(e)}")
+                    get_cache().discard(request_key)
+                else:
+                    logger.info(f"Using cached result for prompt: {prompt[:50]}...")
+                    return images
         
-        response_data = response.json()
-        image_data = base64.b64decode(response_data["data"][0]["b64_json"])
+        cache_key = request_key if use_cache else None
         
-        return Image.open(io.BytesIO(image_data))
+        # The request runs on a worker thread so this caller can stop waiting as soon as it is
+        # cancelled. Without coalescing every call gets its own key and therefore its own request.
+        flight_key = f"{self.provider}:{request_key if self.coalesce else uuid.uuid4().hex}"
+        images = _single_flight.do(
+            flight_key,
+            lambda shared_token: self._generate_with_retries(prompt, size, negative_prompt, samples,
+                                                             cache_key, progress, shared_token),
+            cancel_token
+        )
+        # Followers get their own list; the images themselves are shared
+        return list(images)
     
-    def _call_stability(self, 
-                        prompt: str, 
-                        size: Tuple[int, int],
-                        negative_prompt: str = None) -> Optional[Image.Image]:
-        """Call Stability AI API."""
-        logger.info(f"Calling Stability AI with prompt: {prompt[:50]}...")
+    def _generate_with_retries(self,
+                               prompt: str,
+                               size: Tuple[int, int],
+                               negative_prompt: str = None,
+                               samples: int = 1,
+                               cache_key: str = None,
+                               progress: Callable[[int, Optional[int]], None] = None,
+                               cancel_token: CancelToken = None) -> List[GeneratedImage]:
+        """Call the provider, retrying transient failures with backoff.
         
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json",
-            "Accept": "application/json"
-        }
+        Every attempt first takes a token from the provider's shared rate
+        limiter. 429 and 5xx responses are retried, honoring Retry-After; other
+        4xx responses raise RequestRejected immediately and are not counted
+        against the provider's health.
         
-        payload = {
-            "text_prompts": [
-                {
-                    "text": prompt,
-                    "weight": 1.0
-                }
-            ],
-            "height": size[1],
-            "width": size[0],
-            "samples": 1,
-            "cfg_scale": 7.0,
-            "steps": 30,
-            "style_preset": "photographic"
-        }
+        Each attempt's stage timings and the total time and retry count of the
+        call are recorded in the process-wide metrics (see core.metrics).
+        """
+        cancel_token = cancel_token or CancelToken()
+        limiter = get_rate_limiter(self.provider)
+        router = get_router()
+        started = time.perf_counter()
+        retry_count = 0
+        outcome = "error"
+        try:
+            while retry_count < self.max_retries:
+                with metrics.attempt(self.provider, retry_count + 1) as timer:
+                    try:
+                        cancel_token.check()
+                        if limiter is not None:
+                            with metrics.timed("rate_limit_wait"):
+                                limiter.acquire(cancel_token)
+                        call_started = time.monotonic()
+                        images = self._call(prompt, size, negative_prompt, samples, cache_key, progress,
+                                            cancel_token)
+                        router.record(self.provider, True, time.monotonic() - call_started)
+                        timer.finish("ok")
+                        outcome = "ok"
+                        return images
+                    except GenerationCancelled:
+                        timer.finish("cancelled")
+                        outcome = "cancelled"
+                        raise
+                    except Exception as e:
+                        timer.finish("error", getattr(e, "status_code", None))
+                        if cancel_token.cancelled:
+                            # The failure was caused by aborting the request
+                            outcome = "cancelled"
+                            cancel_token.check()
+                        retry_count += 1
+                        logger.warning(f"API call failed ({retry_count}/{self.max_retries}): {str(e)}")
+                        
+                        wait_time = self.retry_wait(e, retry_count)
+                        if wait_time is None:
+                            # A rejected request says nothing about the provider's health
+                            router.health(self.provider).release_probe()
+                            logger.error("Request was rejected by the provider, not retrying")
+                            outcome = "rejected"
+                            raise RequestRejected(str(e)) from e
+                        router.record(self.provider, False)
+                        if retry_count >= self.max_retries:
+                            break
+                        if router.health(self.provider).state == OPEN:
+                            logger.warning(f"Circuit for {self.provider} is open, giving up on it")
+                            break
+                
+                logger.info(f"Retrying in {wait_time} seconds...")
+                with metrics.timed("backoff", self.provider):
+                    cancel_token.sleep(wait_time)
+            
+            logger.error(f"Failed to generate image after {self.max_retries} attempts")
+            return []
+        finally:
+            registry = metrics.get_metrics()
+            registry.observe("generation_seconds", time.perf_counter() - started,
+                             provider=self.provider, outcome=outcome)
+            registry.histogram("generation_retries", buckets=metrics.RETRY_BUCKETS,
+                               provider=self.provider).observe(retry_count)
+    
+    def retry_wait(self, error: Exception, retry_count: int) -> Optional[float]:
+        """Seconds to wait before retrying after `error`, or None if it should not be retried."""
+        wait_time = self.retry_delay * (2 ** (retry_count - 1))  # Exponential backoff
+        if not isinstance(error, APIError):
+            return wait_time  # Network errors and malformed responses
+        if not error.retryable:
+            return None
+        if error.retry_after is not None:
+            # Hold back every caller of this provider, not just this one
+            limiter = get_rate_limiter(self.provider)
+            if limiter is not None:
+                limiter.pause(error.retry_after)
+            return error.retry_after
+        return wait_time
+    
+    def build_request(self,
+                      prompt: str,
+                      size: Tuple[int, int],
+                      negative_prompt: str = None,
+                      samples: int = 1) -> Tuple[str, Dict[str, str], Dict[str, Any]]:
+        """Build the (url, headers, payload) of a request for the selected provider."""
+        plugin = self.plugin
+        if plugin is None:
+            raise ValueError(f"Unsupported API provider: {self.provider}")
+        return plugin.build_request(self.api_key, prompt, size, negative_prompt, samples)
+    
+    def cache_key(self,
+                  prompt: str,
+                  size: Tuple[int, int],
+                  negative_prompt: str = None,
+                  samples: int = 1) -> str:
+        """Key of a request in the generation cache, derived from the full request payload."""
+        url, _, payload = self.build_request(prompt, size, negative_prompt, samples)
+        return get_cache().make_key(self.provider, url, payload)
+    
+    def parse_response(self, response_data: Dict[str, Any],
+                       blobs: Dict[str, bytearray] = None) -> List[GeneratedImage]:
+        """Extract all generated images from a decoded provider response.
         
-        # Add negative prompt if provided
-        if negative_prompt:
-            payload["text_prompts"].append({
-                "text": negative_prompt,
-                "weight": -1.0
-            })
-        
-        response = requests.post(
-            "https://api.stability.ai/v1/generation/stable-diffusion-xl-1024-v1-0/text-to-image",
-            headers=headers,
-            json=payload,
-            timeout=60
-        )
+        blobs holds image fields already decoded by the streaming decoder.
+        """
+        plugin = self.plugin
+        if plugin is None:
+            raise ValueError(f"Unsupported API provider: {self.provider}")
+        images = plugin.parse_response(response_data, blobs)
         
-        if response.status_code != 200:
-            logger.error(f"Stability API error: {response.status_code} - {response.text}")
-            raise Exception(f"API request failed with status {response.status_code}")
+        for image in images:
+            image.provider = self.provider
+        return images
+    
+    def _call(self,
+              prompt: str,
+              size: Tuple[int, int],
+              negative_prompt: str = None,
+              samples: int = 1,
+              cache_key: str = None,
+              progress: Callable[[int, Optional[int]], None] = None,
+              cancel_token: CancelToken = None) -> List[GeneratedImage]:
+        """Send one generation request to the selected provider.
         
-        response_data = response.json()
-        image_data = base64.b64decode(response_data["artifacts"][0]["base64"])
+        If cache_key is given, the raw response body is stored in the generation cache.
+        Cancelling the token closes the response, aborting a download in progress.
+        With a cassette the response is recorded to it, or replayed from it instead of
+        sending the request.
+        """
+        cancel_token = cancel_token or CancelToken()
+        plugin = self.plugin
+        name = plugin.display_name if plugin is not None else self.provider
+        url, headers, payload = self.build_request(prompt, size, negative_prompt, samples)
         
-        return Image.open(io.BytesIO(image_data))
+        logger.info(f"Calling {name} ({samples} sample(s)) with prompt: {prompt[:50]}...")
         
-    def _call_gemini(self, prompt: str, size: Tuple[int, int]) -> Optional[Image.Image]:
-        """Call Google's Gemini API for image generation."""
-        logger.info(f"Calling Gemini API with prompt: {prompt[:50]}...")
+        if plugin.local:
+            with metrics.timed("local_render"):
+                response_data, blobs = plugin.send(payload, cancel_token)
+            return self.parse_response(response_data, blobs)
         
-        # Convert size to match Gemini requirements
-        # We'll choose the closest supported size
-        supported_sizes = {
-            "1024x1024": (1024, 1024),
-            "1024x1792": (1024, 1792),
-            "1792x1024": (1792, 1024)
-        }
+        _connect_timings.stages = {}
+        request_started = time.perf_counter()
+        if self.cassette is not None and self.cassette.mode == REPLAY:
+            response = self.cassette.replay(self.cassette.make_key(self.provider, url, payload), cancel_token)
+            if response is None:
+                raise APIError(404, f"No recorded response for this request in {self.cassette.cassette_dir}")
+        elif self.cassette is not None:
+            response = self.cassette.post(self.session, self.provider, url, headers, payload,
+                                          timeout=cancel_token.timeout(REQUEST_TIMEOUT))
+        else:
+            response = self.session.post(
+                url,
+                headers=headers,
+                json=payload,
+                timeout=cancel_token.timeout(REQUEST_TIMEOUT),
+                stream=self.stream_responses
+            )
         
-        # Find best fit size
-        if size[0] == size[1]:  # Square image
-            size_key = "1024x1024"
-        elif size[0] < size[1]:  # Portrait
-            size_key = "1024x1792"
-        else:  # Landscape
-            size_key = "1792x1024"
-            
-        actual_size = supported_sizes[size_key]
-        logger.info(f"Using Gemini size: {size_key} (requested: {size[0]}x{size[1]})")
+        # Time to the response headers, split into connection setup (new connections only) and waiting
+        waited = time.perf_counter() - request_started
+        connect_stages, _connect_timings.stages = _connect_timings.stages, None
+        for stage, seconds in connect_stages.items():
+            metrics.record_stage(stage, seconds)
+        metrics.record_stage("ttfb", max(0.0, waited - sum(connect_stages.values())))
         
-        # Build the API URL with key - Using gemini-1.5-flash model
-        api_url = f"https://generativelanguage.googleapis.com/v1/models/gemini-1.5-flash:generateContent?key={self.api_key}"
+        unregister = cancel_token.on_cancel(response.close)
+        try:
+            with response:
+                if response.status_code != 200:
+                    logger.error(f"{name} API error: {response.status_code} - {response.text}")
+                    raise APIError(response.status_code,
+                                   retry_after=parse_retry_after(response.headers.get("Retry-After")))
+                
+                if not self.stream_responses:
+                    with metrics.timed("download"):
+                        content = response.content
+                    with metrics.timed("json_parse"):
+                        response_data = json.loads(content)
+                    with metrics.timed("base64_decode"):
+                        images = self.parse_response(response_data)
+                    if cache_key is not None and images:
+                        get_cache().put(cache_key, response.content)
+                    return images
+                
+                # Parse the body incrementally, decoding base64 image fields chunk by chunk
+                content_length = response.headers.get("Content-Length")
+                total = int(content_length) if content_length and content_length.isdigit() else None
+                sink = get_cache().writer(cache_key) if cache_key is not None else nullcontext()
+                with sink as cache_file:
+                    response_data, blobs = decode_stream(
+                        response.iter_content(chunk_size=STREAM_CHUNK_SIZE),
+                        total=total,
+                        progress=progress,
+                        sink=cache_file
+                    )
+                    cancel_token.check()
+                    # Parsed inside the block so a reply without an image is never committed
+                    images = self.parse_response(response_data, blobs)
+                if cache_key is not None and not images:
+                    get_cache().discard(cache_key)
+        finally:
+            unregister()
         
-        headers = {
-            "Content-Type": "application/json"
-        }
+        return images
+    
+    @staticmethod
+    def save_image(image: Union[GeneratedImage, Image.Image], save_dir: Path, prompt: str) -> str:
+        """Save the generated image to disk."""
+        if not save_dir.exists():
+            save_dir.mkdir(parents=True, exist_ok=True)
         
-        payload = {
-            "contents": [
-                {
-                    "role": "user",
-                    "parts": [
-                        {
-                            "text": f"Generate an image based on this description: {prompt}"
-                        }
-                    ]
-                }
-            ],
-            "generation_config": {
-                "temperature": 0.7,
-                "topP": 0.95,
-                "topK": 40
-            }
-        }
+        # Create a unique filename based on the first few words of the prompt
+        writer = get_image_writer()
+        file_path = save_dir / unique_filename(prompt, writer.extension(image))
         
-        response = requests.post(
-            api_url,
-            headers=headers,
-            json=payload,
-            timeout=60
-        )
+        # Save the image in the configured format (provider bytes are copied when it matches)
+        writer.write_all([image], [file_path])
+        logger.info(f"Image saved to {file_path}")
         
-        if response.status_code != 200:
-            logger.error(f"Gemini API error: {response.status_code} - {response.text}")
-            raise Exception(f"API request failed with status {response.status_code}")
+        return str(file_path)
+    
+    @staticmethod
+    def save_images(images: List[Union[GeneratedImage, Image.Image]], save_dir: Path, prompt: str,
+                    db=None, provider: str = "unknown", filename_prefix: str = "",
+                    metadata: Dict[str, Any] = None) -> List[str]:
+        """Save a batch of generated images and record them in the history database together.
         
-        response_data = response.json()
+        db may be a Database or a HistoryRecorder, which batches the insert with other requests.
+        """
+        rows = APIClient.write_images(images, save_dir, prompt, provider, filename_prefix, metadata)
+        if db is not None and rows:
+            if isinstance(db, HistoryRecorder):
+                db.add(rows)
+            else:
+                db.add_images(rows)
         
-        # Extract image data from the response
-        try:
-            # Gemini might return the image in various formats
-            for candidate in response_data.get("candidates", []):
-                for part in candidate.get("content", {}).get("parts", []):
-                    if "inlineData" in part:
-                        mime_type = part["inlineData"]["mimeType"]
-                        if mime_type.startswith("image/"):
-                            image_data = base64.b64decode(part["inlineData"]["data"])
-                            return Image.open(io.BytesIO(image_data))
-        except Exception as e:
-            logger.error(f"Error parsing Gemini response: {str(e)}")
-            raise Exception(f"Failed to extract image from Gemini response: {str(e)}")
-        
-        raise Exception("No image found in Gemini response")
-
+        return [row["filepath"] for row in rows]
+    
     @staticmethod
-    def save_image(image: Image.Image, save_dir: Path, prompt: str) -> str:
-        """Save the generated image to disk."""
+    def write_images(images: List[Union[GeneratedImage, Image.Image]], save_dir: Path, prompt: str,
+                     provider: str = "unknown", filename_prefix: str = "",
+                     metadata: Dict[str, Any] = None) -> List[Dict[str, Any]]:
+        """Write a batch of images to disk and return their history database rows.
+        
+        Every file gets a unique name, so nothing is ever overwritten. The
+        images are encoded and written in parallel on the image writer's
+        threads. metadata (request parameters, timings, ...) is stored with
+        each row, together with the sample number, format and file size.
+        """
         if not save_dir.exists():
             save_dir.mkdir(parents=True, exist_ok=True)
         
-        # Create a filename based on the first few words of the prompt
-        clean_prompt = "".join(c if c.isalnum() else "_" for c in prompt[:30])
-        timestamp = int(time.time())
-        filename = f"{clean_prompt}_{timestamp}.png"
-        file_path = save_dir / filename
+        writer = get_image_writer()
+        paths = [save_dir / unique_filename(prompt, writer.extension(image), filename_prefix,
+                                            index + 1 if len(images) > 1 else None)
+                 for index, image in enumerate(images)]
+        writer.write_all(images, paths)
         
-        # Save the image
-        image.save(file_path, format="PNG")
-        logger.info(f"Image saved to {file_path}")
+        rows = []
+        for index, (image, file_path) in enumerate(zip(images, paths)):
+            rows.append(history_row(prompt, file_path, provider, image.width, image.height, {
+                **(metadata or {}),
+                "sample": index + 1,
+                "format": output_format(image, writer.save_format),
+                "file_size": os.path.getsize(file_path),
+            }))
+        logger.info(f"Saved {len(rows)} images to {save_dir}")
         
-        return str(file_path) 
\ No newline at end of file
+        return rows
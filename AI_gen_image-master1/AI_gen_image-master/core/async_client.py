@@ -0,0 +1,332 @@
+import time
+import asyncio
+import json
+import logging
+from contextlib import nullcontext
+from typing import Optional, Tuple, Dict, Any, List, AsyncIterator
+
+import httpx
+
+from core.api_client import APIClient, APIError, RequestRejected, map_size, parse_retry_after
+from core.cache import get_cache
+from core.cancel import DeadlineExceeded
+from core.cassette import REPLAY
+from core.rate_limit import get_rate_limiter
+from core.router import get_router, OPEN
+from core.generated_image import GeneratedImage
+from core.providers import get_provider
+from core.stream_decode import StreamingResponseDecoder, record_decoder_stages
+from core.singleflight import AsyncSingleFlight
+from core.settings import DEFAULT_IMAGE_SIZE, HTTP_POOL_SIZE, PROVIDER_CONCURRENCY, REQUEST_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+class AsyncAPIClient:
+    """Asyncio client for generating many images concurrently on one event loop.
+
+    Requests are built and parsed by the synchronous APIClient so both clients
+    send identical payloads; only the transport differs. Like APIClient it
+    records to or replays from the cassette, reports outcomes to the provider
+    router's circuit breakers and fails over to other providers.
+    """
+
+    def __init__(self, api_key: str = None, provider: str = None,
+                 concurrency: Dict[str, int] = None):
+        self._client = APIClient(api_key=api_key, provider=provider)
+        self.max_retries = self._client.max_retries
+        self.retry_delay = self._client.retry_delay
+        self.concurrency = dict(PROVIDER_CONCURRENCY)
+        if concurrency:
+            self.concurrency.update(concurrency)
+
+        self._http: Optional[httpx.AsyncClient] = None
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._single_flight = AsyncSingleFlight()
+
+    @property
+    def api_key(self) -> str:
+        return self._client.api_key
+
+    @property
+    def provider(self) -> str:
+        return self._client.provider
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.aclose()
+
+    async def aclose(self):
+        """Close the underlying connection pool."""
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+
+    def _get_http(self) -> httpx.AsyncClient:
+        if self._http is None:
+            limits = httpx.Limits(max_connections=max(self.concurrency.values(), default=HTTP_POOL_SIZE),
+                                  max_keepalive_connections=HTTP_POOL_SIZE)
+            self._http = httpx.AsyncClient(limits=limits, timeout=REQUEST_TIMEOUT)
+        return self._http
+
+    def _get_semaphore(self, provider: str) -> asyncio.Semaphore:
+        if provider not in self._semaphores:
+            plugin = get_provider(provider)
+            default = plugin.concurrency if plugin is not None else 4
+            self._semaphores[provider] = asyncio.Semaphore(self.concurrency.get(provider, default))
+        return self._semaphores[provider]
+
+    async def generate_image(self,
+                             prompt: str,
+                             size: Tuple[int, int] = DEFAULT_IMAGE_SIZE,
+                             negative_prompt: str = None) -> Optional[GeneratedImage]:
+        """Generate one image, waiting for a free slot in the provider's concurrency limit."""
+        images = await self.generate_images(prompt, size, negative_prompt, samples=1)
+        return images[0] if images else None
+
+    async def generate_images(self,
+                              prompt: str,
+                              size: Tuple[int, int] = DEFAULT_IMAGE_SIZE,
+                              negative_prompt: str = None,
+                              samples: int = 1,
+                              use_cache: bool = None,
+                              timeout: float = None) -> List[GeneratedImage]:
+        """Generate several images for one prompt in a single API call.
+
+        timeout bounds the whole call and raises DeadlineExceeded; cancelling
+        the awaiting task cancels the call. A request shared with other callers
+        keeps running for them either way.
+        """
+        try:
+            return await asyncio.wait_for(
+                self._generate_images(prompt, size, negative_prompt, samples, use_cache), timeout)
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded("Generation deadline exceeded")
+
+    async def _generate_images(self,
+                               prompt: str,
+                               size: Tuple[int, int],
+                               negative_prompt: str = None,
+                               samples: int = 1,
+                               use_cache: bool = None) -> List[GeneratedImage]:
+        """Generate with the selected provider, failing over like APIClient.generate_images."""
+        if not self._client.failover:
+            try:
+                return await self._generate_from_provider(self._client, prompt, size, negative_prompt,
+                                                          samples, use_cache)
+            except RequestRejected:
+                return []
+
+        router = get_router()
+        for provider in router.candidates(self.provider, self._client.failover_providers()):
+            if not router.health(provider).allow_request():
+                logger.info(f"Circuit for {provider} is open, skipping")
+                continue
+
+            client = self._client if provider == self.provider else self._client.for_provider(provider)
+            provider_size = tuple(size) if provider == self.provider else map_size(size, provider)
+            if provider != self.provider:
+                logger.info(f"Failing over to {provider} at {provider_size[0]}x{provider_size[1]}")
+
+            try:
+                images = await self._generate_from_provider(client, prompt, provider_size, negative_prompt,
+                                                            samples, use_cache)
+            except RequestRejected:
+                # Sending the same request to another (paid) provider would not fix it
+                logger.error(f"{provider} rejected the request, not failing over")
+                return []
+            if images:
+                return images
+
+        logger.error("No provider could generate the image")
+        return []
+
+    async def _generate_from_provider(self,
+                                      client: APIClient,
+                                      prompt: str,
+                                      size: Tuple[int, int],
+                                      negative_prompt: str = None,
+                                      samples: int = 1,
+                                      use_cache: bool = None) -> List[GeneratedImage]:
+        """Generate images with the given client's provider only."""
+        plugin = client.plugin
+        if plugin is None:
+            logger.error(f"Unsupported API provider: {client.provider}")
+            return []
+
+        if plugin.requires_api_key and not client.api_key:
+            logger.error("API key is required")
+            return []
+
+        if use_cache is None:
+            use_cache = client.use_cache
+        use_cache = use_cache and plugin.cacheable
+
+        samples = max(1, min(samples, plugin.max_samples))
+        url, headers, payload = client.build_request(prompt, size, negative_prompt, samples)
+
+        request_key = get_cache().make_key(client.provider, url, payload)
+        if use_cache:
+            cached = get_cache().get(request_key)
+            if cached is not None:
+                try:
+                    images = client.parse_response(json.loads(cached))
+                except Exception as e:
+                    # A corrupt entry must not block the request: drop it and ask the provider
+                    logger.warning(f"Discarding unreadable cache entry {request_key[:12]}: {str(e)}")
+                    get_cache().discard(request_key)
+                else:
+                    logger.info(f"Using cached result for prompt: {prompt[:50]}...")
+                    return images
+
+        cache_key = request_key if use_cache else None
+        if not client.coalesce:
+            return await self._post_with_retries(client, prompt, url, headers, payload, cache_key)
+
+        images = await self._single_flight.do(
+            f"{client.provider}:{request_key}",
+            lambda: self._post_with_retries(client, prompt, url, headers, payload, cache_key)
+        )
+        return list(images)
+
+    async def _post_with_retries(self, client: APIClient, prompt: str, url: str, headers: Dict[str, str],
+                                 payload: Dict[str, Any], cache_key: str = None) -> List[GeneratedImage]:
+        """Send the request, retrying transient failures the same way as APIClient.
+
+        Outcomes feed the provider's circuit breaker; a rejected request
+        raises RequestRejected and is not counted against it.
+        """
+        limiter = get_rate_limiter(client.provider)
+        router = get_router()
+        retry_count = 0
+        while retry_count < self.max_retries:
+            try:
+                async with self._get_semaphore(client.provider):
+                    if limiter is not None:
+                        await limiter.acquire_async()
+                    logger.info(f"Calling {client.provider} (async) with prompt: {prompt[:50]}...")
+                    call_started = time.monotonic()
+                    images = await self._post(client, url, headers, payload, cache_key)
+                router.record(client.provider, True, time.monotonic() - call_started)
+                return images
+            except Exception as e:
+                retry_count += 1
+                logger.warning(f"API call failed ({retry_count}/{self.max_retries}): {str(e)}")
+
+                wait_time = client.retry_wait(e, retry_count)
+                if wait_time is None:
+                    # A rejected request says nothing about the provider's health
+                    router.health(client.provider).release_probe()
+                    logger.error("Request was rejected by the provider, not retrying")
+                    raise RequestRejected(str(e)) from e
+                router.record(client.provider, False)
+                if retry_count >= self.max_retries:
+                    break
+                if router.health(client.provider).state == OPEN:
+                    logger.warning(f"Circuit for {client.provider} is open, giving up on it")
+                    break
+
+                logger.info(f"Retrying in {wait_time} seconds...")
+                await asyncio.sleep(wait_time)
+
+        logger.error(f"Failed to generate image after {self.max_retries} attempts")
+        return []
+
+    async def _post(self, client: APIClient, url: str, headers: Dict[str, str], payload: Dict[str, Any],
+                    cache_key: str = None) -> List[GeneratedImage]:
+        """Stream one request, decoding image fields as they arrive, and parse the images.
+
+        If cache_key is given, the raw body is written to the generation cache as it
+        streams; the entry is only committed once the response parsed into images.
+        With a cassette the response is recorded to it, or replayed from it instead
+        of sending the request.
+        """
+        plugin = client.plugin
+        if plugin.local:
+            response_data, blobs = await plugin.send_async(payload)
+            return client.parse_response(response_data, blobs)
+
+        if client.cassette is not None:
+            return await self._post_cassette(client, url, headers, payload, cache_key)
+
+        async with self._get_http().stream("POST", url, headers=headers, json=payload) as response:
+            if response.status_code != 200:
+                await response.aread()
+                logger.error(f"{client.provider} API error: {response.status_code} - {response.text}")
+                raise APIError(response.status_code,
+                               retry_after=parse_retry_after(response.headers.get("Retry-After")))
+
+            decoder = StreamingResponseDecoder()
+            sink = get_cache().writer(cache_key) if cache_key is not None else nullcontext()
+            started = time.perf_counter()
+            with sink as cache_file:
+                async for chunk in response.aiter_bytes():
+                    decoder.feed(chunk)
+                    if cache_file is not None:
+                        cache_file.write(chunk)
+                response_data, blobs = decoder.result()
+                decode_seconds = time.perf_counter() - started
+                images = client.parse_response(response_data, blobs)
+            if cache_key is not None and not images:
+                get_cache().discard(cache_key)
+            record_decoder_stages(decoder, decode_seconds)
+
+        return images
+
+    async def _post_cassette(self, client: APIClient, url: str, headers: Dict[str, str],
+                             payload: Dict[str, Any], cache_key: str = None) -> List[GeneratedImage]:
+        """Record the request to the client's cassette, or replay it from there."""
+        cassette = client.cassette
+        if cassette.mode == REPLAY:
+            response = await cassette.replay_async(cassette.make_key(client.provider, url, payload))
+            if response is None:
+                raise APIError(404, f"No recorded response for this request in {cassette.cassette_dir}")
+        else:
+            response = await cassette.post_async(self._get_http(), client.provider, url, headers, payload)
+
+        if response.status_code != 200:
+            logger.error(f"{client.provider} API error: {response.status_code} - {response.text}")
+            raise APIError(response.status_code,
+                           retry_after=parse_retry_after(response.headers.get("Retry-After")))
+
+        decoder = StreamingResponseDecoder()
+        decoder.feed(response.content)
+        response_data, blobs = decoder.result()
+        images = client.parse_response(response_data, blobs)
+        if cache_key is not None and images:
+            get_cache().put(cache_key, response.content)
+        return images
+
+    async def iter_generate(self, requests: List[Dict[str, Any]]) -> AsyncIterator[Tuple[int, Optional[GeneratedImage]]]:
+        """Fan out all requests at once and yield (index, image) as each one finishes.
+
+        Each request is a dict with "prompt" and optional "size" and "negative_prompt".
+        A request that raises is logged and yields None, without stopping the others.
+        """
+        async def run(index, request):
+            try:
+                image = await self.generate_image(
+                    prompt=request["prompt"],
+                    size=tuple(request.get("size", DEFAULT_IMAGE_SIZE)),
+                    negative_prompt=request.get("negative_prompt")
+                )
+            except Exception as e:
+                logger.error(f"Request {index} failed: {str(e)}")
+                image = None
+            return index, image
+
+        tasks = [asyncio.ensure_future(run(i, r)) for i, r in enumerate(requests)]
+        try:
+            for future in asyncio.as_completed(tasks):
+                yield await future
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def generate_many(self, requests: List[Dict[str, Any]]) -> List[Optional[GeneratedImage]]:
+        """Generate images for all requests concurrently, returned in request order."""
+        results: List[Optional[GeneratedImage]] = [None] * len(requests)
+        async for index, image in self.iter_generate(requests):
+            results[index] = image
+        return results
@@ -0,0 +1,230 @@
+import csv
+import json
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Any, Dict, List, Optional, TextIO, Tuple
+
+from core.api_client import APIClient
+from core.cancel import CancelToken, GenerationCancelled
+from core.db import Database, HistoryRecorder
+from core.settings import DEFAULT_IMAGE_SIZE, GENERATION_TIMEOUT, ensure_dirs
+
+logger = logging.getLogger(__name__)
+
+# Headless code path: nothing here may import customtkinter or the ui package
+
+
+def parse_size(value: Any) -> Tuple[int, int]:
+    """Parse a size given as "512x512", [512, 512] or {"width": .., "height": ..}."""
+    if not value:
+        return tuple(DEFAULT_IMAGE_SIZE)
+    if isinstance(value, str):
+        width, height = value.lower().split("x")
+        return int(width), int(height)
+    if isinstance(value, dict):
+        return int(value["width"]), int(value["height"])
+    return int(value[0]), int(value[1])
+
+
+def _normalize(record: Dict[str, Any], line: int) -> Dict[str, Any]:
+    prompt = (record.get("prompt") or "").strip()
+    if not prompt:
+        raise ValueError(f"Line {line}: missing prompt")
+    if record.get("width") and record.get("height"):
+        size = (int(record["width"]), int(record["height"]))
+    else:
+        size = parse_size(record.get("size"))
+    return {
+        "line": line,
+        "prompt": prompt,
+        "size": size,
+        "negative_prompt": (record.get("negative_prompt") or "").strip() or None,
+        "provider": (record.get("provider") or "").strip().lower() or None,
+        "samples": int(record.get("samples") or 1),
+    }
+
+
+def read_prompts(path: Path) -> List[Dict[str, Any]]:
+    """Read batch jobs from a JSONL or CSV file.
+
+    Each record needs a prompt and may set size ("WxH") or width/height,
+    negative_prompt, provider and samples. CSV files need a header row.
+    """
+    path = Path(path)
+    jobs = []
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        if path.suffix.lower() == ".csv":
+            for line, record in enumerate(csv.DictReader(f), start=2):
+                jobs.append(_normalize(record, line))
+        else:
+            for line, text in enumerate(f, start=1):
+                if text.strip() and not text.lstrip().startswith("#"):
+                    record = json.loads(text)
+                    if not isinstance(record, dict):
+                        raise ValueError(f"Line {line}: expected a JSON object")
+                    jobs.append(_normalize(record, line))
+    return jobs
+
+
+def _percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))] if ordered else 0.0
+
+
+class BatchRunner:
+    """Runs batch jobs through APIClient on a thread pool.
+
+    Images are saved as each job finishes and recorded in the history
+    database in batches, and one JSON line per job is written to the
+    results file.
+    """
+
+    def __init__(self, save_dir: Path, db: Database = None, provider: str = None,
+                 concurrency: int = 4, timeout: float = GENERATION_TIMEOUT,
+                 results_file: TextIO = None):
+        self.save_dir = Path(save_dir)
+        self.recorder = HistoryRecorder(db) if db is not None else None
+        self.concurrency = max(1, concurrency)
+        self.timeout = timeout
+        self.results_file = results_file
+        self.cancel_token = CancelToken()
+
+        self._client = APIClient(provider=provider)
+        self._clients: Dict[str, APIClient] = {self._client.provider: self._client}
+        self._lock = threading.Lock()
+
+    def client_for(self, provider: Optional[str]) -> APIClient:
+        """Client for a job's provider; keys for other providers come from api_keys."""
+        provider = provider or self._client.provider
+        with self._lock:
+            if provider not in self._clients:
+                self._clients[provider] = self._client.for_provider(provider)
+            return self._clients[provider]
+
+    def run_job(self, index: int, job: Dict[str, Any]) -> Dict[str, Any]:
+        started = time.perf_counter()
+        result = {"line": job["line"], "prompt": job["prompt"], "paths": [], "error": None}
+        try:
+            client = self.client_for(job["provider"])
+            images = client.generate_images(
+                job["prompt"], job["size"], job["negative_prompt"],
+                samples=job["samples"],
+                timeout=self.timeout,
+                cancel_token=self.cancel_token
+            )
+            if not images:
+                raise ValueError("Generation failed")
+            result["provider"] = images[0].provider or client.provider
+            result["paths"] = APIClient.save_images(
+                images, self.save_dir, job["prompt"], db=self.recorder,
+                provider=result["provider"], filename_prefix=f"{index + 1:05d}_",
+                metadata={
+                    "source": "batch",
+                    "line": job["line"],
+                    "requested_provider": client.provider,
+                    "requested_size": f"{job['size'][0]}x{job['size'][1]}",
+                    "negative_prompt": job["negative_prompt"],
+                    "samples": job["samples"],
+                    "generation_seconds": round(time.perf_counter() - started, 3),
+                }
+            )
+            result["bytes"] = sum(len(image.data) for image in images)
+        except GenerationCancelled as e:
+            result["error"] = str(e)
+        except Exception as e:
+            logger.error(f"Job on line {job['line']} failed: {str(e)}")
+            result["error"] = str(e)
+        result["seconds"] = round(time.perf_counter() - started, 3)
+        return result
+
+    def run(self, jobs: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Run all jobs and return a throughput summary."""
+        self.save_dir.mkdir(parents=True, exist_ok=True)
+        started = time.perf_counter()
+        results = []
+        try:
+            with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+                futures = [pool.submit(self.run_job, index, job) for index, job in enumerate(jobs)]
+                try:
+                    for done, future in enumerate(as_completed(futures), start=1):
+                        result = future.result()
+                        results.append(result)
+                        self._report(result, done, len(jobs))
+                except KeyboardInterrupt:
+                    print("Interrupted, cancelling remaining jobs...", flush=True)
+                    self.cancel_token.cancel()
+                    for future in futures:
+                        future.cancel()
+                    raise
+        finally:
+            # Commit the history rows of every finished job, also when interrupted
+            if self.recorder is not None:
+                self.recorder.close()
+        return self.summarize(results, time.perf_counter() - started)
+
+    def _report(self, result: Dict[str, Any], done: int, total: int):
+        status = "ok" if not result["error"] else f"FAILED: {result['error']}"
+        print(f"[{done}/{total}] line {result['line']} {result['seconds']:.1f}s {status} "
+              f"- {result['prompt'][:50]}", flush=True)
+        if self.results_file is not None:
+            self.results_file.write(json.dumps(result, ensure_ascii=False) + "\n")
+            self.results_file.flush()
+
+    @staticmethod
+    def summarize(results: List[Dict[str, Any]], elapsed: float) -> Dict[str, Any]:
+        succeeded = [r for r in results if not r["error"]]
+        latencies = [r["seconds"] for r in succeeded]
+        images = sum(len(r["paths"]) for r in succeeded)
+        return {
+            "jobs": len(results),
+            "succeeded": len(succeeded),
+            "failed": len(results) - len(succeeded),
+            "images": images,
+            "bytes": sum(r.get("bytes", 0) for r in succeeded),
+            "seconds": round(elapsed, 2),
+            "images_per_second": round(images / elapsed, 3) if elapsed else 0.0,
+            "p50_seconds": round(_percentile(latencies, 0.50), 3),
+            "p95_seconds": round(_percentile(latencies, 0.95), 3),
+        }
+
+
+def print_summary(summary: Dict[str, Any]):
+    print()
+    print(f"Jobs:        {summary['succeeded']}/{summary['jobs']} succeeded, {summary['failed']} failed")
+    print(f"Images:      {summary['images']} ({summary['bytes'] / (1024 * 1024):.1f} MB)")
+    print(f"Wall time:   {summary['seconds']:.1f}s")
+    print(f"Throughput:  {summary['images_per_second']:.2f} images/s")
+    print(f"Latency:     p50 {summary['p50_seconds']:.2f}s, p95 {summary['p95_seconds']:.2f}s")
+
+
+def run_batch_command(args) -> int:
+    """Entry point of `main.py batch`; returns the process exit code."""
+    try:
+        jobs = read_prompts(args.prompts)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Cannot read {args.prompts}: {e}")
+        return 2
+    if not jobs:
+        print(f"No prompts in {args.prompts}")
+        return 2
+
+    save_dir = Path(args.output) if args.output else ensure_dirs()
+    db = None if args.no_db else Database()
+    results_path = Path(args.results) if args.results else save_dir / "batch_results.jsonl"
+    results_path.parent.mkdir(parents=True, exist_ok=True)
+
+    print(f"Generating {len(jobs)} job(s) with concurrency {args.concurrency} into {save_dir}")
+    with open(results_path, "a", encoding="utf-8") as results_file:
+        runner = BatchRunner(save_dir, db=db, provider=args.provider, concurrency=args.concurrency,
+                             timeout=args.timeout, results_file=results_file)
+        try:
+            summary = runner.run(jobs)
+        except KeyboardInterrupt:
+            return 130
+
+    print_summary(summary)
+    print(f"Results:     {results_path}")
+    return 0 if summary["failed"] == 0 else 1
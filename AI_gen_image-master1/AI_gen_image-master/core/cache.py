@@ -0,0 +1,183 @@
+import os
+import json
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Optional, Dict, Any
+from urllib.parse import urlsplit
+
+from core.settings import CACHE_DIR, CACHE_MAX_BYTES
+
+logger = logging.getLogger(__name__)
+
+class GenerationCache:
+    """Content-addressed on-disk cache of provider responses.
+
+    Entries are keyed by a hash of the full request (provider, endpoint and
+    payload) and evicted least-recently-used once the cache exceeds max_bytes.
+    """
+
+    def __init__(self, cache_dir: Path = CACHE_DIR, max_bytes: int = CACHE_MAX_BYTES):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, int]" = OrderedDict()  # key -> size, oldest first
+        self._total_bytes = 0
+        self._load_index()
+
+    def _load_index(self):
+        """Rebuild the LRU order from the files already on disk."""
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        files = sorted(self.cache_dir.glob("*.json"), key=lambda p: p.stat().st_mtime)
+        for path in files:
+            size = path.stat().st_size
+            self._entries[path.stem] = size
+            self._total_bytes += size
+        logger.info(f"Generation cache at {self.cache_dir}: {len(self._entries)} entries, {self._total_bytes} bytes")
+
+    @staticmethod
+    def make_key(provider: str, url: str, payload: Dict[str, Any]) -> str:
+        """Hash a request into a cache key. The URL query is dropped so API keys never affect the key."""
+        parts = urlsplit(url)
+        material = json.dumps({
+            "provider": provider,
+            "endpoint": f"{parts.netloc}{parts.path}",
+            "payload": payload,
+        }, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.json"
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Return the cached response body for a key, or None on a miss."""
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+
+        try:
+            path = self._path(key)
+            data = path.read_bytes()
+            os.utime(path)  # Keep the LRU order across restarts
+        except OSError:
+            with self._lock:
+                self._forget(key)
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        logger.debug(f"Generation cache hit: {key[:12]}")
+        return data
+
+    def put(self, key: str, data: bytes):
+        """Store a response body and evict old entries if the cache is over its size limit."""
+        if len(data) > self.max_bytes:
+            return
+
+        path = self._path(key)
+        tmp_path = path.with_name(f"{key}.{threading.get_ident()}.tmp")
+        try:
+            tmp_path.write_bytes(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Failed to write cache entry {key[:12]}: {str(e)}")
+            return
+
+        with self._lock:
+            self._forget(key)
+            self._entries[key] = len(data)
+            self._total_bytes += len(data)
+            self._evict()
+
+    @contextmanager
+    def writer(self, key: str):
+        """Stream a response body into the cache; the entry is committed only if the block succeeds."""
+        path = self._path(key)
+        tmp_path = path.with_name(f"{key}.{threading.get_ident()}.tmp")
+        try:
+            with open(tmp_path, "wb") as f:
+                yield f
+            size = os.path.getsize(tmp_path)
+            if size > self.max_bytes:
+                os.remove(tmp_path)
+                return
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+        with self._lock:
+            self._forget(key)
+            self._entries[key] = size
+            self._total_bytes += size
+            self._evict()
+
+    def discard(self, key: str):
+        """Remove one entry, e.g. a response that turned out not to contain an image."""
+        with self._lock:
+            self._forget(key)
+        try:
+            self._path(key).unlink()
+        except OSError:
+            pass
+
+    def _forget(self, key: str):
+        size = self._entries.pop(key, None)
+        if size is not None:
+            self._total_bytes -= size
+
+    def _evict(self):
+        while self._total_bytes > self.max_bytes and self._entries:
+            key, size = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            try:
+                self._path(key).unlink()
+            except OSError:
+                pass
+            logger.debug(f"Evicted generation cache entry {key[:12]}")
+
+    def clear(self):
+        """Remove every cached entry."""
+        with self._lock:
+            for key in list(self._entries):
+                try:
+                    self._path(key).unlink()
+                except OSError:
+                    pass
+            self._entries.clear()
+            self._total_bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        """Hit/miss counters and current size."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+
+_default_cache: Optional[GenerationCache] = None
+_default_cache_lock = threading.Lock()
+
+
+def get_cache() -> GenerationCache:
+    """Get the process-wide generation cache."""
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = GenerationCache()
+        return _default_cache
@@ -0,0 +1,169 @@
+import time
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+class GenerationCancelled(Exception):
+    """A generation call was cancelled before it finished."""
+
+
+class DeadlineExceeded(GenerationCancelled):
+    """A generation call ran out of time."""
+
+
+class CancelToken:
+    """Cancellation flag with an optional overall deadline.
+
+    Pass one token through a whole generation call: backoff sleeps wake up
+    as soon as it fires, callbacks registered with on_cancel() (e.g. closing
+    an HTTP response) run on cancel or when the deadline passes, and check()
+    raises GenerationCancelled / DeadlineExceeded.
+    """
+
+    def __init__(self, timeout: float = None):
+        self.deadline = time.monotonic() + timeout if timeout is not None else None
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks: List[Callable[[], None]] = []
+        self._detach: Optional[Callable[[], None]] = None
+
+    def cancel(self):
+        """Cancel the call; safe to call from any thread, more than once."""
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks = list(self._callbacks)
+            self._callbacks.clear()
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.debug(f"Cancel callback failed: {str(e)}")
+
+    @property
+    def expired(self) -> bool:
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set() or self.expired
+
+    def remaining(self) -> Optional[float]:
+        """Seconds left until the deadline, or None if there is none."""
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    def timeout(self, default: float) -> float:
+        """Per-request timeout: the default, cut short by the deadline."""
+        remaining = self.remaining()
+        return default if remaining is None else max(0.001, min(default, remaining))
+
+    def check(self):
+        """Raise if the call has been cancelled or its deadline has passed."""
+        if self.expired:
+            raise DeadlineExceeded("Generation deadline exceeded")
+        if self._event.is_set():
+            raise GenerationCancelled("Generation cancelled")
+
+    def sleep(self, seconds: float):
+        """Sleep for up to `seconds`, raising as soon as the token fires.
+
+        Raises DeadlineExceeded straight away if the sleep would outlast the deadline.
+        """
+        remaining = self.remaining()
+        if remaining is not None and remaining < seconds:
+            raise DeadlineExceeded("Generation deadline exceeded")
+        self._event.wait(seconds)
+        self.check()
+
+    def on_cancel(self, callback: Callable[[], None]) -> Callable[[], None]:
+        """Run callback when the token is cancelled or expires; returns a function that unregisters it."""
+        with self._lock:
+            fire_now = self._event.is_set()
+            if not fire_now:
+                self._callbacks.append(callback)
+        if fire_now:
+            callback()
+            return lambda: None
+
+        timer = None
+
+        def arm():
+            nonlocal timer
+            remaining = self.remaining()
+            if remaining is None:
+                return
+            timer = threading.Timer(remaining, on_deadline)
+            timer.daemon = True
+            timer.start()
+
+        def on_deadline():
+            with self._lock:
+                registered = callback in self._callbacks
+            if not registered:
+                return
+            if self.expired:
+                callback()
+            else:
+                arm()  # The deadline was pushed out by extend()
+
+        arm()
+
+        def unregister():
+            with self._lock:
+                if callback in self._callbacks:
+                    self._callbacks.remove(callback)
+            if timer is not None:
+                timer.cancel()
+
+        return unregister
+
+    def extend(self, deadline: Optional[float]):
+        """Push the deadline out to `deadline` (a time.monotonic() value, None for no limit).
+
+        Never brings the deadline forward.
+        """
+        with self._lock:
+            if self.deadline is not None and (deadline is None or deadline > self.deadline):
+                self.deadline = deadline
+
+    def child(self, timeout: float = None) -> "CancelToken":
+        """A token that fires when this one does, with an optional tighter deadline.
+
+        Call release() on the child once its call has finished, so a
+        long-lived parent does not keep a callback (and timer) per call.
+        """
+        token = CancelToken(timeout)
+        if self.deadline is not None and (token.deadline is None or self.deadline < token.deadline):
+            token.deadline = self.deadline
+        token._detach = self.on_cancel(token.cancel)
+        return token
+
+    def release(self):
+        """Detach this token from its parent; a no-op for a token made without child()."""
+        with self._lock:
+            detach, self._detach = self._detach, None
+        if detach is not None:
+            detach()
+
+    def wait_future(self, future: Future):
+        """Wait for a future's result, giving up as soon as the token fires.
+
+        Giving up does not cancel the future itself.
+        """
+        done = threading.Event()
+        future.add_done_callback(lambda _: done.set())
+        unregister = self.on_cancel(done.set)
+        try:
+            done.wait(self.remaining())
+        finally:
+            unregister()
+        if not future.done():
+            self.check()
+            raise DeadlineExceeded("Generation deadline exceeded")
+        return future.result()
@@ -0,0 +1,260 @@
+import json
+import gzip
+import time
+import asyncio
+import hashlib
+import logging
+import threading
+from pathlib import Path
+from typing import Optional, Dict, Any, List, Iterator
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from core.cache import GenerationCache
+from core.cancel import CancelToken
+from core.settings import CASSETTE_MODE, CASSETTE_DIR, CASSETTE_REPLAY_LATENCY
+
+logger = logging.getLogger(__name__)
+
+OFF = "off"
+RECORD = "record"
+REPLAY = "replay"
+
+# Request headers and query parameters that carry credentials
+REDACTED_HEADERS = {"authorization", "x-api-key", "x-goog-api-key"}
+REDACTED_PARAMS = {"key", "api_key"}
+REDACTED = "REDACTED"
+
+# Response headers worth keeping; everything else is dropped from the cassette
+RECORDED_HEADERS = ("Content-Type", "Retry-After")
+
+
+def redact_url(url: str) -> str:
+    """The URL with credentials in the query string replaced."""
+    parts = urlsplit(url)
+    query = [(name, REDACTED if name.lower() in REDACTED_PARAMS else value)
+             for name, value in parse_qsl(parts.query, keep_blank_values=True)]
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+def redact_headers(headers: Dict[str, str]) -> Dict[str, str]:
+    """The request headers with credentials replaced."""
+    return {name: REDACTED if name.lower() in REDACTED_HEADERS else value
+            for name, value in (headers or {}).items()}
+
+
+class ReplayResponse:
+    """In-memory stand-in for the parts of requests.Response that APIClient uses."""
+
+    def __init__(self, status_code: int, headers: Dict[str, str], content: bytes):
+        self.status_code = status_code
+        self.headers = CaseInsensitiveDict(headers)
+        self.headers["Content-Length"] = str(len(content))
+        self.content = content
+
+    @property
+    def text(self) -> str:
+        return self.content.decode("utf-8", errors="replace")
+
+    def json(self) -> Any:
+        return json.loads(self.content)
+
+    def iter_content(self, chunk_size: int = 1) -> Iterator[bytes]:
+        for start in range(0, len(self.content), chunk_size):
+            yield self.content[start:start + chunk_size]
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class Cassette:
+    """On-disk store of provider request/response pairs for deterministic replay.
+
+    cassette.jsonl holds one line per recorded interaction: the redacted request,
+    the response status, headers and latency, and the hash of the body. Bodies
+    are stored gzip-compressed under bodies/, once per distinct body.
+
+    Interactions are matched by the same request hash as the generation cache.
+    Several recordings of one request (e.g. a 429 followed by a 200) replay in
+    order; once they run out, the last one is repeated.
+    """
+
+    def __init__(self, cassette_dir: Path = CASSETTE_DIR, mode: str = REPLAY,
+                 replay_latency: bool = CASSETTE_REPLAY_LATENCY):
+        if mode not in (RECORD, REPLAY):
+            raise ValueError(f"Unknown cassette mode: {mode}")
+        self.cassette_dir = Path(cassette_dir)
+        self.mode = mode
+        self.replay_latency = replay_latency
+        self._index_path = self.cassette_dir / "cassette.jsonl"
+        self._bodies_dir = self.cassette_dir / "bodies"
+        self._interactions: Dict[str, List[Dict[str, Any]]] = {}
+        self._cursors: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+        self._bodies_dir.mkdir(parents=True, exist_ok=True)
+        self._load_index()
+
+    def _load_index(self):
+        if not self._index_path.exists():
+            return
+        count = 0
+        with open(self._index_path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                interaction = json.loads(line)
+                self._interactions.setdefault(interaction["key"], []).append(interaction)
+                count += 1
+        logger.info(f"Loaded cassette {self.cassette_dir}: {count} interactions")
+
+    @staticmethod
+    def make_key(provider: str, url: str, payload: Dict[str, Any]) -> str:
+        return GenerationCache.make_key(provider, url, payload)
+
+    def post(self,
+             session: requests.Session,
+             provider: str,
+             url: str,
+             headers: Dict[str, str],
+             payload: Dict[str, Any],
+             timeout: float) -> ReplayResponse:
+        """Send one request and record the response (record mode).
+
+        The whole body is read before returning, so the recorded latency covers the download.
+        """
+        key = self.make_key(provider, url, payload)
+        started = time.monotonic()
+        response = session.post(url, headers=headers, json=payload, timeout=timeout)
+        with response:
+            content = response.content
+        latency = time.monotonic() - started
+
+        recorded_headers = {name: response.headers[name]
+                            for name in RECORDED_HEADERS if name in response.headers}
+        self.record(key, provider, url, headers, payload,
+                    response.status_code, recorded_headers, content, latency)
+        return ReplayResponse(response.status_code, recorded_headers, content)
+
+    async def post_async(self,
+                         http,
+                         provider: str,
+                         url: str,
+                         headers: Dict[str, str],
+                         payload: Dict[str, Any]) -> ReplayResponse:
+        """Asyncio version of post(), sending the request with an httpx.AsyncClient."""
+        key = self.make_key(provider, url, payload)
+        started = time.monotonic()
+        response = await http.post(url, headers=headers, json=payload)
+        latency = time.monotonic() - started
+
+        recorded_headers = {name: response.headers[name]
+                            for name in RECORDED_HEADERS if name in response.headers}
+        self.record(key, provider, url, headers, payload,
+                    response.status_code, recorded_headers, response.content, latency)
+        return ReplayResponse(response.status_code, recorded_headers, response.content)
+
+    def record(self, key: str, provider: str, url: str, headers: Dict[str, str],
+               payload: Dict[str, Any], status_code: int, response_headers: Dict[str, str],
+               content: bytes, latency: float):
+        """Append one interaction to the cassette."""
+        body_hash = hashlib.sha256(content).hexdigest()
+        body_path = self._bodies_dir / f"{body_hash}.gz"
+        if not body_path.exists():
+            tmp_path = body_path.with_name(f"{body_hash}.{threading.get_ident()}.tmp")
+            with gzip.open(tmp_path, "wb", compresslevel=6) as f:
+                f.write(content)
+            tmp_path.replace(body_path)
+
+        interaction = {
+            "key": key,
+            "provider": provider,
+            "request": {
+                "url": redact_url(url),
+                "headers": redact_headers(headers),
+                "payload": payload,
+            },
+            "status_code": status_code,
+            "headers": response_headers,
+            "latency": round(latency, 4),
+            "body": body_hash,
+            "size": len(content),
+        }
+        with self._lock:
+            with open(self._index_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(interaction, separators=(",", ":")) + "\n")
+            self._interactions.setdefault(key, []).append(interaction)
+        logger.debug(f"Recorded {provider} response {status_code} ({len(content)} bytes, {latency:.2f}s)")
+
+    def _next_interaction(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            interactions = self._interactions.get(key)
+            if not interactions:
+                return None
+            cursor = self._cursors.get(key, 0)
+            self._cursors[key] = cursor + 1
+            return interactions[min(cursor, len(interactions) - 1)]
+
+    def _response(self, interaction: Dict[str, Any]) -> ReplayResponse:
+        with gzip.open(self._bodies_dir / f"{interaction['body']}.gz", "rb") as f:
+            content = f.read()
+        return ReplayResponse(interaction["status_code"], interaction["headers"], content)
+
+    def replay(self, key: str, cancel_token: CancelToken = None) -> Optional[ReplayResponse]:
+        """Serve the next recorded response for a request, or None if there is none."""
+        interaction = self._next_interaction(key)
+        if interaction is None:
+            return None
+        response = self._response(interaction)
+
+        if self.replay_latency and interaction["latency"] > 0:
+            if cancel_token is not None:
+                cancel_token.sleep(interaction["latency"])
+            else:
+                time.sleep(interaction["latency"])
+
+        return response
+
+    async def replay_async(self, key: str) -> Optional[ReplayResponse]:
+        """Asyncio version of replay(); the recorded latency is awaited, not slept."""
+        interaction = self._next_interaction(key)
+        if interaction is None:
+            return None
+        response = self._response(interaction)
+
+        if self.replay_latency and interaction["latency"] > 0:
+            await asyncio.sleep(interaction["latency"])
+
+        return response
+
+    def stats(self) -> Dict[str, int]:
+        """Number of distinct requests and interactions in the cassette."""
+        with self._lock:
+            return {
+                "requests": len(self._interactions),
+                "interactions": sum(len(i) for i in self._interactions.values()),
+            }
+
+
+_cassette: Optional[Cassette] = None
+_cassette_lock = threading.Lock()
+
+
+def get_cassette() -> Optional[Cassette]:
+    """Get the process-wide cassette, or None when cassette_mode is off."""
+    global _cassette
+    if CASSETTE_MODE == OFF:
+        return None
+    with _cassette_lock:
+        if _cassette is None:
+            _cassette = Cassette(CASSETTE_DIR, CASSETTE_MODE)
+            logger.info(f"Provider traffic {CASSETTE_MODE} mode, cassette: {CASSETTE_DIR}")
+        return _cassette
@@ -1,32 +1,220 @@
 import os
+import re
+import json
+import zlib
+import heapq
+import time
+import queue
 import sqlite3
 import logging
-from typing import List, Dict, Any, Optional
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import List, Dict, Any, Iterable, Iterator, Optional, Set, Tuple, Union
 from datetime import datetime
 
-from core.settings import DB_PATH
+from core.settings import (
+    DB_PATH, GENERATED_IMAGES_DIR, HISTORY_BATCH_SIZE, HISTORY_FLUSH_SECONDS,
+    DB_POOL_SIZE, DB_BUSY_TIMEOUT, DB_SYNCHRONOUS, DB_CACHE_SIZE_KB, DB_MMAP_SIZE, DB_OPTIMIZE_INTERVAL
+)
 
 logger = logging.getLogger(__name__)
 
-class Database:
-    """Database wrapper for storing image history."""
+# Marks the matched words in search_images() snippets
+SNIPPET_MARKERS = ("[", "]")
+
+
+def history_row(prompt: str, filepath: str, provider: str = "unknown", width: int = None,
+                height: int = None, metadata: Dict[str, Any] = None) -> Dict[str, Any]:
+    """Build an images row for add_images(); metadata is stored as JSON in extra_data."""
+    return {
+        "prompt": prompt,
+        "filename": os.path.basename(filepath),
+        "filepath": str(filepath),
+        "provider": provider,
+        "width": width,
+        "height": height,
+        "extra_data": json.dumps(metadata, ensure_ascii=False) if metadata else None,
+    }
+
+
+# MinHash signature of a prompt: the lowest trigram hash in each of MINHASH_BINS bins,
+# grouped into bands of MINHASH_ROWS_PER_BAND. Prompts sharing any band are candidates
+# for similar_prompts(); 16 bands of 2 find most prompts with a Jaccard similarity
+# above ~0.3 while a lookup stays a handful of index probes.
+MINHASH_BINS = 32
+MINHASH_ROWS_PER_BAND = 2
+_HASH_MASK = 0x7FFFFFFF
+
+
+def _prompt_key(prompt: str) -> str:
+    """Prompt reduced to lowercase words, so case, spacing and punctuation don't matter."""
+    return " ".join(re.findall(r"\w+", prompt.lower()))
+
+
+def _trigrams(key: str) -> Set[int]:
+    """Stable 31-bit hashes of the character trigrams of a prompt key."""
+    padded = f"  {key} ".encode("utf-8")
+    return {zlib.crc32(padded[i:i + 3]) & _HASH_MASK for i in range(len(padded) - 2)}
+
+
+def _minhash_bands(trigrams: Set[int]) -> List[Tuple[int, int]]:
+    """(band, band hash) pairs of a one-permutation MinHash signature."""
+    if not trigrams:
+        return []
+    signature = [None] * MINHASH_BINS
+    for value in trigrams:
+        slot = value % MINHASH_BINS
+        if signature[slot] is None or value < signature[slot]:
+            signature[slot] = value
+    # Densify: an empty bin copies the next filled one (wrapping around), mixed with the distance
+    filled = list(signature)
+    for i in range(MINHASH_BINS):
+        if signature[i] is None:
+            for distance in range(1, MINHASH_BINS):
+                borrowed = signature[(i + distance) % MINHASH_BINS]
+                if borrowed is not None:
+                    filled[i] = (borrowed * 1000003 + distance) & _HASH_MASK
+                    break
+    bands = []
+    for band, start in enumerate(range(0, MINHASH_BINS, MINHASH_ROWS_PER_BAND)):
+        key = 0
+        for value in filled[start:start + MINHASH_ROWS_PER_BAND]:
+            key = (key << 31 | value) & 0x7FFFFFFFFFFFFFFF  # Fits an SQLite INTEGER
+        bands.append((band, key))
+    return bands
+
+
+def _similarity(a: Set[int], b: Set[int]) -> float:
+    shared = len(a & b)
+    return shared / (len(a) + len(b) - shared) if a or b else 0.0
+
+
+class ConnectionPool:
+    """Reusable SQLite connections to one database file.
     
-    def __init__(self, db_path=DB_PATH):
-        self.db_path = db_path
-        self._ensure_db_exists()
-        logger.info(f"Database initialized at {db_path}")
+    Connections are opened once in WAL mode with tuned pragmas and returned
+    to the pool after use, so a query does not pay for connect and setup.
+    Any thread may use any pooled connection, but only one at a time.
+    PRAGMA optimize runs every DB_OPTIMIZE_INTERVAL seconds and when the
+    pool is closed.
+    """
     
-    def _ensure_db_exists(self):
-        """Create database and tables if they don't exist."""
-        # Make sure directory exists
-        if not os.path.exists(os.path.dirname(self.db_path)):
-            os.makedirs(os.path.dirname(self.db_path))
-        
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Create history table if it doesn't exist
-        cursor.execute('''
+    def __init__(self, db_path: Union[str, Path], size: int = DB_POOL_SIZE,
+                 optimize_interval: float = DB_OPTIMIZE_INTERVAL):
+        self.db_path = str(db_path)
+        self.size = max(1, size)
+        self.optimize_interval = optimize_interval
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._last_optimize = time.monotonic()
+        # Set by _migrate(): whether the FTS5 prompt index exists and is kept in sync
+        self.full_text_search = False
+    
+    def _open(self) -> sqlite3.Connection:
+        # Autocommit mode: transactions are begun explicitly by transaction()
+        conn = sqlite3.connect(self.db_path, timeout=DB_BUSY_TIMEOUT, isolation_level=None,
+                               check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA synchronous={DB_SYNCHRONOUS}")
+        conn.execute(f"PRAGMA cache_size=-{int(DB_CACHE_SIZE_KB)}")
+        conn.execute(f"PRAGMA mmap_size={int(DB_MMAP_SIZE)}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA foreign_keys=ON")
+        return conn
+    
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """Borrow a connection for reads (or for managing a transaction yourself)."""
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = self._open()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()  # Never hand out a connection with a dangling transaction
+            if self._idle.qsize() < self.size:
+                self._idle.put(conn)
+            else:
+                conn.close()
+        self._maybe_optimize()
+    
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """Borrow a connection inside a write transaction, committed when the block succeeds."""
+        with self.connection() as conn:
+            # IMMEDIATE takes the write lock up front, so concurrent writers wait
+            # (busy timeout) instead of failing when they upgrade a read lock
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.rollback()
+                raise
+            conn.commit()
+    
+    def _maybe_optimize(self):
+        if self.optimize_interval is None:
+            return
+        with self._lock:
+            if time.monotonic() - self._last_optimize < self.optimize_interval:
+                return
+            self._last_optimize = time.monotonic()
+        self.optimize()
+    
+    def optimize(self):
+        """Refresh query planner statistics where SQLite thinks they are stale."""
+        try:
+            with self.connection() as conn:
+                conn.execute("PRAGMA analysis_limit=1000")  # Bound the cost on a large history
+                conn.execute("PRAGMA optimize")
+        except sqlite3.Error as e:
+            logger.warning(f"PRAGMA optimize failed: {str(e)}")
+    
+    def close(self):
+        """Optimize and close every idle connection."""
+        self.optimize_interval = None
+        self.optimize()
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+_pools: Dict[str, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_path: Union[str, Path] = DB_PATH) -> ConnectionPool:
+    """Connection pool of a database file, creating the file and its schema on first use."""
+    key = os.path.abspath(str(db_path))
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = ConnectionPool(key)
+            _migrate(pool)
+            _pools[key] = pool
+        return pool
+
+
+def close_pools():
+    """Close every connection pool (on application exit)."""
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
+
+
+# Versioned schema changes, applied in order to databases whose PRAGMA user_version is
+# lower. Never edit a released migration; append a new one.
+SCHEMA_MIGRATIONS = [
+    (1, "images table", [
+        '''
         CREATE TABLE IF NOT EXISTS images (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             prompt TEXT NOT NULL,
@@ -38,105 +226,700 @@ class Database:
             height INTEGER,
             extra_data TEXT
         )
-        ''')
-        
-        conn.commit()
-        conn.close()
+        ''',
+    ]),
+    (2, "history indexes", [
+        # created_at is stored as "YYYY-MM-DD HH:MM:SS", which sorts chronologically;
+        # id breaks ties within a second and makes (created_at, id) a unique page key
+        "CREATE INDEX IF NOT EXISTS idx_images_created_at ON images (created_at, id)",
+        "CREATE INDEX IF NOT EXISTS idx_images_provider ON images (provider, created_at, id)",
+        "CREATE INDEX IF NOT EXISTS idx_images_dimensions ON images (width, height)",
+    ]),
+    (3, "similar prompt index", [
+        # Each distinct normalized prompt once, with the MinHash band hashes of its
+        # trigrams; images point at their prompt. Written by add_images()
+        "CREATE TABLE IF NOT EXISTS prompts (id INTEGER PRIMARY KEY, key TEXT NOT NULL UNIQUE)",
+        '''
+        CREATE TABLE IF NOT EXISTS prompt_minhash (
+            band INTEGER NOT NULL,
+            hash INTEGER NOT NULL,
+            prompt_id INTEGER NOT NULL,
+            PRIMARY KEY (band, hash, prompt_id)
+        ) WITHOUT ROWID
+        ''',
+        "CREATE INDEX IF NOT EXISTS idx_prompt_minhash_prompt ON prompt_minhash (prompt_id)",
+        "ALTER TABLE images ADD COLUMN prompt_id INTEGER",
+        "CREATE INDEX IF NOT EXISTS idx_images_prompt ON images (prompt_id, id)",
+        # A prompt leaves the index with the last image that used it
+        '''
+        CREATE TRIGGER IF NOT EXISTS prompts_delete AFTER DELETE ON images
+        WHEN old.prompt_id IS NOT NULL
+            AND NOT EXISTS (SELECT 1 FROM images WHERE prompt_id = old.prompt_id)
+        BEGIN
+            DELETE FROM prompt_minhash WHERE prompt_id = old.prompt_id;
+            DELETE FROM prompts WHERE id = old.prompt_id;
+        END
+        ''',
+        lambda conn: _index_prompts(conn, conn.execute("SELECT id, prompt FROM images").fetchall()),
+    ]),
+    # Completes recording every generation: files the Generate tab saved before it
+    # wrote history rows are added once, so the History tab keeps showing them
+    (4, "import earlier generated images", [
+        lambda conn: _import_generated_images(conn, GENERATED_IMAGES_DIR),
+    ]),
+]
+
+SCHEMA_VERSION = SCHEMA_MIGRATIONS[-1][0]
+
+
+def _index_prompts(conn: sqlite3.Connection, rows: Iterable[Tuple[int, str]]):
+    """Link (image id, prompt) rows to the similar prompt index, adding prompts not seen before.
     
-    def add_image(self, prompt: str, filename: str, filepath: str, provider: str = "unknown",
-                width: int = None, height: int = None, extra_data: str = None) -> int:
-        """Add a new image to the database."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
+    Only a new distinct prompt costs a MinHash signature; repeats just get its id.
+    """
+    prompt_ids: Dict[str, int] = {}
+    links = []
+    for image_id, prompt in rows:
+        key = _prompt_key(prompt)
+        if not key:
+            continue
+        prompt_id = prompt_ids.get(key)
+        if prompt_id is None:
+            row = conn.execute("SELECT id FROM prompts WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                prompt_id = row[0]
+            else:
+                prompt_id = conn.execute("INSERT INTO prompts (key) VALUES (?)", (key,)).lastrowid
+                conn.executemany(
+                    "INSERT INTO prompt_minhash (band, hash, prompt_id) VALUES (?, ?, ?)",
+                    [(band, value, prompt_id) for band, value in _minhash_bands(_trigrams(key))]
+                )
+            prompt_ids[key] = prompt_id
+        links.append((prompt_id, image_id))
+    conn.executemany("UPDATE images SET prompt_id = ? WHERE id = ?", links)
+
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp")
+
+
+def _prompt_from_filename(name: str) -> Tuple[str, Optional[int], Optional[int]]:
+    """Best guess of (prompt, width, height) from the name of a saved image."""
+    stem = os.path.splitext(name)[0]
+    width = height = None
+    # Current names: [00001_]prompt_YYYYmmdd_HHMMSS_<8 hex>[_sample]
+    match = re.fullmatch(r"(?:\d{5}_)?(.*?)_\d{8}_\d{6}_[0-9a-f]{8}(?:_\d+)?", stem)
+    if match:
+        stem = match.group(1)
+    else:
+        # Older Generate tab names: prompt_WIDTHxHEIGHT or prompt_<unix time>
+        match = re.fullmatch(r"(.*?)_(\d+)x(\d+)", stem)
+        if match:
+            stem, width, height = match.group(1), int(match.group(2)), int(match.group(3))
+        else:
+            stem = re.sub(r"_\d{9,}$", "", stem)
+    return stem.replace("_", " ").strip() or name, width, height
+
+
+def _import_generated_images(conn: sqlite3.Connection, directory: Path):
+    """Add image files the Generate tab saved before it recorded history.
+    
+    Only the main history database imports them, so a scratch database
+    (tests, batch runs with their own file) stays empty.
+    """
+    main_file = conn.execute("PRAGMA database_list").fetchone()[2]
+    if not main_file or os.path.realpath(main_file) != os.path.realpath(DB_PATH):
+        return
+    if not os.path.isdir(directory):
+        return
+    
+    recorded = {os.path.normcase(os.path.realpath(row[0]))
+                for row in conn.execute("SELECT filepath FROM images")}
+    imported = []
+    for entry in sorted(os.scandir(directory), key=lambda e: e.stat().st_mtime):
+        if not entry.is_file() or not entry.name.lower().endswith(IMAGE_EXTENSIONS):
+            continue
+        if os.path.normcase(os.path.realpath(entry.path)) in recorded:
+            continue
+        prompt, width, height = _prompt_from_filename(entry.name)
+        cursor = conn.execute('''
         INSERT INTO images (prompt, filename, filepath, provider, created_at, width, height, extra_data)
         VALUES (?, ?, ?, ?, ?, ?, ?, ?)
         ''', (
-            prompt, 
-            filename, 
-            filepath, 
-            provider, 
-            datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            prompt,
+            entry.name,
+            os.path.abspath(entry.path),
+            "unknown",
+            datetime.fromtimestamp(entry.stat().st_mtime).strftime("%Y-%m-%d %H:%M:%S"),
             width,
             height,
-            extra_data
+            json.dumps({"source": "imported_file"})
         ))
+        imported.append((cursor.lastrowid, prompt))
+    _index_prompts(conn, imported)
+    if imported:
+        logger.info(f"Imported {len(imported)} earlier images from {directory} into the history")
+
+
+# Full-text index of prompts. It is created outside SCHEMA_MIGRATIONS because SQLite
+# may be built without FTS5; triggers keep it in sync with the images table.
+PROMPT_INDEX_TRIGGERS = {
+    "images_fts_insert": '''
+        CREATE TRIGGER images_fts_insert AFTER INSERT ON images BEGIN
+            INSERT INTO images_fts (rowid, prompt) VALUES (new.id, new.prompt);
+        END
+    ''',
+    "images_fts_delete": '''
+        CREATE TRIGGER images_fts_delete AFTER DELETE ON images BEGIN
+            INSERT INTO images_fts (images_fts, rowid, prompt) VALUES ('delete', old.id, old.prompt);
+        END
+    ''',
+    "images_fts_update": '''
+        CREATE TRIGGER images_fts_update AFTER UPDATE OF prompt ON images BEGIN
+            INSERT INTO images_fts (images_fts, rowid, prompt) VALUES ('delete', old.id, old.prompt);
+            INSERT INTO images_fts (rowid, prompt) VALUES (new.id, new.prompt);
+        END
+    ''',
+}
+
+
+def _fts5_available(conn: sqlite3.Connection) -> bool:
+    try:
+        conn.execute("CREATE VIRTUAL TABLE temp.fts5_probe USING fts5(text)")
+        conn.execute("DROP TABLE temp.fts5_probe")
+        return True
+    except sqlite3.OperationalError:
+        return False
+
+
+def _ensure_prompt_index(conn: sqlite3.Connection) -> bool:
+    """Create the FTS5 prompt index and its triggers; returns whether it is usable.
+    
+    Without FTS5 the triggers are dropped, since they would make every insert
+    fail; a SQLite with FTS5 recreates them and rebuilds the index later.
+    """
+    triggers = {row[0] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'images_fts_%'"
+    )}
+    if not _fts5_available(conn):
+        for name in triggers:
+            conn.execute(f"DROP TRIGGER {name}")
+        logger.warning("SQLite is built without FTS5, prompt search falls back to LIKE")
+        return False
+    
+    if triggers != set(PROMPT_INDEX_TRIGGERS):
+        logger.info("Building full-text prompt index")
+        # remove_diacritics lets "anh" also find "ảnh"
+        conn.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS images_fts USING fts5(
+                prompt, content='images', content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2'
+            )
+        ''')
+        for name, statement in PROMPT_INDEX_TRIGGERS.items():
+            conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+            conn.execute(statement)
+        conn.execute("INSERT INTO images_fts (images_fts) VALUES ('rebuild')")
+    return True
+
+
+def _migrate(pool: ConnectionPool):
+    """Create the database file and bring its schema up to SCHEMA_VERSION."""
+    # Make sure directory exists
+    directory = os.path.dirname(pool.db_path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    
+    migrated = False
+    with pool.transaction() as conn:
+        # Checked inside the write transaction, so two processes never apply a step twice
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        for step, description, statements in SCHEMA_MIGRATIONS:
+            if step <= version:
+                continue
+            logger.info(f"Migrating {pool.db_path} to schema version {step}: {description}")
+            for statement in statements:
+                if callable(statement):
+                    statement(conn)  # Data migration written in Python
+                else:
+                    conn.execute(statement)
+            conn.execute(f"PRAGMA user_version = {step}")
+            migrated = True
+        pool.full_text_search = _ensure_prompt_index(conn)
+    
+    # Collect planner statistics for a database that has never been analyzed or just changed
+    with pool.connection() as conn:
+        analyzed = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'"
+        ).fetchone()
+        if migrated or not analyzed:
+            conn.execute("PRAGMA analysis_limit=1000")
+            conn.execute("ANALYZE")
+
+
+def _search_terms(search_term: str) -> List[Tuple[str, bool]]:
+    """Split a search into (text, is_prefix) terms: "quoted phrases", words and word* prefixes."""
+    terms = []
+    for phrase, word in re.findall(r'"([^"]*)"|(\S+)', search_term):
+        text = phrase if phrase else word.rstrip("*")
+        if any(c.isalnum() for c in text):
+            terms.append((text.strip(), bool(word) and word.endswith("*")))
+    return terms
+
+
+def _fts_query(terms: List[Tuple[str, bool]]) -> str:
+    """FTS5 MATCH expression requiring every term; quoting keeps user input literal."""
+    quoted = []
+    for text, prefix in terms:
+        phrase = '"' + text.replace('"', '""') + '"'
+        quoted.append(phrase + "*" if prefix else phrase)
+    return " AND ".join(quoted)
+
+
+class Database:
+    """Database wrapper for storing image history.
+    
+    All Database objects for the same file share one connection pool, and
+    the schema is only checked the first time the file is opened. Inside a
+    batch() block every call made by the same thread shares one transaction.
+    """
+    
+    # Ids per statement for IN (...) lists, below SQLite's bound-variable limit
+    CHUNK_SIZE = 500
+    
+    def __init__(self, db_path=DB_PATH):
+        self.db_path = db_path
+        self.pool = get_pool(db_path)
+        self._local = threading.local()
+        logger.debug(f"Database initialized at {db_path}")
+    
+    @contextmanager
+    def batch(self) -> Iterator["Database"]:
+        """Run every call this thread makes inside the block as one transaction.
         
-        # Get the ID of the inserted row
-        image_id = cursor.lastrowid
-        
-        conn.commit()
-        conn.close()
+        The transaction commits when the block exits normally and rolls back
+        if it raises. Nested batch() blocks join the outer transaction.
+        """
+        if getattr(self._local, "conn", None) is not None:
+            yield self
+            return
+        with self.pool.transaction() as conn:
+            self._local.conn = conn
+            try:
+                yield self
+            finally:
+                self._local.conn = None
+    
+    @contextmanager
+    def _write(self) -> Iterator[sqlite3.Connection]:
+        """Connection in a write transaction: the current batch's, or a new one."""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            yield conn
+        else:
+            with self.pool.transaction() as conn:
+                yield conn
+    
+    @contextmanager
+    def _read(self) -> Iterator[sqlite3.Connection]:
+        """Connection for a query; inside a batch it sees the batch's uncommitted writes."""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            yield conn
+        else:
+            with self.pool.connection() as conn:
+                yield conn
+    
+    def add_image(self, prompt: str, filename: str, filepath: str, provider: str = "unknown",
+                width: int = None, height: int = None, extra_data: str = None) -> int:
+        """Add a new image to the database."""
+        with self._write() as conn:
+            cursor = conn.execute('''
+            INSERT INTO images (prompt, filename, filepath, provider, created_at, width, height, extra_data)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (
+                prompt, 
+                filename, 
+                filepath, 
+                provider, 
+                datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                width,
+                height,
+                extra_data
+            ))
+            
+            # Get the ID of the inserted row
+            image_id = cursor.lastrowid
+            _index_prompts(conn, [(image_id, prompt)])
         
         logger.debug(f"Added image to database with ID {image_id}")
         return image_id
     
+    def add_images(self, rows: List[Dict[str, Any]]) -> List[int]:
+        """Add several images in one transaction and return their ids, in order.
+        
+        Rows are dicts with prompt, filename, filepath and optionally provider,
+        width, height, extra_data and created_at (see history_row()).
+        """
+        if not rows:
+            return []
+        created_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        with self._write() as conn:
+            conn.executemany('''
+            INSERT INTO images (prompt, filename, filepath, provider, created_at, width, height, extra_data)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', [(
+                row["prompt"],
+                row["filename"],
+                row["filepath"],
+                row.get("provider", "unknown"),
+                row.get("created_at", created_at),
+                row.get("width"),
+                row.get("height"),
+                row.get("extra_data")
+            ) for row in rows])
+            # AUTOINCREMENT ids are consecutive while this transaction holds the write lock
+            last_id = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'images'").fetchone()[0]
+            image_ids = list(range(last_id - len(rows) + 1, last_id + 1))
+            _index_prompts(conn, zip(image_ids, (row["prompt"] for row in rows)))
+        
+        logger.debug(f"Added {len(image_ids)} images to database")
+        return image_ids
+    
     def get_all_images(self, limit: int = 50) -> List[Dict[str, Any]]:
         """Get all images from the database."""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
+        with self._read() as conn:
+            rows = conn.execute('''
+            SELECT * FROM images
+            ORDER BY created_at DESC, id DESC
+            LIMIT ?
+            ''', (limit,)).fetchall()
+        
+        return [dict(row) for row in rows]
+    
+    @staticmethod
+    def page_cursor(row: Dict[str, Any]) -> str:
+        """Opaque cursor pointing just after a row, for get_images_page(after=...)."""
+        return f"{row['created_at']}|{row['id']}"
+    
+    def get_images_page(self, after: str = None, page_size: int = 50,
+                        provider: str = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """One page of history, newest first, and the cursor of the next page (None at the end).
         
-        cursor.execute('''
-        SELECT * FROM images
-        ORDER BY created_at DESC
-        LIMIT ?
-        ''', (limit,))
+        Keyset pagination on the (created_at, id) index: every page costs the
+        same however deep into the history it is, unlike LIMIT/OFFSET.
+        """
+        conditions, params = [], []
+        if provider:
+            conditions.append("provider = ?")
+            params.append(provider)
+        if after:
+            created_at, _, image_id = after.rpartition("|")
+            if not created_at or not image_id.isdigit():
+                raise ValueError(f"Invalid page cursor: {after}")
+            conditions.append("(created_at, id) < (?, ?)")
+            params.extend([created_at, int(image_id)])
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
         
-        rows = cursor.fetchall()
-        results = [dict(row) for row in rows]
+        with self._read() as conn:
+            rows = conn.execute(f'''
+            SELECT * FROM images
+            {where}
+            ORDER BY created_at DESC, id DESC
+            LIMIT ?
+            ''', params + [page_size + 1]).fetchall()
         
-        conn.close()
-        return results
+        rows = [dict(row) for row in rows]
+        if len(rows) > page_size:
+            rows = rows[:page_size]
+            return rows, self.page_cursor(rows[-1])
+        return rows, None
+    
+    def iter_images(self, after: str = None, page_size: int = 500,
+                    provider: str = None) -> Iterator[Dict[str, Any]]:
+        """Every image (after the cursor), newest first, fetched one page at a time."""
+        while True:
+            rows, after = self.get_images_page(after, page_size, provider)
+            yield from rows
+            if after is None:
+                return
     
     def search_images(self, search_term: str, limit: int = 50) -> List[Dict[str, Any]]:
-        """Search for images matching the search term."""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
+        """Search prompts, best matches first.
         
-        # Search in prompt field
-        cursor.execute('''
-        SELECT * FROM images
-        WHERE prompt LIKE ?
-        ORDER BY created_at DESC
-        LIMIT ?
-        ''', (f'%{search_term}%', limit))
+        Every word must match; "quoted text" matches a phrase and word* a prefix.
+        Each result has a "snippet" of its prompt with the matches between
+        SNIPPET_MARKERS. Uses the FTS5 index, or LIKE when SQLite lacks FTS5.
+        """
+        terms = _search_terms(search_term)
+        if not terms:
+            return []
+        if self.pool.full_text_search:
+            try:
+                return self._search_full_text(terms, limit)
+            except sqlite3.OperationalError as e:
+                logger.error(f"Full-text search failed, using LIKE: {str(e)}")
+        return self._search_like(terms, limit)
+    
+    def _search_full_text(self, terms: List[Tuple[str, bool]], limit: int) -> List[Dict[str, Any]]:
+        start, end = SNIPPET_MARKERS
+        with self._read() as conn:
+            rows = conn.execute('''
+            SELECT images.*, snippet(images_fts, 0, ?, ?, '...', 16) AS snippet
+            FROM images_fts
+            JOIN images ON images.id = images_fts.rowid
+            WHERE images_fts MATCH ?
+            ORDER BY images_fts.rank, images.id DESC
+            LIMIT ?
+            ''', (start, end, _fts_query(terms), limit)).fetchall()
         
-        rows = cursor.fetchall()
-        results = [dict(row) for row in rows]
+        return [dict(row) for row in rows]
+    
+    def _search_like(self, terms: List[Tuple[str, bool]], limit: int) -> List[Dict[str, Any]]:
+        conditions = " AND ".join("prompt LIKE ? ESCAPE '\\'" for _ in terms)
+        patterns = [
+            "%" + text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+            for text, _ in terms
+        ]
+        with self._read() as conn:
+            rows = conn.execute(f'''
+            SELECT *, prompt AS snippet FROM images
+            WHERE {conditions}
+            ORDER BY created_at DESC, id DESC
+            LIMIT ?
+            ''', patterns + [limit]).fetchall()
         
-        conn.close()
-        return results
+        return [dict(row) for row in rows]
     
     def get_image(self, image_id: int) -> Optional[Dict[str, Any]]:
         """Get an image by ID."""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT * FROM images WHERE id = ?', (image_id,))
-        row = cursor.fetchone()
-        
-        conn.close()
+        with self._read() as conn:
+            row = conn.execute('SELECT * FROM images WHERE id = ?', (image_id,)).fetchone()
         
         if row:
             return dict(row)
         return None
     
+    def similar_prompts(self, prompt: str, k: int = 5, min_similarity: float = 0.3,
+                        candidates: int = 50) -> List[Dict[str, Any]]:
+        """Earlier images whose prompts are most similar to prompt, best first.
+        
+        Similarity is the Jaccard index of the prompts' character trigrams
+        (1.0 for the same words); only the newest image of each distinct prompt
+        is returned, with its score in "similarity". The MinHash band index
+        narrows the search to at most `candidates` distinct prompts sharing a band.
+        """
+        trigrams = _trigrams(_prompt_key(prompt))
+        bands = _minhash_bands(trigrams)
+        if not bands:
+            return []
+        
+        values = ", ".join(["(?, ?)"] * len(bands))
+        params = [value for pair in bands for value in pair]
+        with self._read() as conn:
+            matches = conn.execute(f'''
+            SELECT prompts.key,
+                   (SELECT MAX(id) FROM images WHERE images.prompt_id = matches.prompt_id) AS image_id
+            FROM (
+                SELECT prompt_id, COUNT(*) AS shared_bands
+                FROM (VALUES {values}) AS probe
+                CROSS JOIN prompt_minhash  -- Probe the primary key once per band
+                    ON prompt_minhash.band = probe.column1 AND prompt_minhash.hash = probe.column2
+                GROUP BY prompt_id
+                ORDER BY shared_bands DESC, prompt_id DESC
+                LIMIT ?
+            ) AS matches
+            JOIN prompts ON prompts.id = matches.prompt_id
+            ''', params + [candidates]).fetchall()
+            
+            # Exact similarity of the candidate prompts
+            scored = []
+            for key, image_id in matches:
+                similarity = _similarity(trigrams, _trigrams(key))
+                if similarity >= min_similarity and image_id is not None:
+                    scored.append((similarity, image_id))
+            scored = heapq.nlargest(k, scored)
+            if not scored:
+                return []
+            
+            placeholders = ",".join("?" * len(scored))
+            rows = {row["id"]: dict(row) for row in conn.execute(
+                f"SELECT * FROM images WHERE id IN ({placeholders})", [image_id for _, image_id in scored]
+            )}
+        
+        return [{**rows[image_id], "similarity": round(similarity, 3)}
+                for similarity, image_id in scored if image_id in rows]
+    
     def delete_image(self, image_id: int) -> bool:
         """Delete an image from the database."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        with self._write() as conn:
+            cursor = conn.execute('DELETE FROM images WHERE id = ?', (image_id,))
+            
+            # Check if a row was affected
+            success = cursor.rowcount > 0
         
-        cursor.execute('DELETE FROM images WHERE id = ?', (image_id,))
+        logger.debug(f"Deleted image with ID {image_id}, success: {success}")
+        return success
+    
+    def delete_images(self, image_ids: List[int]) -> int:
+        """Delete several images in one transaction; returns how many rows were deleted."""
+        image_ids = list(image_ids)
+        deleted = 0
+        with self._write() as conn:
+            for start in range(0, len(image_ids), self.CHUNK_SIZE):
+                chunk = image_ids[start:start + self.CHUNK_SIZE]
+                placeholders = ",".join("?" * len(chunk))
+                cursor = conn.execute(f'DELETE FROM images WHERE id IN ({placeholders})', chunk)
+                deleted += cursor.rowcount
         
-        # Check if a row was affected
-        success = cursor.rowcount > 0
+        logger.debug(f"Deleted {deleted} of {len(image_ids)} images from database")
+        return deleted
+    
+    def update_metadata(self, rows: List[Dict[str, Any]]) -> int:
+        """Merge metadata into the extra_data JSON of several images in one transaction.
         
-        conn.commit()
-        conn.close()
+        Each row is {"id": ..., "metadata": {...}}; keys in metadata replace
+        existing keys, and a None value removes the key. Returns the number of
+        images updated.
+        """
+        updates = {row["id"]: row["metadata"] for row in rows}
+        image_ids = list(updates)
+        changed = []
+        with self._write() as conn:
+            for start in range(0, len(image_ids), self.CHUNK_SIZE):
+                chunk = image_ids[start:start + self.CHUNK_SIZE]
+                placeholders = ",".join("?" * len(chunk))
+                for image_id, extra_data in conn.execute(
+                        f'SELECT id, extra_data FROM images WHERE id IN ({placeholders})', chunk):
+                    try:
+                        metadata = json.loads(extra_data) if extra_data else {}
+                    except ValueError:
+                        metadata = {"extra_data": extra_data}  # Keep legacy free-form text
+                    if not isinstance(metadata, dict):
+                        metadata = {"extra_data": metadata}
+                    metadata.update(updates[image_id])
+                    metadata = {key: value for key, value in metadata.items() if value is not None}
+                    changed.append((json.dumps(metadata, ensure_ascii=False) if metadata else None, image_id))
+            conn.executemany('UPDATE images SET extra_data = ? WHERE id = ?', changed)
         
-        logger.debug(f"Deleted image with ID {image_id}, success: {success}")
-        return success 
\ No newline at end of file
+        logger.debug(f"Updated metadata of {len(changed)} images")
+        return len(changed)
+
+
+_database: Optional[Database] = None
+_database_lock = threading.Lock()
+
+
+def get_database() -> Database:
+    """Get the Database shared by the whole application (default history file)."""
+    global _database
+    with _database_lock:
+        if _database is None:
+            _database = Database()
+        return _database
+
+
+class HistoryRecorder:
+    """Queues history rows and inserts them in batches on a background thread.
+    
+    add() never waits for SQLite. Waiting rows are written with
+    Database.add_images (one transaction per batch) as soon as batch_size of
+    them are queued, or flush_interval seconds after the oldest was added.
+    """
+    
+    def __init__(self, db: Database = None, batch_size: int = HISTORY_BATCH_SIZE,
+                 flush_interval: float = HISTORY_FLUSH_SECONDS):
+        self.db = db or Database()
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        
+        self._pending: List[Dict[str, Any]] = []
+        self._oldest: Optional[float] = None  # When the oldest waiting row was added
+        self._writing = False
+        self._flush_requested = False
+        self._closed = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="history-recorder")
+        self._thread.daemon = True
+        self._thread.start()
+    
+    def add(self, rows: List[Dict[str, Any]]):
+        """Queue rows for insertion."""
+        if not rows:
+            return
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("History recorder is closed")
+            if not self._pending:
+                self._oldest = time.monotonic()
+            self._pending.extend(rows)
+            self._condition.notify_all()
+    
+    def flush(self):
+        """Write every queued row now and wait until they are committed."""
+        with self._condition:
+            self._flush_requested = True
+            self._condition.notify_all()
+            while (self._pending or self._writing) and self._thread.is_alive():
+                self._condition.wait()
+            self._flush_requested = False
+    
+    def close(self):
+        """Write the remaining rows and stop the background thread."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._thread.join()
+    
+    def _due(self) -> bool:
+        if not self._pending:
+            return False
+        if self._closed or self._flush_requested or len(self._pending) >= self.batch_size:
+            return True
+        return time.monotonic() - self._oldest >= self.flush_interval
+    
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._due():
+                    if self._closed:
+                        return
+                    timeout = None
+                    if self._pending:
+                        timeout = max(0.0, self.flush_interval - (time.monotonic() - self._oldest))
+                    self._condition.wait(timeout)
+                batch, self._pending = self._pending, []
+                self._oldest = None
+                self._writing = True
+            
+            try:
+                self.db.add_images(batch)
+            except Exception as e:
+                logger.error(f"Failed to record {len(batch)} images in history: {str(e)}")
+            
+            with self._condition:
+                self._writing = False
+                if not self._pending:
+                    self._flush_requested = False
+                self._condition.notify_all()
+
+
+_recorder: Optional[HistoryRecorder] = None
+_recorder_lock = threading.Lock()
+
+
+def get_history_recorder() -> HistoryRecorder:
+    """Get the process-wide history recorder for the default database."""
+    global _recorder
+    with _recorder_lock:
+        if _recorder is None:
+            _recorder = HistoryRecorder()
+        return _recorder
+
+
+def close_history_recorder():
+    """Commit queued history rows and stop the recorder, if it was used."""
+    global _recorder
+    with _recorder_lock:
+        recorder, _recorder = _recorder, None
+    if recorder is not None:
+        recorder.close()
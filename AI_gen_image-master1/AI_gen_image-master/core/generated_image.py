@@ -0,0 +1,137 @@
+import io
+import os
+import uuid
+import logging
+import threading
+from pathlib import Path
+from typing import Optional, Tuple, Union
+
+from PIL import Image
+
+from core.metrics import timed
+
+logger = logging.getLogger(__name__)
+
+# File extension for each encoded format we may receive from a provider
+FORMAT_EXTENSIONS = {
+    "PNG": ".png",
+    "JPEG": ".jpg",
+    "WEBP": ".webp",
+    "GIF": ".gif",
+}
+
+# Format implied by a file extension when saving
+EXTENSION_FORMATS = {
+    ".png": "PNG",
+    ".jpg": "JPEG",
+    ".jpeg": "JPEG",
+    ".webp": "WEBP",
+    ".gif": "GIF",
+}
+
+
+def extension_format(extension: str) -> str:
+    """Image format implied by a file extension, defaulting to PNG."""
+    return EXTENSION_FORMATS.get(extension.lower(), "PNG")
+
+
+def sniff_format(data: bytes) -> Optional[str]:
+    """Detect the image format from its magic bytes."""
+    if data.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "PNG"
+    if data.startswith(b"\xff\xd8\xff"):
+        return "JPEG"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "WEBP"
+    if data[:6] in (b"GIF87a", b"GIF89a"):
+        return "GIF"
+    return None
+
+
+def write_atomic(path: Union[str, Path], data: bytes):
+    """Write a file via a temporary file and a rename, so readers never see a partial image."""
+    path = Path(path)
+    temp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex[:8]}.tmp")
+    try:
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+class GeneratedImage:
+    """An image returned by a provider, kept in its original encoded form.
+
+    The PIL image is only opened when first needed, and save() writes the
+    provider's bytes straight to disk unless a different format is requested.
+    """
+
+    def __init__(self, data: bytes, mime_type: str = None, provider: str = None):
+        self.data = data
+        self.provider = provider
+        self.format = sniff_format(data)
+        if self.format is None and mime_type and mime_type.startswith("image/"):
+            self.format = mime_type.split("/", 1)[1].upper().replace("JPG", "JPEG")
+        self._image: Optional[Image.Image] = None
+        self._lock = threading.RLock()
+
+    @property
+    def image(self) -> Image.Image:
+        """Decoded PIL image (opened lazily)."""
+        with self._lock:
+            if self._image is None:
+                with timed("pil_open", self.provider):
+                    self._image = Image.open(io.BytesIO(self.data))
+            return self._image
+    
+    def loaded(self) -> Image.Image:
+        """Fully decoded PIL image; safe to use from several threads at once (read-only)."""
+        with self._lock:
+            image = self.image
+            image.load()
+            return image
+
+    @property
+    def size(self) -> Tuple[int, int]:
+        return self.image.size
+
+    @property
+    def width(self) -> int:
+        return self.image.width
+
+    @property
+    def height(self) -> int:
+        return self.image.height
+
+    @property
+    def extension(self) -> str:
+        """File extension matching the encoded bytes."""
+        return FORMAT_EXTENSIONS.get(self.format, ".png")
+
+    def save(self, path: Union[str, Path], format: str = None, **params):
+        """Save to disk, copying the original bytes when no transcoding is needed."""
+        path = Path(path)
+        target = (format or extension_format(path.suffix)).upper()
+
+        if target == self.format and not params:
+            data = self.data
+        else:
+            logger.debug(f"Transcoding {self.format} image to {target}")
+            image = self.loaded()
+            with timed("encode", self.provider):
+                if target == "JPEG" and image.mode not in ("RGB", "L"):
+                    image = image.convert("RGB")
+                buffer = io.BytesIO()
+                image.save(buffer, format=target, **params)
+                data = buffer.getvalue()
+
+        with timed("disk_write", self.provider):
+            write_atomic(path, data)
+
+    def __repr__(self):
+        return f"<GeneratedImage format={self.format} bytes={len(self.data)}>"
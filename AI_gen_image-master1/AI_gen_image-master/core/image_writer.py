@@ -0,0 +1,156 @@
+import io
+import uuid
+import logging
+import threading
+from datetime import datetime
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Union
+
+from PIL import Image
+
+from core.generated_image import GeneratedImage, FORMAT_EXTENSIONS, write_atomic
+from core.metrics import timed
+from core.settings import (
+    SAVE_FORMAT, PNG_COMPRESS_LEVEL, WEBP_LOSSLESS, WEBP_QUALITY, JPEG_QUALITY, IMAGE_WRITER_WORKERS
+)
+
+logger = logging.getLogger(__name__)
+
+AnyImage = Union[GeneratedImage, Image.Image]
+
+
+def output_format(image: AnyImage, save_format: str = None) -> str:
+    """Format an image is saved in under the save_format setting."""
+    save_format = (save_format or SAVE_FORMAT).upper().replace("JPG", "JPEG")
+    if save_format == "ORIGINAL":
+        if isinstance(image, GeneratedImage) and image.format in FORMAT_EXTENSIONS:
+            return image.format
+        return "PNG"
+    if save_format not in ("PNG", "WEBP", "JPEG"):
+        logger.warning(f"Unknown save_format {save_format}, saving as PNG")
+        return "PNG"
+    return save_format
+
+
+def output_extension(image: AnyImage, save_format: str = None) -> str:
+    """File extension matching output_format()."""
+    return FORMAT_EXTENSIONS[output_format(image, save_format)]
+
+
+def unique_filename(prompt: str, extension: str, prefix: str = "", index: int = None) -> str:
+    """Collision-free file name: prompt words, timestamp and a random suffix."""
+    clean_prompt = "".join(c if c.isalnum() else "_" for c in prompt[:30])
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    sample = f"_{index}" if index is not None else ""
+    return f"{prefix}{clean_prompt}_{timestamp}_{uuid.uuid4().hex[:8]}{sample}{extension}"
+
+
+def encode_params(format: str) -> Dict[str, Any]:
+    """PIL save options for a format, from the compression settings."""
+    if format == "PNG":
+        return {"compress_level": PNG_COMPRESS_LEVEL}
+    if format == "WEBP":
+        return {"lossless": WEBP_LOSSLESS, "quality": WEBP_QUALITY}
+    if format == "JPEG":
+        return {"quality": JPEG_QUALITY}
+    return {}
+
+
+def write_image(image: AnyImage, path: Union[str, Path], save_format: str = None) -> str:
+    """Encode an image in its output format and write it atomically; returns the path.
+
+    Provider images already in the output format are copied byte for byte.
+    """
+    path = Path(path)
+    target = output_format(image, save_format)
+
+    if isinstance(image, GeneratedImage):
+        if image.format == target:
+            image.save(path, format=target)
+        else:
+            image.save(path, format=target, **encode_params(target))
+    else:
+        with timed("encode"):
+            if target == "JPEG" and image.mode not in ("RGB", "L"):
+                image = image.convert("RGB")
+            buffer = io.BytesIO()
+            image.save(buffer, format=target, **encode_params(target))
+        with timed("disk_write"):
+            write_atomic(path, buffer.getvalue())
+
+    return str(path)
+
+
+class ImageWriter:
+    """Encodes and writes images on its own thread pool.
+
+    submit() returns at once, so generation workers can hand the image to the
+    UI while it is persisted; write_all() fans a batch out over the pool and
+    waits for it.
+    """
+
+    def __init__(self, workers: int = IMAGE_WRITER_WORKERS, save_format: str = None):
+        self.save_format = save_format
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="image-writer")
+        self._pending: List[Future] = []
+        self._lock = threading.Lock()
+
+    def extension(self, image: AnyImage) -> str:
+        """Extension the file of this image must have."""
+        return output_extension(image, self.save_format)
+
+    def submit(self, image: AnyImage, path: Union[str, Path]) -> "Future[str]":
+        """Write an image in the background; the future's result is its path."""
+        future = self._executor.submit(write_image, image, path, self.save_format)
+        with self._lock:
+            self._pending = [f for f in self._pending if not f.done()]
+            self._pending.append(future)
+        future.add_done_callback(self._log_failure)
+        return future
+
+    def write_all(self, images: List[AnyImage], paths: List[Union[str, Path]]) -> List[str]:
+        """Write several images in parallel and wait for all of them."""
+        futures = [self.submit(image, path) for image, path in zip(images, paths)]
+        return [future.result() for future in futures]
+
+    @staticmethod
+    def _log_failure(future: Future):
+        error = future.exception()
+        if error is not None:
+            logger.error(f"Failed to write image: {str(error)}")
+
+    def flush(self, timeout: float = None):
+        """Wait until every image submitted so far is on disk."""
+        with self._lock:
+            pending = list(self._pending)
+        for future in pending:
+            try:
+                future.result(timeout)
+            except Exception:
+                pass  # Already logged
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait)
+
+
+_writer: Optional[ImageWriter] = None
+_writer_lock = threading.Lock()
+
+
+def get_image_writer() -> ImageWriter:
+    """Get the process-wide image writer."""
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = ImageWriter()
+        return _writer
+
+
+def shutdown_image_writer():
+    """Finish pending writes and stop the writer threads, if the writer was used."""
+    global _writer
+    with _writer_lock:
+        writer, _writer = _writer, None
+    if writer is not None:
+        writer.shutdown(wait=True)
@@ -0,0 +1,251 @@
+import time
+import logging
+import itertools
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from core.cancel import CancelToken, GenerationCancelled, DeadlineExceeded
+from core.settings import JOB_WORKERS, JOB_QUEUE_MAX, GENERATION_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+# Job states
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+FINISHED_STATES = (DONE, FAILED, CANCELLED)
+
+
+class QueueFull(Exception):
+    """The job queue already holds its maximum number of pending jobs."""
+
+
+class Job:
+    """One queued generation request and its progress."""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, prompt: str, size: Tuple[int, int], negative_prompt: str = None,
+                 priority: int = 0, timeout: float = GENERATION_TIMEOUT,
+                 options: Dict[str, Any] = None):
+        self.id = next(Job._ids)
+        self.prompt = prompt
+        self.size = tuple(size)
+        self.negative_prompt = negative_prompt
+        self.priority = priority
+        self.timeout = timeout
+        self.options = options or {}  # Extra settings for run_job (provider, samples, ...)
+
+        self.status = QUEUED
+        self.progress: Optional[float] = None  # Download progress 0..1 while running
+        self.result: Any = None
+        self.error: Optional[str] = None
+        self.timed_out = False
+        self.cancel_token: Optional[CancelToken] = None  # Created when the job starts
+
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATES
+
+    def __repr__(self):
+        return f"<Job {self.id} {self.status} priority={self.priority} prompt={self.prompt[:30]!r}>"
+
+
+class JobQueue:
+    """Bounded priority queue of generation jobs served by a pool of worker threads.
+
+    Pending jobs run highest priority first, in submission order within a
+    priority; move() reorders them. run_job(job) does the work on a worker
+    thread and its return value becomes job.result. Listeners registered with
+    add_listener() are called (on the worker or caller thread) whenever a job
+    changes.
+    """
+
+    def __init__(self, run_job: Callable[[Job], Any], workers: int = JOB_WORKERS,
+                 max_pending: int = JOB_QUEUE_MAX):
+        self.run_job = run_job
+        self.workers = max(1, workers)
+        self.max_pending = max_pending
+
+        self._pending: List[Job] = []  # In run order
+        self._jobs: Dict[int, Job] = {}  # Every job not yet cleared, in submission order
+        self._listeners: List[Callable[[Job], None]] = []
+        self._condition = threading.Condition()
+        self._closed = False
+        self._threads: List[threading.Thread] = []
+
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"job-worker-{index + 1}")
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def add_listener(self, callback: Callable[[Job], None]):
+        self._listeners.append(callback)
+
+    def _notify(self, job: Job):
+        for callback in list(self._listeners):
+            try:
+                callback(job)
+            except Exception as e:
+                logger.warning(f"Job listener failed: {str(e)}")
+
+    def submit(self, prompt: str, size: Tuple[int, int], negative_prompt: str = None,
+               priority: int = 0, timeout: float = GENERATION_TIMEOUT,
+               options: Dict[str, Any] = None) -> Job:
+        """Queue a job; raises QueueFull if max_pending jobs are already waiting."""
+        job = Job(prompt, size, negative_prompt, priority, timeout, options)
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("Job queue is shut down")
+            if len(self._pending) >= self.max_pending:
+                raise QueueFull(f"Queue is full ({self.max_pending} pending jobs)")
+            # After every pending job of the same or higher priority
+            position = len(self._pending)
+            for index, pending in enumerate(self._pending):
+                if pending.priority < priority:
+                    position = index
+                    break
+            self._pending.insert(position, job)
+            self._jobs[job.id] = job
+            self._condition.notify()
+        logger.info(f"Queued job {job.id} (priority {priority}): {prompt[:50]}")
+        self._notify(job)
+        return job
+
+    def cancel(self, job_id: int) -> bool:
+        """Cancel a pending or running job; returns False if it already finished."""
+        token = None
+        with self._condition:
+            job = self._jobs.get(job_id)
+            if job is None or job.finished:
+                return False
+            was_queued = job.status == QUEUED
+            if was_queued:
+                self._pending.remove(job)
+                job.status = CANCELLED
+                job.finished_at = time.time()
+            else:
+                token = job.cancel_token
+        if was_queued:
+            logger.info(f"Cancelled queued job {job.id}")
+            self._notify(job)
+        else:
+            token.cancel()
+        return True
+
+    def cancel_all(self):
+        """Cancel every pending and running job."""
+        with self._condition:
+            job_ids = [job.id for job in self._jobs.values() if not job.finished]
+        for job_id in job_ids:
+            self.cancel(job_id)
+
+    def move(self, job_id: int, offset: int) -> bool:
+        """Move a pending job `offset` places earlier (negative) or later (positive) in the queue.
+
+        The job takes the priority of the job it lands next to, so later
+        submissions still queue up behind it correctly.
+        """
+        with self._condition:
+            job = self._jobs.get(job_id)
+            if job is None or job.status != QUEUED:
+                return False
+            index = self._pending.index(job)
+            new_index = max(0, min(len(self._pending) - 1, index + offset))
+            if new_index == index:
+                return False
+            self._pending.pop(index)
+            self._pending.insert(new_index, job)
+            neighbour = self._pending[new_index + 1] if offset < 0 else self._pending[new_index - 1]
+            job.priority = neighbour.priority
+        self._notify(job)
+        return True
+
+    def get(self, job_id: int) -> Optional[Job]:
+        with self._condition:
+            return self._jobs.get(job_id)
+
+    def jobs(self) -> List[Job]:
+        """Running and pending jobs in run order, followed by finished jobs."""
+        with self._condition:
+            running = [job for job in self._jobs.values() if job.status == RUNNING]
+            finished = [job for job in self._jobs.values() if job.finished]
+            return running + list(self._pending) + finished
+
+    def pending_count(self) -> int:
+        with self._condition:
+            return len(self._pending)
+
+    def active_count(self) -> int:
+        """Number of pending and running jobs."""
+        with self._condition:
+            return sum(1 for job in self._jobs.values() if not job.finished)
+
+    def clear_finished(self, keep: int = 0):
+        """Forget finished jobs, except the `keep` most recently finished ones."""
+        with self._condition:
+            finished = sorted((job for job in self._jobs.values() if job.finished),
+                              key=lambda job: job.finished_at)
+            for job in finished[:max(0, len(finished) - keep)]:
+                del self._jobs[job.id]
+
+    def shutdown(self, cancel: bool = True, wait: bool = False):
+        """Stop the workers; pending jobs are cancelled, running ones too if cancel is True."""
+        with self._condition:
+            self._closed = True
+            pending = list(self._pending)
+            self._condition.notify_all()
+        for job in pending:
+            self.cancel(job.id)
+        if cancel:
+            self.cancel_all()
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+    def _next_job(self) -> Optional[Job]:
+        with self._condition:
+            while not self._pending and not self._closed:
+                self._condition.wait()
+            if self._closed:
+                return None
+            job = self._pending.pop(0)
+            job.status = RUNNING
+            job.started_at = time.time()
+            # The deadline starts when the job does, not while it waits in the queue
+            job.cancel_token = CancelToken(job.timeout)
+            return job
+
+    def _worker(self):
+        while True:
+            job = self._next_job()
+            if job is None:
+                return
+            self._notify(job)
+
+            result, error, status = None, None, DONE
+            try:
+                result = self.run_job(job)
+            except GenerationCancelled as e:
+                status, error = CANCELLED, str(e)
+                job.timed_out = isinstance(e, DeadlineExceeded)
+            except Exception as e:
+                logger.exception(f"Job {job.id} failed")
+                status, error = FAILED, str(e)
+
+            with self._condition:
+                job.result = result
+                job.error = error
+                job.status = status
+                job.finished_at = time.time()
+                job.progress = None
+            logger.info(f"Job {job.id} {job.status} in {job.finished_at - job.started_at:.1f}s")
+            self._notify(job)
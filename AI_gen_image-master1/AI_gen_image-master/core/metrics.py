@@ -0,0 +1,267 @@
+import json
+import time
+import bisect
+import logging
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (seconds) of the latency histogram buckets
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+# Buckets of the retries-per-generation histogram
+RETRY_BUCKETS = (0, 1, 2, 3, 5, 10)
+
+# Prefix of every exported metric name
+METRIC_PREFIX = "imagegen_"
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus style."""
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)  # The last slot is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        with self._lock:
+            self.counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.count += 1
+            self.sum += value
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Estimate a quantile by interpolating inside its bucket, or None without data."""
+        with self._lock:
+            if not self.count:
+                return None
+            rank = q * self.count
+            seen = 0
+            for index, bucket_count in enumerate(self.counts):
+                if seen + bucket_count >= rank and bucket_count:
+                    lower = self.buckets[index - 1] if index > 0 else 0.0
+                    if index == len(self.buckets):
+                        return lower  # Above the largest bucket
+                    upper = self.buckets[index]
+                    return lower + (upper - lower) * (rank - seen) / bucket_count
+                seen += bucket_count
+            return self.buckets[-1]
+
+    def snapshot(self) -> Dict[str, object]:
+        with self._lock:
+            cumulative = []
+            total = 0
+            for bound, bucket_count in zip(list(self.buckets) + ["+Inf"], self.counts):
+                total += bucket_count
+                cumulative.append((bound, total))
+            return {"count": self.count, "sum": self.sum, "buckets": cumulative}
+
+
+class Metrics:
+    """In-process histograms and counters, exportable as JSON or Prometheus text."""
+
+    def __init__(self):
+        self._histograms: Dict[str, Dict[Labels, Histogram]] = {}
+        self._counters: Dict[str, Dict[Labels, float]] = {}
+        self._buckets: Dict[str, Tuple[float, ...]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _labels(labels: Dict[str, object]) -> Labels:
+        return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+    def histogram(self, name: str, buckets: Tuple[float, ...] = None, **labels) -> Histogram:
+        """Get or create the histogram for a metric name and label set."""
+        key = self._labels(labels)
+        with self._lock:
+            family = self._histograms.setdefault(name, {})
+            if key not in family:
+                buckets = buckets or self._buckets.get(name, DEFAULT_BUCKETS)
+                self._buckets.setdefault(name, buckets)
+                family[key] = Histogram(buckets)
+            return family[key]
+
+    def observe(self, name: str, value: float, **labels):
+        self.histogram(name, **labels).observe(value)
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        key = self._labels(labels)
+        with self._lock:
+            family = self._counters.setdefault(name, {})
+            family[key] = family.get(key, 0) + amount
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+    def to_dict(self) -> Dict[str, List[Dict[str, object]]]:
+        """All metrics with p50/p95/p99 estimates, grouped by name."""
+        with self._lock:
+            histograms = {name: dict(family) for name, family in self._histograms.items()}
+            counters = {name: dict(family) for name, family in self._counters.items()}
+
+        result: Dict[str, List[Dict[str, object]]] = {}
+        for name, family in sorted(histograms.items()):
+            result[name] = []
+            for labels, histogram in sorted(family.items()):
+                snapshot = histogram.snapshot()
+                result[name].append({
+                    "labels": dict(labels),
+                    "count": snapshot["count"],
+                    "sum": snapshot["sum"],
+                    "p50": histogram.quantile(0.5),
+                    "p95": histogram.quantile(0.95),
+                    "p99": histogram.quantile(0.99),
+                })
+        for name, family in sorted(counters.items()):
+            result[name] = [{"labels": dict(labels), "value": value}
+                            for labels, value in sorted(family.items())]
+        return result
+
+    def to_json(self, indent: int = 2) -> str:
+        return json.dumps(self.to_dict(), indent=indent)
+
+    def to_prometheus(self) -> str:
+        """Prometheus text exposition format."""
+        with self._lock:
+            histograms = {name: dict(family) for name, family in self._histograms.items()}
+            counters = {name: dict(family) for name, family in self._counters.items()}
+
+        lines = []
+        for name, family in sorted(histograms.items()):
+            metric = METRIC_PREFIX + name
+            lines.append(f"# TYPE {metric} histogram")
+            for labels, histogram in sorted(family.items()):
+                snapshot = histogram.snapshot()
+                for bound, count in snapshot["buckets"]:
+                    le = bound if bound == "+Inf" else repr(float(bound))
+                    lines.append(f"{metric}_bucket{_format_labels(labels + (('le', le),))} {count}")
+                lines.append(f"{metric}_sum{_format_labels(labels)} {snapshot['sum']}")
+                lines.append(f"{metric}_count{_format_labels(labels)} {snapshot['count']}")
+        for name, family in sorted(counters.items()):
+            metric = METRIC_PREFIX + name
+            lines.append(f"# TYPE {metric} counter")
+            for labels, value in sorted(family.items()):
+                lines.append(f"{metric}{_format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path: Union[str, Path]):
+        """Write all metrics to a file: Prometheus text for .prom/.txt, JSON otherwise."""
+        path = Path(path)
+        text = self.to_prometheus() if path.suffix.lower() in (".prom", ".txt") else self.to_json()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(text, encoding="utf-8")
+        logger.info(f"Metrics written to {path}")
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+               for _, value in labels)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + "}"
+
+
+class AttemptTimer:
+    """Stage timings of one provider call attempt.
+
+    While active (see attempt()), stages timed with timed() on the same thread
+    are added to it. finish() records the attempt and logs all its stages as
+    one structured line.
+    """
+
+    def __init__(self, metrics: "Metrics", provider: str, attempt: int):
+        self.metrics = metrics
+        self.provider = provider
+        self.attempt = attempt
+        self.stages: Dict[str, float] = {}
+        self.started = time.perf_counter()
+        self.finished = False
+
+    def add(self, stage: str, seconds: float):
+        """Record a stage duration measured elsewhere."""
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+        self.metrics.observe("stage_seconds", seconds, stage=stage, provider=self.provider)
+
+    def finish(self, outcome: str, status_code: int = None):
+        """Record the attempt's total time under outcome ("ok", "error", "cancelled", ...)."""
+        if self.finished:
+            return
+        self.finished = True
+        elapsed = time.perf_counter() - self.started
+        self.metrics.observe("attempt_seconds", elapsed, provider=self.provider, outcome=outcome)
+        logger.info("timing " + json.dumps({
+            "provider": self.provider,
+            "attempt": self.attempt,
+            "retries": self.attempt - 1,
+            "outcome": outcome,
+            "status_code": status_code,
+            "total": round(elapsed, 6),
+            "stages": {stage: round(seconds, 6) for stage, seconds in self.stages.items()},
+        }))
+
+
+_local = threading.local()
+
+
+def current_attempt() -> Optional[AttemptTimer]:
+    """The attempt being timed on this thread, if any."""
+    return getattr(_local, "attempt", None)
+
+
+@contextmanager
+def attempt(provider: str, attempt_number: int):
+    """Time one provider call attempt; stages timed inside are attributed to it.
+
+    The block should call finish() on the yielded timer; otherwise the attempt
+    is recorded with outcome "error" when the block exits.
+    """
+    timer = AttemptTimer(get_metrics(), provider, attempt_number)
+    previous = current_attempt()
+    _local.attempt = timer
+    try:
+        yield timer
+    finally:
+        _local.attempt = previous
+        timer.finish("error")
+
+
+def record_stage(stage: str, seconds: float, provider: str = None):
+    """Record a stage duration, attributing it to the current attempt if there is one."""
+    timer = current_attempt()
+    if timer is not None:
+        timer.add(stage, seconds)
+    else:
+        get_metrics().observe("stage_seconds", seconds, stage=stage, provider=provider or "unknown")
+
+
+@contextmanager
+def timed(stage: str, provider: str = None):
+    """Time the block as one pipeline stage."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - started, provider)
+
+
+_metrics: Optional[Metrics] = None
+_metrics_lock = threading.Lock()
+
+
+def get_metrics() -> Metrics:
+    """Get the process-wide metrics registry."""
+    global _metrics
+    with _metrics_lock:
+        if _metrics is None:
+            _metrics = Metrics()
+        return _metrics
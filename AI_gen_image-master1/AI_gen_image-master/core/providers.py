@@ -0,0 +1,361 @@
+import io
+import time
+import base64
+import random
+import asyncio
+import hashlib
+import logging
+import threading
+from typing import Optional, Tuple, Dict, Any, List
+
+from PIL import Image, ImageDraw
+
+from core.cancel import CancelToken
+from core.generated_image import GeneratedImage
+from core.stream_decode import BLOB_PREFIX, is_blob
+from core.settings import (LOCAL_PROVIDER_LATENCY, LOCAL_PROVIDER_JITTER,
+                           LOCAL_PROVIDER_FAILURE_RATE)
+
+logger = logging.getLogger(__name__)
+
+
+def field_bytes(value: str, blobs: Dict[str, bytearray] = None) -> bytes:
+    """Bytes of a base64 image field, which may already have been decoded while streaming."""
+    if blobs and is_blob(value):
+        return blobs[value]
+    return base64.b64decode(value)
+
+
+class ImageProvider:
+    """A text-to-image backend: how to build its requests and parse its responses.
+
+    Subclasses set the class attributes describing the provider and implement
+    build_request() and parse_response(). Register an instance with
+    register_provider() to make it available to the clients and the UI.
+    """
+
+    name = ""
+    display_name = ""
+    description = ""
+    base_url: Optional[str] = None  # Used for connection warm-up
+    supported_sizes: List[Tuple[int, int]] = []
+    max_samples = 1  # Images returned by a single request
+    concurrency = 4  # Default in-flight request limit (see PROVIDER_CONCURRENCY)
+    rate_limit: Optional[float] = None  # Default requests/minute (see PROVIDER_RATE_LIMITS)
+    requires_api_key = True
+    cacheable = True  # Whether responses may be served from the generation cache
+    local = False  # Served in-process by send() instead of over HTTP
+
+    def build_request(self,
+                      api_key: str,
+                      prompt: str,
+                      size: Tuple[int, int],
+                      negative_prompt: str = None,
+                      samples: int = 1) -> Tuple[str, Dict[str, str], Dict[str, Any]]:
+        """Build the (url, headers, payload) of a generation request."""
+        raise NotImplementedError
+
+    def parse_response(self, response_data: Dict[str, Any],
+                       blobs: Dict[str, bytearray] = None) -> List[GeneratedImage]:
+        """Extract the images from a decoded response.
+
+        blobs holds image fields already decoded by the streaming decoder.
+        """
+        raise NotImplementedError
+
+    def size_options(self) -> List[str]:
+        """Supported sizes as "WxH" strings, for the size dropdown."""
+        return [f"{width}x{height}" for width, height in self.supported_sizes]
+
+
+class OpenAIProvider(ImageProvider):
+    name = "openai"
+    display_name = "OpenAI DALL-E"
+    description = (
+        "OpenAI API for DALL-E image generation.\n\n"
+        "To use this API:\n"
+        "1. Register at https://platform.openai.com/\n"
+        "2. Create an API key in your dashboard\n"
+        "3. Paste your API key here\n\n"
+        "The DALL-E models can generate high-quality images from text prompts."
+    )
+    base_url = "https://api.openai.com"
+    supported_sizes = [(256, 256), (512, 512), (1024, 1024)]
+    max_samples = 10
+    concurrency = 5
+    rate_limit = 50
+
+    def build_request(self, api_key, prompt, size, negative_prompt=None, samples=1):
+        # Convert size to OpenAI format (e.g. 512x512)
+        size_str = f"{size[0]}x{size[1]}"
+
+        headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {api_key}"
+        }
+
+        payload = {
+            "prompt": prompt,
+            "size": size_str,
+            "n": samples,
+            "response_format": "b64_json"
+        }
+
+        return f"{self.base_url}/v1/images/generations", headers, payload
+
+    def parse_response(self, response_data, blobs=None):
+        return [
+            GeneratedImage(field_bytes(item["b64_json"], blobs))
+            for item in response_data["data"]
+        ]
+
+
+class StabilityProvider(ImageProvider):
+    name = "stability"
+    display_name = "Stability AI"
+    description = (
+        "Stability AI API for SDXL image generation.\n\n"
+        "To use this API:\n"
+        "1. Register at https://platform.stability.ai/\n"
+        "2. Create an API key in your dashboard\n"
+        "3. Paste your API key here\n\n"
+        "Stability AI offers state-of-the-art AI image generation."
+    )
+    base_url = "https://api.stability.ai"
+    supported_sizes = [(1024, 1024), (1152, 896), (1216, 832), (1344, 768),
+                       (1536, 640), (768, 1344), (832, 1216), (896, 1152)]
+    max_samples = 10
+    concurrency = 4
+    rate_limit = 150
+
+    def build_request(self, api_key, prompt, size, negative_prompt=None, samples=1):
+        headers = {
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json",
+            "Accept": "application/json"
+        }
+
+        payload = {
+            "text_prompts": [
+                {
+                    "text": prompt,
+                    "weight": 1.0
+                }
+            ],
+            "height": size[1],
+            "width": size[0],
+            "samples": samples,
+            "cfg_scale": 7.0,
+            "steps": 30,
+            "style_preset": "photographic"
+        }
+
+        # Add negative prompt if provided
+        if negative_prompt:
+            payload["text_prompts"].append({
+                "text": negative_prompt,
+                "weight": -1.0
+            })
+
+        url = f"{self.base_url}/v1/generation/stable-diffusion-xl-1024-v1-0/text-to-image"
+        return url, headers, payload
+
+    def parse_response(self, response_data, blobs=None):
+        return [
+            GeneratedImage(field_bytes(artifact["base64"], blobs))
+            for artifact in response_data["artifacts"]
+        ]
+
+
+class GeminiProvider(ImageProvider):
+    name = "gemini"
+    display_name = "Gemini API"
+    description = (
+        "Google's Gemini API for image generation.\n\n"
+        "To use this API:\n"
+        "1. Register at https://aistudio.google.com/\n"
+        "2. Create an API key in your Google AI Studio\n"
+        "3. Paste your API key here\n\n"
+        "Gemini is Google's multimodal AI that can generate images from text."
+    )
+    base_url = "https://generativelanguage.googleapis.com"
+    supported_sizes = [(1024, 1024), (1024, 1792), (1792, 1024)]
+    max_samples = 1
+    concurrency = 4
+    rate_limit = 60
+
+    def build_request(self, api_key, prompt, size, negative_prompt=None, samples=1):
+        # Find best fit size
+        if size[0] == size[1]:  # Square image
+            size_key = "1024x1024"
+        elif size[0] < size[1]:  # Portrait
+            size_key = "1024x1792"
+        else:  # Landscape
+            size_key = "1792x1024"
+        logger.info(f"Using Gemini size: {size_key} (requested: {size[0]}x{size[1]})")
+
+        # Build the API URL with key - Using gemini-1.5-flash model
+        api_url = f"{self.base_url}/v1/models/gemini-1.5-flash:generateContent?key={api_key}"
+
+        headers = {
+            "Content-Type": "application/json"
+        }
+
+        payload = {
+            "contents": [
+                {
+                    "role": "user",
+                    "parts": [
+                        {
+                            "text": f"Generate an image based on this description: {prompt}"
+                        }
+                    ]
+                }
+            ],
+            "generation_config": {
+                "temperature": 0.7,
+                "topP": 0.95,
+                "topK": 40
+            }
+        }
+
+        return api_url, headers, payload
+
+    def parse_response(self, response_data, blobs=None):
+        images = []
+        try:
+            # Gemini might return the image in various formats
+            for candidate in response_data.get("candidates", []):
+                for part in candidate.get("content", {}).get("parts", []):
+                    if "inlineData" in part:
+                        mime_type = part["inlineData"]["mimeType"]
+                        if mime_type.startswith("image/"):
+                            image_data = field_bytes(part["inlineData"]["data"], blobs)
+                            images.append(GeneratedImage(image_data, mime_type))
+        except Exception as e:
+            logger.error(f"Error parsing Gemini response: {str(e)}")
+            raise Exception(f"Failed to extract image from Gemini response: {str(e)}")
+
+        if not images:
+            raise Exception("No image found in Gemini response")
+
+        return images
+
+
+class LocalProvider(ImageProvider):
+    """Offline provider that renders synthetic images in-process.
+
+    Requests go through the same limiter, retry, circuit breaker and save path
+    as a real provider; only the transport is replaced. Each call waits for
+    latency +/- jitter seconds and fails with probability failure_rate, so the
+    pipeline can be load-tested without network access or per-image cost.
+    """
+
+    name = "local"
+    display_name = "Local (synthetic)"
+    description = (
+        "Built-in local provider for offline testing.\n\n"
+        "Generates placeholder images on this computer without calling any API, "
+        "so no API key is needed.\n\n"
+        "Latency and failure rate can be configured with \"local_provider\" in config.json."
+    )
+    supported_sizes = [(256, 256), (512, 512), (1024, 1024), (1024, 768), (768, 1024)]
+    max_samples = 10
+    concurrency = 8
+    requires_api_key = False
+    cacheable = False
+    local = True
+
+    def __init__(self, latency: float = LOCAL_PROVIDER_LATENCY,
+                 jitter: float = LOCAL_PROVIDER_JITTER,
+                 failure_rate: float = LOCAL_PROVIDER_FAILURE_RATE,
+                 seed: int = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self._random = random.Random(seed)
+        self._random_lock = threading.Lock()
+
+    def build_request(self, api_key, prompt, size, negative_prompt=None, samples=1):
+        payload = {
+            "prompt": prompt,
+            "negative_prompt": negative_prompt,
+            "width": size[0],
+            "height": size[1],
+            "samples": samples,
+        }
+        return "local://generate", {}, payload
+
+    def parse_response(self, response_data, blobs=None):
+        return [GeneratedImage(field_bytes(item["data"], blobs)) for item in response_data["images"]]
+
+    def _simulate(self) -> Tuple[float, bool]:
+        """Draw the (delay, fails) outcome of one request."""
+        with self._random_lock:
+            delay = max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter))
+            fails = self._random.random() < self.failure_rate
+        return delay, fails
+
+    def send(self, payload: Dict[str, Any], cancel_token: CancelToken = None):
+        """Serve a request built by build_request(); returns (response_data, blobs) like the stream decoder."""
+        delay, fails = self._simulate()
+        if cancel_token is not None:
+            cancel_token.sleep(delay)
+        else:
+            time.sleep(delay)
+        if fails:
+            raise ConnectionError("Simulated local provider failure")
+        return self.render(payload)
+
+    async def send_async(self, payload: Dict[str, Any]):
+        """Asyncio version of send()."""
+        delay, fails = self._simulate()
+        await asyncio.sleep(delay)
+        if fails:
+            raise ConnectionError("Simulated local provider failure")
+        return self.render(payload)
+
+    @staticmethod
+    def render(payload: Dict[str, Any]):
+        """Render the requested images: a colour derived from the prompt, with the prompt drawn on it."""
+        size = (payload["width"], payload["height"])
+        response_data = {"images": []}
+        blobs = {}
+        for index in range(payload["samples"]):
+            digest = hashlib.sha256(f"{payload['prompt']}:{index}".encode("utf-8")).digest()
+            image = Image.new("RGB", size, tuple(digest[:3]))
+            ImageDraw.Draw(image).text((10, 10), payload["prompt"][:80], fill=tuple(255 - c for c in digest[:3]))
+
+            buffer = io.BytesIO()
+            image.save(buffer, format="PNG", compress_level=1)
+            name = f"{BLOB_PREFIX}{index}"
+            blobs[name] = buffer.getvalue()
+            response_data["images"].append({"data": name})
+        return response_data, blobs
+
+
+_providers: Dict[str, ImageProvider] = {}
+_providers_lock = threading.Lock()
+
+
+def register_provider(provider: ImageProvider):
+    """Add a provider to the registry, replacing any provider with the same name."""
+    with _providers_lock:
+        _providers[provider.name] = provider
+    logger.debug(f"Registered provider {provider.name}")
+
+
+def get_provider(name: str) -> Optional[ImageProvider]:
+    """Look up a registered provider by name, or None if there is none."""
+    with _providers_lock:
+        return _providers.get((name or "").lower())
+
+
+def list_providers() -> List[str]:
+    """Names of all registered providers, in registration order."""
+    with _providers_lock:
+        return list(_providers)
+
+
+for _provider in (OpenAIProvider(), StabilityProvider(), GeminiProvider(), LocalProvider()):
+    register_provider(_provider)
@@ -0,0 +1,93 @@
+import time
+import asyncio
+import logging
+import threading
+from typing import Dict, Optional
+
+from core.providers import get_provider
+from core.settings import PROVIDER_RATE_LIMITS, RATE_LIMIT_BURST
+
+logger = logging.getLogger(__name__)
+
+class TokenBucket:
+    """Token-bucket rate limiter shared by threads and asyncio tasks.
+
+    Tokens refill at requests_per_minute / 60 per second up to `burst`. A
+    provider's Retry-After can pause the bucket until a given time.
+    """
+
+    def __init__(self, requests_per_minute: float, burst: int = RATE_LIMIT_BURST):
+        self.rate = requests_per_minute / 60.0
+        self.capacity = max(1, burst)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _reserve(self) -> float:
+        """Take a token if one is available; otherwise return the seconds to wait for one."""
+        with self._lock:
+            now = time.monotonic()
+            if now < self._paused_until:
+                return self._paused_until - now
+
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self, cancel_token=None):
+        """Block the calling thread until a request may be sent.
+
+        With a cancel token the wait is cut short when the token fires.
+        """
+        while True:
+            wait = self._reserve()
+            if wait <= 0:
+                return
+            if cancel_token is not None:
+                cancel_token.sleep(wait)
+            else:
+                time.sleep(wait)
+
+    async def acquire_async(self):
+        """Wait on the event loop until a request may be sent."""
+        while True:
+            wait = self._reserve()
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+    def pause(self, seconds: float):
+        """Hold back every caller for the given time, e.g. after a 429 with Retry-After."""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = 0.0
+            self._updated = time.monotonic()
+
+
+_limiters: Dict[str, Optional[TokenBucket]] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(provider: str) -> Optional[TokenBucket]:
+    """Get the process-wide limiter for a provider, or None if it has no limit configured.
+
+    PROVIDER_RATE_LIMITS overrides the provider's own default (ImageProvider.rate_limit).
+    """
+    with _limiters_lock:
+        if provider not in _limiters:
+            plugin = get_provider(provider)
+            rpm = PROVIDER_RATE_LIMITS.get(provider, plugin.rate_limit if plugin is not None else None)
+            _limiters[provider] = TokenBucket(rpm) if rpm else None
+            if rpm:
+                logger.info(f"Rate limit for {provider}: {rpm} requests/minute")
+        return _limiters[provider]
+
+
+def set_rate_limit(provider: str, requests_per_minute: Optional[float], burst: int = RATE_LIMIT_BURST):
+    """Replace a provider's limiter at runtime; None removes the limit (e.g. for benchmarks)."""
+    with _limiters_lock:
+        _limiters[provider] = TokenBucket(requests_per_minute, burst) if requests_per_minute else None
@@ -0,0 +1,169 @@
+import time
+import logging
+import threading
+from collections import deque
+from typing import Dict, List, Optional
+
+from core.settings import (CIRCUIT_WINDOW_SECONDS, CIRCUIT_MIN_REQUESTS,
+                           CIRCUIT_ERROR_THRESHOLD, CIRCUIT_COOLDOWN_SECONDS)
+
+logger = logging.getLogger(__name__)
+
+# Circuit breaker states
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class ProviderHealth:
+    """Rolling error rate and latency of one provider, with a circuit breaker.
+
+    The circuit opens when the error rate over the window exceeds the
+    threshold. After the cooldown a single probe request is let through
+    (half-open); its outcome closes or re-opens the circuit.
+    """
+
+    def __init__(self, name: str,
+                 window: float = CIRCUIT_WINDOW_SECONDS,
+                 min_requests: int = CIRCUIT_MIN_REQUESTS,
+                 error_threshold: float = CIRCUIT_ERROR_THRESHOLD,
+                 cooldown: float = CIRCUIT_COOLDOWN_SECONDS):
+        self.name = name
+        self.window = window
+        self.min_requests = min_requests
+        self.error_threshold = error_threshold
+        self.cooldown = cooldown
+
+        self.state = CLOSED
+        self._opened_at = 0.0
+        self._probe_started = 0.0
+        self._probe_in_flight = False
+        self._samples = deque()  # (timestamp, ok, latency)
+        self._lock = threading.Lock()
+
+    def _trim(self, now: float):
+        while self._samples and now - self._samples[0][0] > self.window:
+            self._samples.popleft()
+
+    def allow_request(self) -> bool:
+        """Whether a request may be sent to this provider right now."""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.monotonic() - self._opened_at >= self.cooldown:
+                self.state = HALF_OPEN
+                self._probe_in_flight = False
+                logger.info(f"Circuit for {self.name} is half-open, sending a probe request")
+            if self.state == HALF_OPEN:
+                now = time.monotonic()
+                # A probe that never reported back (e.g. served from cache) expires after the cooldown
+                if not self._probe_in_flight or now - self._probe_started >= self.cooldown:
+                    self._probe_in_flight = True
+                    self._probe_started = now
+                    return True
+            return False
+
+    def record(self, ok: bool, latency: float = None):
+        """Record the outcome of one request."""
+        with self._lock:
+            now = time.monotonic()
+            self._samples.append((now, ok, latency))
+            self._trim(now)
+
+            if self.state == HALF_OPEN:
+                self._probe_in_flight = False
+                if ok:
+                    self.state = CLOSED
+                    self._samples.clear()
+                    logger.info(f"Circuit for {self.name} closed")
+                else:
+                    self._open(now)
+            elif self.state == CLOSED and not ok:
+                total = len(self._samples)
+                errors = sum(1 for _, sample_ok, _ in self._samples if not sample_ok)
+                if total >= self.min_requests and errors / total >= self.error_threshold:
+                    self._open(now)
+
+    def release_probe(self):
+        """Let the next probe through after one that said nothing about health (e.g. a rejected request)."""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def _open(self, now: float):
+        self.state = OPEN
+        self._opened_at = now
+        logger.warning(f"Circuit for {self.name} opened (error rate {self._error_rate():.0%})")
+
+    def _error_rate(self) -> float:
+        if not self._samples:
+            return 0.0
+        return sum(1 for _, ok, _ in self._samples if not ok) / len(self._samples)
+
+    def error_rate(self) -> float:
+        with self._lock:
+            self._trim(time.monotonic())
+            return self._error_rate()
+
+    def p95_latency(self) -> Optional[float]:
+        """95th percentile latency of successful requests in the window, or None without data."""
+        with self._lock:
+            self._trim(time.monotonic())
+            latencies = sorted(latency for _, ok, latency in self._samples if ok and latency is not None)
+        if not latencies:
+            return None
+        return latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "state": self.state,
+            "error_rate": self.error_rate(),
+            "p95_latency": self.p95_latency(),
+        }
+
+
+class ProviderRouter:
+    """Orders providers for failover by circuit state and recent latency."""
+
+    def __init__(self):
+        self._health: Dict[str, ProviderHealth] = {}
+        self._lock = threading.Lock()
+
+    def health(self, provider: str) -> ProviderHealth:
+        with self._lock:
+            if provider not in self._health:
+                self._health[provider] = ProviderHealth(provider)
+            return self._health[provider]
+
+    def record(self, provider: str, ok: bool, latency: float = None):
+        self.health(provider).record(ok, latency)
+
+    def candidates(self, preferred: str, providers: List[str]) -> List[str]:
+        """Providers to try in order: the preferred one first, then the rest by p95 latency.
+
+        Callers must still check health(provider).allow_request() before each
+        attempt, so an open circuit is skipped.
+        """
+        fallbacks = [p for p in providers if p != preferred]
+        # Providers without latency data yet go last, in configured order
+        fallbacks.sort(key=lambda p: (self.health(p).p95_latency() is None,
+                                      self.health(p).p95_latency() or 0.0))
+
+        return [preferred] + fallbacks if preferred in providers else fallbacks
+
+    def stats(self) -> Dict[str, Dict[str, object]]:
+        with self._lock:
+            providers = list(self._health)
+        return {p: self.health(p).stats() for p in providers}
+
+
+_router: Optional[ProviderRouter] = None
+_router_lock = threading.Lock()
+
+
+def get_router() -> ProviderRouter:
+    """Get the process-wide provider router."""
+    global _router
+    with _router_lock:
+        if _router is None:
+            _router = ProviderRouter()
+        return _router
@@ -0,0 +1,434 @@
+import os
+import hmac
+import json
+import time
+import signal
+import logging
+import mimetypes
+import threading
+import unicodedata
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import urlsplit, parse_qs, urlencode, quote
+
+from core.api_client import APIClient
+from core.batch import parse_size
+from core.db import Database
+from core.job_queue import JobQueue, Job, QueueFull
+from core.providers import get_provider
+from core.settings import (
+    ensure_dirs, GENERATION_TIMEOUT, JOB_QUEUE_MAX,
+    SERVER_HOST, SERVER_PORT, SERVER_WORKERS, SERVER_TOKEN, SERVER_JOB_HISTORY
+)
+
+logger = logging.getLogger(__name__)
+
+# Headless code path: nothing here may import customtkinter or the ui package
+
+# Largest accepted request body, in bytes
+MAX_BODY_BYTES = 64 * 1024
+
+# Chunk size of streamed image downloads
+FILE_CHUNK_SIZE = 64 * 1024
+
+# Longest a client may block in GET /jobs/<id>?wait=<seconds>
+MAX_WAIT_SECONDS = 60
+
+
+def content_disposition(filename: str) -> str:
+    """Content-Disposition value for a possibly non-ASCII file name (RFC 6266 / RFC 5987).
+
+    Header values must be Latin-1, so the plain filename= gets an ASCII
+    fallback (accents stripped, anything else replaced by "_") and the
+    exact name goes in filename*=.
+    """
+    decomposed = unicodedata.normalize("NFKD", filename)
+    fallback = "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+    fallback = "".join(ch if 32 <= ord(ch) < 127 and ch not in '"\\' else "_" for ch in fallback)
+    return f"inline; filename=\"{fallback}\"; filename*=UTF-8''{quote(filename, safe='')}"
+
+
+class BadRequest(Exception):
+    """The request is malformed; answered with 400 and the message."""
+
+
+class NotFound(Exception):
+    """The requested job or image does not exist; answered with 404."""
+
+
+class ImageService:
+    """Generation and history shared by all HTTP clients.
+
+    Generation requests become jobs on a JobQueue whose workers call APIClient
+    and save the images into the App_Data save directory and history database,
+    exactly like the Generate tab.
+    """
+
+    def __init__(self, db: Database = None, workers: int = SERVER_WORKERS,
+                 max_pending: int = JOB_QUEUE_MAX, job_history: int = SERVER_JOB_HISTORY):
+        self.db = db or Database()
+        self.job_history = job_history
+        self._client = APIClient()
+        self._clients: Dict[str, APIClient] = {self._client.provider: self._client}
+        self._clients_lock = threading.Lock()
+        self._changed = threading.Condition()
+
+        self.queue = JobQueue(self._run_job, workers=workers, max_pending=max_pending)
+        self.queue.add_listener(self._on_job_changed)
+
+    def client_for(self, provider: str) -> APIClient:
+        with self._clients_lock:
+            if provider not in self._clients:
+                self._clients[provider] = self._client.for_provider(provider)
+            return self._clients[provider]
+
+    def submit(self, request: Dict[str, Any]) -> Job:
+        """Validate a generation request and queue it; raises BadRequest or QueueFull."""
+        prompt = str(request.get("prompt") or "").strip()
+        if not prompt:
+            raise BadRequest("prompt is required")
+
+        provider = str(request.get("provider") or self._client.provider).lower()
+        plugin = get_provider(provider)
+        if plugin is None:
+            raise BadRequest(f"Unknown provider: {provider}")
+
+        try:
+            if request.get("width") and request.get("height"):
+                size = (int(request["width"]), int(request["height"]))
+            else:
+                size = parse_size(request.get("size"))
+            samples = int(request.get("samples") or 1)
+            priority = int(request.get("priority") or 0)
+            timeout = min(float(request.get("timeout") or GENERATION_TIMEOUT), GENERATION_TIMEOUT)
+        except (TypeError, ValueError, KeyError, IndexError):
+            raise BadRequest("size, samples, priority and timeout must be numbers")
+
+        size_str = f"{size[0]}x{size[1]}"
+        if size_str not in plugin.size_options():
+            raise BadRequest(f"Invalid size {size_str} for {provider}. "
+                             f"Allowed sizes: {', '.join(plugin.size_options())}")
+        if not 1 <= samples <= plugin.max_samples:
+            raise BadRequest(f"samples must be between 1 and {plugin.max_samples} for {provider}")
+
+        negative_prompt = str(request.get("negative_prompt") or "").strip() or None
+        return self.queue.submit(prompt, size, negative_prompt, priority=priority, timeout=timeout,
+                                 options={"provider": provider, "samples": samples})
+
+    def _run_job(self, job: Job):
+        """Generate and save the images of one job (runs on a queue worker thread)."""
+        client = self.client_for(job.options["provider"])
+        started = time.perf_counter()
+        images = client.generate_images(
+            prompt=job.prompt,
+            size=job.size,
+            negative_prompt=job.negative_prompt,
+            samples=job.options["samples"],
+            progress=lambda received, total: self._on_download_progress(job, received, total),
+            cancel_token=job.cancel_token
+        )
+        if not images:
+            raise RuntimeError("Generation failed")
+
+        provider = images[0].provider or client.provider
+        rows = APIClient.write_images(images, ensure_dirs(), job.prompt, provider, metadata={
+            "source": "service",
+            "job_id": job.id,
+            "requested_provider": client.provider,
+            "requested_size": f"{job.size[0]}x{job.size[1]}",
+            "negative_prompt": job.negative_prompt,
+            "samples": job.options["samples"],
+            "priority": job.priority,
+            "queued_seconds": round(job.started_at - job.created_at, 3),
+            "generation_seconds": round(time.perf_counter() - started, 3),
+        })
+        # Inserted right away (not through a HistoryRecorder): the response needs the image ids
+        image_ids = self.db.add_images(rows)
+        return [{"id": image_id, "provider": provider, "width": row["width"], "height": row["height"],
+                 "url": f"/images/{image_id}"} for image_id, row in zip(image_ids, rows)]
+
+    def _on_download_progress(self, job: Job, received: int, total: Optional[int]):
+        if total:
+            job.progress = received / total
+
+    def _on_job_changed(self, job: Job):
+        if job.finished:
+            self.queue.clear_finished(keep=self.job_history)
+        with self._changed:
+            self._changed.notify_all()
+
+    def wait_for(self, job: Job, timeout: float):
+        """Block until the job finishes or the timeout passes."""
+        deadline = time.monotonic() + timeout
+        with self._changed:
+            while not job.finished:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._changed.wait(remaining)
+
+    @staticmethod
+    def job_to_dict(job: Job) -> Dict[str, Any]:
+        return {
+            "id": job.id,
+            "status": job.status,
+            "prompt": job.prompt,
+            "negative_prompt": job.negative_prompt,
+            "size": f"{job.size[0]}x{job.size[1]}",
+            "provider": job.options.get("provider"),
+            "samples": job.options.get("samples"),
+            "priority": job.priority,
+            "progress": job.progress,
+            "error": job.error,
+            "timed_out": job.timed_out,
+            "images": job.result or [],
+            "created_at": job.created_at,
+            "started_at": job.started_at,
+            "finished_at": job.finished_at,
+        }
+
+    def shutdown(self):
+        self.queue.shutdown(cancel=True)
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    """HTTP API of the image service.
+
+        GET    /health                  queue status
+        POST   /generate                queue a job: {"prompt", "size", "negative_prompt",
+                                        "provider", "samples", "priority", "timeout"}
+        GET    /jobs                    all known jobs
+        GET    /jobs/<id>[?wait=<s>]    one job, optionally waiting for it to finish
+        DELETE /jobs/<id>               cancel a job
+        GET    /history[?q=..&limit=..] history, or a prompt search when q is given;
+               [&provider=..&after=..]  pages follow the Link: rel="next" header
+        GET    /images/<id>             the image file
+    """
+
+    protocol_version = "HTTP/1.1"
+    server_version = "AIImageGenerator"
+
+    @property
+    def service(self) -> ImageService:
+        return self.server.service
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def do_DELETE(self):
+        self._dispatch("DELETE")
+
+    def _dispatch(self, method: str):
+        url = urlsplit(self.path)
+        parts = [part for part in url.path.split("/") if part]
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+
+        self._response_started = False
+        # A body left unread would be parsed as the next request on this connection
+        self._body_pending = (self.headers.get("Content-Length", "0").strip() not in ("", "0")
+                              or "Transfer-Encoding" in self.headers)
+
+        if SERVER_TOKEN and not self._authorized():
+            self._send_json(HTTPStatus.UNAUTHORIZED, {"error": "Missing or invalid token"})
+            return
+
+        try:
+            route = (method, parts[0] if parts else "", len(parts))
+            if route == ("GET", "health", 1):
+                self._send_json(HTTPStatus.OK, {
+                    "status": "ok",
+                    "pending": self.service.queue.pending_count(),
+                    "active": self.service.queue.active_count(),
+                })
+            elif route == ("POST", "generate", 1):
+                job = self.service.submit(self._read_json())
+                self._send_json(HTTPStatus.ACCEPTED, self.service.job_to_dict(job),
+                                {"Location": f"/jobs/{job.id}"})
+            elif route == ("GET", "jobs", 1):
+                self._send_json(HTTPStatus.OK, [self.service.job_to_dict(job)
+                                                for job in self.service.queue.jobs()])
+            elif route[:2] == ("GET", "jobs") and len(parts) == 2:
+                job = self._get_job(parts[1])
+                wait = min(self._number(query, "wait", 0), MAX_WAIT_SECONDS)
+                if wait > 0:
+                    self.service.wait_for(job, wait)
+                self._send_json(HTTPStatus.OK, self.service.job_to_dict(job))
+            elif route[:2] == ("DELETE", "jobs") and len(parts) == 2:
+                job = self._get_job(parts[1])
+                self.service.queue.cancel(job.id)
+                self._send_json(HTTPStatus.OK, self.service.job_to_dict(job))
+            elif route == ("GET", "history", 1):
+                limit = int(max(1, min(self._number(query, "limit", 50), 500)))
+                if query.get("q"):
+                    self._send_json(HTTPStatus.OK, self.service.db.search_images(query["q"], limit))
+                else:
+                    self._send_history_page(query, int(limit))
+            elif route[:2] == ("GET", "images") and len(parts) == 2:
+                self._send_image(self._parse_id(parts[1]))
+            else:
+                self._send_json(HTTPStatus.NOT_FOUND, {"error": f"No route for {method} {url.path}"})
+        except BadRequest as e:
+            self._send_error(HTTPStatus.BAD_REQUEST, {"error": str(e)})
+        except NotFound as e:
+            self._send_error(HTTPStatus.NOT_FOUND, {"error": str(e)})
+        except QueueFull as e:
+            self._send_error(HTTPStatus.SERVICE_UNAVAILABLE, {"error": str(e)}, {"Retry-After": "5"})
+        except (BrokenPipeError, ConnectionResetError):
+            logger.debug(f"Client went away during {method} {url.path}")
+            self.close_connection = True
+        except Exception as e:
+            logger.exception(f"Error handling {method} {url.path}")
+            self._send_error(HTTPStatus.INTERNAL_SERVER_ERROR, {"error": str(e)})
+
+    def _authorized(self) -> bool:
+        expected = f"Bearer {SERVER_TOKEN}".encode("utf-8")
+        # Constant-time comparison, so response timing does not reveal the token
+        return hmac.compare_digest(self.headers.get("Authorization", "").encode("utf-8"), expected)
+
+    def send_response(self, code, message=None):
+        super().send_response(code, message)
+        self._response_started = True
+
+    def _send_error(self, status: HTTPStatus, data: Any, headers: Dict[str, str] = None):
+        """Answer with a JSON error, or drop the connection if a response was already started."""
+        if getattr(self, "_response_started", False):
+            # A status line is buffered or part of a body is on the wire; a second response
+            # would corrupt the stream, so the client can only tell from the connection closing
+            self.close_connection = True
+            return
+        self._send_json(status, data, headers)
+
+    @staticmethod
+    def _parse_id(value: str) -> int:
+        if not value.isdigit():
+            raise NotFound(f"Invalid id: {value}")
+        return int(value)
+
+    @staticmethod
+    def _number(query: Dict[str, str], name: str, default: float) -> float:
+        try:
+            return float(query.get(name) or default)
+        except ValueError:
+            raise BadRequest(f"{name} must be a number")
+
+    def _get_job(self, value: str) -> Job:
+        job = self.service.queue.get(self._parse_id(value))
+        if job is None:
+            raise NotFound(f"Job {value} not found")
+        return job
+
+    def _read_json(self) -> Dict[str, Any]:
+        if "Transfer-Encoding" in self.headers:
+            raise BadRequest("Chunked request bodies are not supported")
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            raise BadRequest("Invalid Content-Length")
+        if length > MAX_BODY_BYTES:
+            raise BadRequest(f"Request body larger than {MAX_BODY_BYTES} bytes")
+        body = self.rfile.read(length)
+        self._body_pending = False
+        try:
+            data = json.loads(body or b"{}")
+        except ValueError:
+            raise BadRequest("Request body is not valid JSON")
+        if not isinstance(data, dict):
+            raise BadRequest("Request body must be a JSON object")
+        return data
+
+    def _send_json(self, status: HTTPStatus, data: Any, headers: Dict[str, str] = None):
+        body = json.dumps(data, ensure_ascii=False, default=str).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        if getattr(self, "_body_pending", False):
+            # Also sets close_connection, so the unread body is dropped with the connection
+            self.send_header("Connection", "close")
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_history_page(self, query: Dict[str, str], limit: int):
+        """One page of history; the Link header points at the next one."""
+        provider = query.get("provider")
+        try:
+            rows, cursor = self.service.db.get_images_page(query.get("after"), limit, provider)
+        except ValueError as e:
+            raise BadRequest(str(e))
+        headers = {}
+        if cursor is not None:
+            params = {"limit": limit, "after": cursor}
+            if provider:
+                params["provider"] = provider
+            headers["Link"] = f'</history?{urlencode(params)}>; rel="next"'
+        self._send_json(HTTPStatus.OK, rows, headers)
+
+    def _send_image(self, image_id: int):
+        """Stream an image file in chunks rather than loading it into memory."""
+        record = self.service.db.get_image(image_id)
+        if record is None:
+            raise NotFound(f"Image {image_id} not found")
+        path = Path(record["filepath"])
+        try:
+            f = open(path, "rb")
+        except OSError:
+            raise NotFound(f"File of image {image_id} is missing")
+
+        with f:
+            size = os.fstat(f.fileno()).st_size
+            self.send_response(HTTPStatus.OK)
+            self.send_header("Content-Type", mimetypes.guess_type(path.name)[0] or "application/octet-stream")
+            self.send_header("Content-Length", str(size))
+            self.send_header("Content-Disposition", content_disposition(record["filename"]))
+            self.send_header("Cache-Control", "private, max-age=86400")
+            self.end_headers()
+            while True:
+                chunk = f.read(FILE_CHUNK_SIZE)
+                if not chunk:
+                    break
+                self.wfile.write(chunk)
+
+    def log_message(self, format, *args):
+        logger.info(f"{self.address_string()} - {format % args}")
+
+
+class ServiceServer(ThreadingHTTPServer):
+    """Threaded HTTP server; each connection is handled on its own thread."""
+
+    daemon_threads = True
+
+    def __init__(self, service: ImageService, address: Tuple[str, int] = (SERVER_HOST, SERVER_PORT)):
+        super().__init__(address, ServiceHandler)
+        self.service = service
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+def run_server_command(args) -> int:
+    """Entry point of `main.py serve`; runs until interrupted."""
+    service = ImageService(workers=args.workers)
+    server = ServiceServer(service, (args.host, args.port))
+    if args.host not in ("127.0.0.1", "localhost") and not SERVER_TOKEN:
+        logger.warning("Serving on a non-local address without server_token; anyone can generate images")
+    # Stop cleanly on SIGTERM too (service managers and containers); shutdown() blocks
+    # until serve_forever returns, so it must not run on the main thread
+    signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=server.shutdown).start())
+    print(f"Image service listening on {server.url} with {args.workers} workers", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.shutdown()
+        logger.info("Image service stopped")
+    return 0
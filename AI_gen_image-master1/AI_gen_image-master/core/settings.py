@@ -133,12 +133,120 @@ APP_CONFIG = load_config()
 
 # Database settings
 DB_PATH = APP_DIR / "history.db"
+# Folder the Generate tab saves into; files there from before it recorded history are imported once
+GENERATED_IMAGES_DIR = Path(os.path.abspath(os.path.dirname(os.path.dirname(__file__)))) / "generated_images"
+# SQLite connection pool: idle connections kept open, seconds to wait for a lock,
+# and pragmas applied to every connection (the database runs in WAL mode)
+DB_POOL_SIZE = APP_CONFIG.get("db_pool_size", 8)
+DB_BUSY_TIMEOUT = APP_CONFIG.get("db_busy_timeout", 10.0)
+DB_SYNCHRONOUS = APP_CONFIG.get("db_synchronous", "NORMAL")  # NORMAL is durable enough with WAL
+DB_CACHE_SIZE_KB = APP_CONFIG.get("db_cache_size_kb", 16384)
+DB_MMAP_SIZE = APP_CONFIG.get("db_mmap_size", 256 * 1024 * 1024)
+# Seconds between PRAGMA optimize runs (planner statistics refresh)
+DB_OPTIMIZE_INTERVAL = APP_CONFIG.get("db_optimize_interval", 3600)
+# History rows are inserted in batches of up to HISTORY_BATCH_SIZE rows, at most
+# HISTORY_FLUSH_SECONDS after they were generated
+HISTORY_BATCH_SIZE = APP_CONFIG.get("history_batch_size", 100)
+HISTORY_FLUSH_SECONDS = APP_CONFIG.get("history_flush_seconds", 1.0)
 
 # Image settings
 DEFAULT_IMAGE_SIZE = (512, 512)
 MAX_IMAGE_SIZE = (1024, 1024)
 SUPPORTED_FORMATS = [".png", ".jpg", ".jpeg"]
 
+# HTTP connection pool settings
+HTTP_POOL_SIZE = APP_CONFIG.get("http_pool_size", 10)
+HTTP_KEEP_ALIVE = APP_CONFIG.get("http_keep_alive", True)
+HTTP_WARM_UP = APP_CONFIG.get("http_warm_up", True)
+
+# Generation result cache
+CACHE_ENABLED = APP_CONFIG.get("cache_enabled", True)
+CACHE_DIR = APP_DIR / "cache"
+CACHE_MAX_BYTES = APP_CONFIG.get("cache_max_mb", 500) * 1024 * 1024
+
+# Share one provider call between identical concurrent requests
+COALESCE_REQUESTS = APP_CONFIG.get("coalesce_requests", True)
+
+# Parse provider responses incrementally instead of buffering the whole body
+STREAM_RESPONSES = APP_CONFIG.get("stream_responses", True)
+
+# Requests per minute allowed for each provider, shared by all callers in the process
+PROVIDER_RATE_LIMITS = APP_CONFIG.get("provider_rate_limits", {
+    "openai": 50,
+    "stability": 150,
+    "gemini": 60,
+})
+RATE_LIMIT_BURST = APP_CONFIG.get("rate_limit_burst", 5)
+
+# Provider failover: other providers are tried in this order when the selected one fails.
+# Keys for providers other than the selected one come from "api_keys" in config.json.
+FAILOVER_ENABLED = APP_CONFIG.get("failover_enabled", True)
+FAILOVER_PROVIDERS = APP_CONFIG.get("failover_providers", ["openai", "stability", "gemini"])
+API_KEYS = APP_CONFIG.get("api_keys", {})
+
+# Circuit breaker: open when at least CIRCUIT_ERROR_THRESHOLD of the requests in the
+# last CIRCUIT_WINDOW_SECONDS failed, then probe again after CIRCUIT_COOLDOWN_SECONDS
+CIRCUIT_WINDOW_SECONDS = APP_CONFIG.get("circuit_window_seconds", 60)
+CIRCUIT_MIN_REQUESTS = APP_CONFIG.get("circuit_min_requests", 5)
+CIRCUIT_ERROR_THRESHOLD = APP_CONFIG.get("circuit_error_threshold", 0.5)
+CIRCUIT_COOLDOWN_SECONDS = APP_CONFIG.get("circuit_cooldown_seconds", 30)
+
+# Timeout of a single HTTP request, and default overall deadline of one generation
+# (all retries and failover included), in seconds
+REQUEST_TIMEOUT = APP_CONFIG.get("request_timeout", 60)
+GENERATION_TIMEOUT = APP_CONFIG.get("generation_timeout", 180)
+
+# Maximum number of in-flight requests per provider for concurrent generation
+PROVIDER_CONCURRENCY = APP_CONFIG.get("provider_concurrency", {
+    "openai": 5,
+    "stability": 4,
+    "gemini": 4,
+})
+
+# Record/replay of provider traffic: "off", "record" (save every request/response pair
+# to the cassette) or "replay" (serve responses from the cassette without network access).
+# Replayed responses wait for the originally observed latency unless
+# CASSETTE_REPLAY_LATENCY is off.
+CASSETTE_MODE = APP_CONFIG.get("cassette_mode", "off")
+CASSETTE_DIR = Path(APP_CONFIG.get("cassette_dir", APP_DIR / "cassettes"))
+CASSETTE_REPLAY_LATENCY = APP_CONFIG.get("cassette_replay_latency", True)
+
+# Write the pipeline timing metrics to this file on exit (Prometheus text for
+# .prom/.txt, JSON otherwise); unset to disable
+METRICS_FILE = APP_CONFIG.get("metrics_file")
+
+# Built-in "local" provider: synthetic images for offline load testing.
+# Each request takes LOCAL_PROVIDER_LATENCY +/- LOCAL_PROVIDER_JITTER seconds and
+# fails with probability LOCAL_PROVIDER_FAILURE_RATE.
+LOCAL_PROVIDER = APP_CONFIG.get("local_provider", {})
+LOCAL_PROVIDER_LATENCY = LOCAL_PROVIDER.get("latency", 0.5)
+LOCAL_PROVIDER_JITTER = LOCAL_PROVIDER.get("jitter", 0.2)
+LOCAL_PROVIDER_FAILURE_RATE = LOCAL_PROVIDER.get("failure_rate", 0.0)
+
+# Generation job queue of the Generate tab: worker threads and maximum pending jobs
+JOB_WORKERS = APP_CONFIG.get("job_workers", 2)
+JOB_QUEUE_MAX = APP_CONFIG.get("job_queue_max", 100)
+
+# Format of saved images. "original" writes the provider's bytes unchanged (no decode
+# or re-encode); "png", "webp" or "jpeg" convert images in any other format, using the
+# options below. Images already in the target format are always copied as-is.
+SAVE_FORMAT = APP_CONFIG.get("save_format", "original")
+PNG_COMPRESS_LEVEL = APP_CONFIG.get("png_compress_level", 6)  # 0 (fast, large) .. 9 (slow, small)
+WEBP_LOSSLESS = APP_CONFIG.get("webp_lossless", True)
+WEBP_QUALITY = APP_CONFIG.get("webp_quality", 80)  # Quality when lossy, compression effort when lossless
+JPEG_QUALITY = APP_CONFIG.get("jpeg_quality", 90)
+# Threads encoding and writing images in the background
+IMAGE_WRITER_WORKERS = APP_CONFIG.get("image_writer_workers", 2)
+
+# HTTP service mode (python main.py serve). Requests must carry
+# "Authorization: Bearer <server_token>" when a token is set.
+SERVER_HOST = APP_CONFIG.get("server_host", "127.0.0.1")
+SERVER_PORT = APP_CONFIG.get("server_port", 8600)
+SERVER_WORKERS = APP_CONFIG.get("server_workers", 4)
+SERVER_TOKEN = APP_CONFIG.get("server_token", "")
+# Finished jobs kept for status queries before the oldest are forgotten
+SERVER_JOB_HISTORY = APP_CONFIG.get("server_job_history", 1000)
+
 # UI settings - load from config
 DARK_MODE = APP_CONFIG.get("dark_mode", True)
 API_PROVIDER = APP_CONFIG.get("api_provider", "openai")
@@ -0,0 +1,122 @@
+import asyncio
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Awaitable
+
+from core.cancel import CancelToken
+
+logger = logging.getLogger(__name__)
+
+class _Call:
+    """One shared in-flight call."""
+
+    def __init__(self, deadline: float = None):
+        self.future = Future()
+        self.token = CancelToken()
+        # Per-request timeouts of the shared call are cut short by the latest waiter's deadline
+        self.token.deadline = deadline
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Coalesce identical concurrent calls so only one of them does the work.
+
+    The first caller for a key starts the call on a background thread; every
+    caller (including the first) waits on the shared Future. A caller whose
+    cancel token fires stops waiting without cancelling the call for the
+    others; only when every waiter has gone is the shared call's own token
+    cancelled. The shared token's deadline is the latest of the waiters'
+    deadlines (none if any waiter has none), so a caller with a short
+    timeout never cuts the call short for the others.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+        self.coalesced = 0
+
+    def do(self, key: str, fn: Callable[[CancelToken], Any], cancel_token: CancelToken = None) -> Any:
+        """Run fn(shared_token) once per key at a time and return its result to every caller."""
+        with self._lock:
+            deadline = cancel_token.deadline if cancel_token is not None else None
+            call = self._calls.get(key)
+            if call is not None and call.token.expired:
+                # Already failing on an earlier caller's deadline; start over for this one
+                call = None
+            leader = call is None
+            if leader:
+                call = _Call(deadline)
+                self._calls[key] = call
+            else:
+                self.coalesced += 1
+                call.token.extend(deadline)
+            call.waiters += 1
+
+        if leader:
+            thread = threading.Thread(target=self._run, args=(key, fn, call))
+            thread.daemon = True
+            thread.start()
+        else:
+            logger.info(f"Waiting for in-flight request {key[:12]}")
+
+        try:
+            if cancel_token is None:
+                return call.future.result()
+            return cancel_token.wait_future(call.future)
+        finally:
+            with self._lock:
+                call.waiters -= 1
+                abandoned = call.waiters == 0 and not call.future.done()
+                if abandoned and self._calls.get(key) is call:
+                    # New callers must not join a call that is being cancelled
+                    del self._calls[key]
+            if abandoned:
+                logger.info(f"All callers left request {key[:12]}, cancelling it")
+                call.token.cancel()
+
+    def _run(self, key: str, fn: Callable[[CancelToken], Any], call: _Call):
+        try:
+            result = fn(call.token)
+        except BaseException as e:
+            call.future.set_exception(e)
+        else:
+            call.future.set_result(result)
+        finally:
+            with self._lock:
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+
+    def in_flight(self) -> int:
+        """Number of distinct calls currently running."""
+        with self._lock:
+            return len(self._calls)
+
+
+class AsyncSingleFlight:
+    """Asyncio counterpart of SingleFlight for use on one event loop.
+
+    The shared call runs as its own task and waiters are shielded, so
+    cancelling one waiter leaves the call running for the others.
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, asyncio.Task] = {}
+        self.coalesced = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Await fn once per key at a time and return its result to every caller."""
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        else:
+            self.coalesced += 1
+            logger.info(f"Waiting for in-flight request {key[:12]}")
+
+        return await asyncio.shield(task)
+
+    def _forget(self, key: str, task: asyncio.Task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
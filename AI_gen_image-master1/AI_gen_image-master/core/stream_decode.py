@@ -0,0 +1,226 @@
+import json
+import time
+import base64
+import logging
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+from core.metrics import record_stage
+
+logger = logging.getLogger(__name__)
+
+# JSON keys whose string values hold base64 image data in provider responses
+IMAGE_FIELDS = ("b64_json", "base64", "data")
+
+# Decode base64 in blocks of this many characters (must be a multiple of 4)
+DECODE_BLOCK = 64 * 1024
+
+# Placeholder written into the JSON skeleton in place of each image field
+BLOB_PREFIX = "__blob_"
+
+_WHITESPACE = b" \t\r\n"
+_ESCAPES = {ord("/"): b"/", ord("\\"): b"\\", ord('"'): b'"'}
+
+
+def is_blob(value: Any) -> bool:
+    """True if a skeleton value is a placeholder for a decoded image field."""
+    return isinstance(value, str) and value.startswith(BLOB_PREFIX)
+
+
+class StreamingResponseDecoder:
+    """Incrementally parse a provider JSON response, decoding image fields on the fly.
+
+    Everything except base64 image values is copied into a small JSON
+    "skeleton"; each image value is replaced by a placeholder and decoded in
+    blocks into its own bytearray, so the raw body and the base64 text are never
+    held in memory as a whole.
+    """
+
+    def __init__(self, image_fields: Tuple[str, ...] = IMAGE_FIELDS):
+        self.image_fields = set(image_fields)
+        self.blobs: Dict[str, bytearray] = {}
+
+        self._skeleton = bytearray()
+        self._stack = []  # "{" or "[" for each open container
+        self._expect_key = False
+        self._last_key: Optional[str] = None
+
+        # String scanning state
+        self._in_string = False
+        self._string_is_key = False
+        self._escape = False
+        self._key_buffer = bytearray()
+
+        # Image field decoding state
+        self._blob: Optional[bytearray] = None
+        self._b64_pending = bytearray()
+
+        # Time spent scanning JSON and decoding base64, in seconds
+        self.parse_seconds = 0.0
+        self.decode_seconds = 0.0
+
+    def feed(self, chunk: bytes):
+        """Consume the next chunk of the response body."""
+        started = time.perf_counter()
+        decode_before = self.decode_seconds
+        try:
+            self._feed(chunk)
+        finally:
+            self.parse_seconds += time.perf_counter() - started - (self.decode_seconds - decode_before)
+
+    def _feed(self, chunk: bytes):
+        i = 0
+        n = len(chunk)
+        while i < n:
+            if self._blob is not None:
+                i = self._feed_blob(chunk, i)
+                continue
+
+            c = chunk[i]
+            if self._in_string:
+                self._skeleton.append(c)
+                if self._string_is_key:
+                    if self._escape:
+                        self._escape = False
+                        self._key_buffer.append(c)
+                    elif c == 0x5C:  # backslash
+                        self._escape = True
+                        self._key_buffer.append(c)
+                    elif c == 0x22:  # closing quote
+                        self._in_string = False
+                        self._last_key = json.loads(b'"' + bytes(self._key_buffer) + b'"')
+                    else:
+                        self._key_buffer.append(c)
+                else:
+                    if self._escape:
+                        self._escape = False
+                    elif c == 0x5C:
+                        self._escape = True
+                    elif c == 0x22:
+                        self._in_string = False
+                i += 1
+                continue
+
+            if c == 0x22:  # opening quote
+                in_object = bool(self._stack) and self._stack[-1] == "{"
+                if in_object and self._expect_key:
+                    self._in_string = True
+                    self._string_is_key = True
+                    self._key_buffer = bytearray()
+                    self._expect_key = False
+                    self._skeleton.append(c)
+                elif in_object and self._last_key in self.image_fields:
+                    self._start_blob()
+                else:
+                    self._in_string = True
+                    self._string_is_key = False
+                    self._skeleton.append(c)
+                i += 1
+                continue
+
+            if c == 0x7B:  # {
+                self._stack.append("{")
+                self._expect_key = True
+            elif c == 0x5B:  # [
+                self._stack.append("[")
+            elif c in (0x7D, 0x5D):  # } or ]
+                if self._stack:
+                    self._stack.pop()
+                self._expect_key = False
+            elif c == 0x2C:  # ,
+                self._expect_key = bool(self._stack) and self._stack[-1] == "{"
+            self._skeleton.append(c)
+            i += 1
+
+    def _start_blob(self):
+        name = f"{BLOB_PREFIX}{len(self.blobs)}"
+        self._blob = bytearray()
+        self.blobs[name] = self._blob
+        self._b64_pending = bytearray()
+        self._skeleton += f'"{name}"'.encode("ascii")
+
+    def _feed_blob(self, chunk: bytes, i: int) -> int:
+        """Copy base64 text into the pending buffer until the closing quote; return the new offset."""
+        n = len(chunk)
+        while i < n:
+            if self._escape:
+                self._escape = False
+                replacement = _ESCAPES.get(chunk[i])
+                if replacement is not None:
+                    self._b64_pending += replacement
+                i += 1  # \n, \r etc. are line breaks in MIME base64 and are dropped
+                continue
+
+            end = chunk.find(b'"', i)
+            stop = n if end == -1 else end
+            backslash = chunk.find(b"\\", i, stop)
+            if backslash != -1:
+                stop = backslash
+            self._b64_pending += chunk[i:stop]
+            self._decode_pending(final=False)
+
+            if stop == backslash:
+                self._escape = True
+                i = stop + 1
+            elif end != -1:
+                self._decode_pending(final=True)
+                self._blob = None
+                return end + 1
+            else:
+                i = n
+        return i
+
+    def _decode_pending(self, final: bool):
+        pending = self._b64_pending.translate(None, _WHITESPACE)
+        if final:
+            usable = len(pending)
+        else:
+            if len(pending) < DECODE_BLOCK:
+                self._b64_pending = pending
+                return
+            usable = len(pending) - len(pending) % 4
+        if usable:
+            started = time.perf_counter()
+            self._blob += base64.b64decode(bytes(pending[:usable]))
+            self.decode_seconds += time.perf_counter() - started
+        self._b64_pending = pending[usable:]
+
+    def result(self) -> Tuple[Dict[str, Any], Dict[str, bytearray]]:
+        """Return the parsed skeleton and the decoded image fields."""
+        if self._blob is not None or self._in_string or self._stack:
+            raise ValueError("Incomplete JSON response")
+        return json.loads(bytes(self._skeleton)), self.blobs
+
+
+def decode_stream(chunks: Iterable[bytes],
+                  total: Optional[int] = None,
+                  progress: Callable[[int, Optional[int]], None] = None,
+                  sink=None) -> Tuple[Dict[str, Any], Dict[str, bytearray]]:
+    """Decode a whole response body from an iterable of chunks.
+
+    progress, if given, is called with (bytes_received, total_bytes) after each
+    chunk; total is None when the server sent no Content-Length. sink, if given,
+    receives a copy of every raw chunk (e.g. a cache file).
+
+    Records the download, json_parse and base64_decode stages in the metrics.
+    """
+    decoder = StreamingResponseDecoder()
+    received = 0
+    started = time.perf_counter()
+    for chunk in chunks:
+        if not chunk:
+            continue
+        decoder.feed(chunk)
+        if sink is not None:
+            sink.write(chunk)
+        received += len(chunk)
+        if progress is not None:
+            progress(received, total)
+    record_decoder_stages(decoder, time.perf_counter() - started)
+    return decoder.result()
+
+
+def record_decoder_stages(decoder: StreamingResponseDecoder, elapsed: float):
+    """Split the time spent reading a streamed body into download, JSON parsing and base64 decoding."""
+    record_stage("download", max(0.0, elapsed - decoder.parse_seconds - decoder.decode_seconds))
+    record_stage("json_parse", decoder.parse_seconds)
+    record_stage("base64_decode", decoder.decode_seconds)
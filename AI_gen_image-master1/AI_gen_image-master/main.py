@@ -1,10 +1,16 @@
 import os
 import sys
 import logging
+import argparse
 from pathlib import Path
 
-from ui.main_window import MainWindow
-from core.settings import ensure_dirs, DB_PATH
+from core.db import close_history_recorder, close_pools
+from core.image_writer import shutdown_image_writer
+from core.metrics import get_metrics
+from core.settings import (
+    ensure_dirs, DB_PATH, METRICS_FILE, GENERATION_TIMEOUT,
+    SERVER_HOST, SERVER_PORT, SERVER_WORKERS
+)
 
 # Configure logging
 logging.basicConfig(
@@ -39,18 +45,61 @@ def setup_app():
         # Running as a bundled executable
         logger.info(f"Running from PyInstaller bundle: {sys._MEIPASS}")
 
-def main():
+def parse_args(argv=None):
+    """Parse the command line; without a command the GUI is started."""
+    parser = argparse.ArgumentParser(description="AI Image Generator")
+    commands = parser.add_subparsers(dest="command")
+    
+    batch = commands.add_parser("batch", help="generate images for every prompt in a CSV or JSONL file")
+    batch.add_argument("prompts", type=Path, help="CSV (with header) or JSONL file of prompts")
+    batch.add_argument("-c", "--concurrency", type=int, default=4, help="requests in flight at once")
+    batch.add_argument("-p", "--provider", help="provider for rows that do not name one")
+    batch.add_argument("-o", "--output", type=Path, help="directory for the images (default: save directory)")
+    batch.add_argument("--results", type=Path, help="JSONL file with one result line per prompt")
+    batch.add_argument("--timeout", type=float, default=GENERATION_TIMEOUT, help="seconds allowed per prompt")
+    batch.add_argument("--no-db", action="store_true", help="do not record the images in the history database")
+    
+    serve = commands.add_parser("serve", help="run the HTTP generation and history service")
+    serve.add_argument("--host", default=SERVER_HOST, help="address to listen on")
+    serve.add_argument("--port", type=int, default=SERVER_PORT)
+    serve.add_argument("-w", "--workers", type=int, default=SERVER_WORKERS, help="generation worker threads")
+    
+    return parser.parse_args(argv)
+
+def run_gui():
+    # Imported here so the batch and serve commands never load customtkinter
+    from ui.main_window import MainWindow
+    
+    app = MainWindow()
+    app.mainloop()
+
+def main(argv=None):
     """Application entry point."""
+    args = parse_args(argv)
     try:
         # Setup
         setup_app()
         
+        if args.command == "batch":
+            from core.batch import run_batch_command
+            return run_batch_command(args)
+        if args.command == "serve":
+            from core.server import run_server_command
+            return run_server_command(args)
+        
         # Start the UI
-        app = MainWindow()
-        app.mainloop()
+        run_gui()
+        return 0
     except Exception as e:
         logger.exception(f"Unhandled exception: {str(e)}")
         raise
+    finally:
+        # Let background image writes finish, then commit their history rows
+        shutdown_image_writer()
+        close_history_recorder()
+        close_pools()
+        if METRICS_FILE:
+            get_metrics().dump(METRICS_FILE)
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    sys.exit(main()) 
\ No newline at end of file
@@ -9,7 +9,7 @@ from typing import Optional, Tuple
 import uuid
 
 from core.image_editor import ImageEditor
-from core.db import Database
+from core.db import get_database
 from core.settings import ensure_dirs
 
 logger = logging.getLogger(__name__)
@@ -20,7 +20,7 @@ class EditTab:
     def __init__(self, parent, main_window):
         self.parent = parent
         self.main_window = main_window
-        self.db = Database()
+        self.db = get_database()
         
         self.frame = None
         self.canvas = None
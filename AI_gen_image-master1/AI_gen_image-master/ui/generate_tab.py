@@ -1,19 +1,33 @@
 import os
+import time
 import threading
 import logging
 import tkinter as tk
 from pathlib import Path
 from typing import Optional
-from PIL import Image, ImageTk
+from PIL import ImageTk
 
 import customtkinter as ctk
 
 from core.api_client import APIClient
-from core.db import Database
-from core.settings import ensure_dirs, DEFAULT_IMAGE_SIZE, API_PROVIDER, APP_CONFIG
+from core.db import get_database, get_history_recorder, history_row
+from core.generated_image import GeneratedImage
+from core.image_writer import get_image_writer, output_format, unique_filename
+from core.job_queue import JobQueue, QueueFull, QUEUED, RUNNING, DONE, FAILED, CANCELLED
+from core.providers import get_provider
+from core.settings import ensure_dirs, DEFAULT_IMAGE_SIZE, API_PROVIDER, APP_CONFIG, GENERATED_IMAGES_DIR
 
 logger = logging.getLogger(__name__)
 
+# Largest size of the preview shown in the tab
+PREVIEW_SIZE = (512, 512)
+# Gợi ý prompt tương tự đã sinh trước đó: số gợi ý, độ tương đồng tối thiểu,
+# độ dài prompt tối thiểu và độ trễ (ms) sau lần gõ phím cuối
+SUGGESTION_COUNT = 3
+SUGGESTION_MIN_SIMILARITY = 0.4
+SUGGESTION_MIN_LENGTH = 8
+SUGGESTION_DELAY_MS = 300
+
 class GenerateTab:
     """Tab for generating images from text prompts."""
     
@@ -27,23 +41,32 @@ class GenerateTab:
             provider=APP_CONFIG.get("api_provider", None)
         )
         
-        self.db = Database()
+        self.db = get_database()
         self.frame = None
         self.preview_image = None
         self.generated_image = None
         self.generated_path = None
         
+        # Generations run on a worker pool so new prompts can be queued while others run
+        self.job_queue = JobQueue(self._run_job)
+        self.job_queue.add_listener(self._on_job_changed)
+        self._queue_refresh_pending = False
+        self._queue_rows = {}
+        self._suggest_job = None
+        self._suggest_seq = 0
+        
         self._create_widgets()
     
     def _create_widgets(self):
         """Create the UI elements for the generate tab."""
         self.frame = ctk.CTkFrame(self.parent)
         self.frame.grid_columnconfigure(0, weight=1)
+        self.frame.grid_columnconfigure(1, weight=0)
         self.frame.grid_rowconfigure(1, weight=1)
         
         # Input frame (top)
         input_frame = ctk.CTkFrame(self.frame)
-        input_frame.grid(row=0, column=0, padx=10, pady=10, sticky="ew")
+        input_frame.grid(row=0, column=0, columnspan=2, padx=10, pady=10, sticky="ew")
         input_frame.grid_columnconfigure(1, weight=1)
         
         # Prompt label
@@ -65,6 +88,7 @@ class GenerateTab:
         )
         self.prompt_entry.grid(row=0, column=1, padx=10, pady=10, sticky="ew")
         self.prompt_entry.bind("<Return>", lambda event: self._on_generate())  # Bind Enter key to generate
+        self.prompt_var.trace_add("write", self._on_prompt_changed)
         
         # Negative prompt label
         neg_prompt_label = ctk.CTkLabel(
@@ -85,6 +109,11 @@ class GenerateTab:
         )
         self.neg_prompt_entry.grid(row=1, column=1, padx=10, pady=10, sticky="ew")
         
+        # Ảnh cũ có prompt tương tự - dùng lại thay vì trả tiền sinh ảnh mới (ẩn khi không có)
+        self.suggestions_frame = ctk.CTkFrame(input_frame, fg_color="transparent")
+        self.suggestions_frame.grid(row=3, column=0, columnspan=3, padx=10, pady=(0, 10), sticky="ew")
+        self.suggestions_frame.grid_remove()
+        
         # Size selection
         size_label = ctk.CTkLabel(
             input_frame,
@@ -106,7 +135,17 @@ class GenerateTab:
         )
         self.size_dropdown.grid(row=2, column=1, padx=10, pady=10, sticky="w")
         
-        # Generate button
+        # Priority: high-priority jobs jump ahead of normal ones in the queue
+        self.priority_var = ctk.BooleanVar(value=False)
+        self.priority_check = ctk.CTkCheckBox(
+            input_frame,
+            text="High priority",
+            variable=self.priority_var,
+            font=ctk.CTkFont(size=13)
+        )
+        self.priority_check.grid(row=2, column=1, padx=(180, 10), pady=10, sticky="w")
+        
+        # Generate button (adds the prompt to the queue)
         generate_btn = ctk.CTkButton(
             input_frame,
             text="Generate",
@@ -118,6 +157,20 @@ class GenerateTab:
         )
         generate_btn.grid(row=2, column=1, padx=10, pady=10, sticky="e")
         
+        # Cancel button (enabled while jobs are queued or running)
+        self.cancel_btn = ctk.CTkButton(
+            input_frame,
+            text="Cancel All",
+            font=ctk.CTkFont(size=14),
+            height=35,
+            width=90,
+            fg_color=["#D32F2F", "#D32F2F"],
+            hover_color=["#B71C1C", "#B71C1C"],
+            state="disabled",
+            command=self._on_cancel
+        )
+        self.cancel_btn.grid(row=2, column=2, padx=(0, 10), pady=10, sticky="e")
+        
         # Preview frame (center)
         preview_frame = ctk.CTkFrame(self.frame)
         preview_frame.grid(row=1, column=0, padx=10, pady=10, sticky="nsew")
@@ -131,10 +184,39 @@ class GenerateTab:
             highlightthickness=0
         )
         self.canvas.grid(row=0, column=0, sticky="nsew", padx=10, pady=10)
+        # Nhấp đúp vào preview để xem ảnh ở độ phân giải đầy đủ
+        self.canvas.bind("<Double-Button-1>", self._on_open_full_image)
+        
+        # Queue panel (right)
+        queue_frame = ctk.CTkFrame(self.frame, width=320)
+        queue_frame.grid(row=1, column=1, padx=(0, 10), pady=10, sticky="ns")
+        queue_frame.grid_rowconfigure(1, weight=1)
+        queue_frame.grid_columnconfigure(0, weight=1)
+        
+        self.queue_title = ctk.CTkLabel(
+            queue_frame,
+            text="Queue",
+            font=ctk.CTkFont(size=14, weight="bold")
+        )
+        self.queue_title.grid(row=0, column=0, padx=10, pady=(10, 5), sticky="w")
+        
+        clear_btn = ctk.CTkButton(
+            queue_frame,
+            text="Clear finished",
+            font=ctk.CTkFont(size=12),
+            width=100,
+            height=28,
+            command=self._on_clear_finished
+        )
+        clear_btn.grid(row=0, column=1, padx=10, pady=(10, 5), sticky="e")
+        
+        self.queue_list = ctk.CTkScrollableFrame(queue_frame, width=300)
+        self.queue_list.grid(row=1, column=0, columnspan=2, padx=5, pady=(0, 10), sticky="nsew")
+        self.queue_list.grid_columnconfigure(0, weight=1)
         
         # Action buttons frame (bottom)
         action_frame = ctk.CTkFrame(self.frame)
-        action_frame.grid(row=2, column=0, padx=10, pady=(0, 10), sticky="ew")
+        action_frame.grid(row=2, column=0, columnspan=2, padx=10, pady=(0, 10), sticky="ew")
         action_frame.grid_columnconfigure(0, weight=1)
         action_frame.grid_columnconfigure(1, weight=0)
 
@@ -158,24 +240,15 @@ class GenerateTab:
             font=ctk.CTkFont(size=12)
         )
         self.progress_label.grid(row=0, column=2, padx=10, pady=10, sticky="e")
+        
+        self._refresh_queue_panel()
     
     def _get_size_options_for_provider(self, provider):
         """Get size options based on the provider."""
-        if provider == "openai":
-            return ["256x256", "512x512", "1024x1024"]
-        elif provider == "stability":
-            return [
-                "1024x1024",
-                "1152x896",
-                "1216x832",
-                "1344x768",
-                "1536x640",
-                "768x1344",
-                "832x1216",
-                "896x1152"
-            ]
-        else:
-            return [f"{DEFAULT_IMAGE_SIZE}x{DEFAULT_IMAGE_SIZE}"]
+        plugin = get_provider(provider)
+        if plugin is not None and plugin.supported_sizes:
+            return plugin.size_options()
+        return [f"{DEFAULT_IMAGE_SIZE[0]}x{DEFAULT_IMAGE_SIZE[1]}"]
     
     def update_size_options(self, provider):
         """Update size options based on the selected provider."""
@@ -184,107 +257,366 @@ class GenerateTab:
         self.size_dropdown.configure(values=self.size_options)
     
     def _on_generate(self):
-        """Handle generate button click."""
+        """Handle generate button click: add the prompt to the job queue."""
         prompt = self.prompt_var.get().strip()
         if not prompt:
             self.main_window.show_error("Error", "Please enter a prompt")
             return
         
-        # Disable UI during generation
-        self._set_ui_state(False)
-        self.status_label.configure(text="Generating image...")
-        self.main_window.set_status("Generating image...")
-        
-        # Show loading bar
-        self.loading_bar.grid()
-        self.loading_bar.start()
-        
         # Parse size
         size_str = self.size_var.get()
         width, height = map(int, size_str.split("x"))
         
         # Get negative prompt if any
         negative_prompt = self.neg_prompt_var.get().strip() or None
+        priority = 1 if self.priority_var.get() else 0
+        
+        try:
+            job = self.job_queue.submit(prompt, (width, height), negative_prompt, priority=priority)
+        except QueueFull as e:
+            self.main_window.show_error("Queue full", str(e))
+            return
+        
+        message = f"Queued job #{job.id} ({self.job_queue.pending_count()} waiting)"
+        self.status_label.configure(text=message)
+        self.main_window.set_status(message)
+
+    def _on_prompt_changed(self, *args):
+        """Look up similar earlier prompts once typing pauses."""
+        if self._suggest_job is not None:
+            self.frame.after_cancel(self._suggest_job)
+        self._suggest_job = self.frame.after(SUGGESTION_DELAY_MS, self._lookup_suggestions)
+    
+    def _lookup_suggestions(self):
+        self._suggest_job = None
+        self._suggest_seq += 1
+        seq = self._suggest_seq
+        prompt = self.prompt_var.get().strip()
+        if len(prompt) < SUGGESTION_MIN_LENGTH:
+            self._show_suggestions(seq, [])
+            return
+        
+        def lookup():
+            try:
+                rows = self.db.similar_prompts(prompt, SUGGESTION_COUNT, SUGGESTION_MIN_SIMILARITY)
+            except Exception as e:
+                logger.error(f"Similar prompt lookup failed: {str(e)}")
+                rows = []
+            self.frame.after(0, lambda: self._show_suggestions(seq, rows))
         
-        # Start generation in a separate thread to keep UI responsive
-        thread = threading.Thread(
-            target=self._generate_image_thread,
-            args=(prompt, (width, height), negative_prompt)
+        # Tra cứu ở luồng nền để ô nhập không bị khựng
+        threading.Thread(target=lookup, daemon=True).start()
+    
+    def _show_suggestions(self, seq, rows):
+        if seq != self._suggest_seq:
+            return  # A newer lookup is on its way
+        for widget in self.suggestions_frame.winfo_children():
+            widget.destroy()
+        if not rows:
+            self.suggestions_frame.grid_remove()
+            return
+        
+        ctk.CTkLabel(
+            self.suggestions_frame,
+            text="Similar:",
+            font=ctk.CTkFont(size=12)
+        ).pack(side=tk.LEFT, padx=(0, 5))
+        for row in rows:
+            text = row["prompt"] if len(row["prompt"]) <= 40 else row["prompt"][:40] + "..."
+            ctk.CTkButton(
+                self.suggestions_frame,
+                text=f"{row['similarity']:.0%} {text}",
+                height=26,
+                fg_color="transparent",
+                border_width=1,
+                text_color=("gray10", "gray90"),
+                command=lambda row=row: self._on_use_suggestion(row)
+            ).pack(side=tk.LEFT, padx=5)
+        self.suggestions_frame.grid()
+    
+    def _on_use_suggestion(self, row):
+        """Show an earlier image in the preview instead of generating a new one."""
+        path = row["filepath"]
+        
+        def load():
+            try:
+                with open(path, "rb") as f:
+                    image = GeneratedImage(f.read(), provider=row["provider"])
+                result = {"image": image, "path": path, "preview": self._make_preview(image)}
+            except Exception as e:
+                logger.error(f"Failed to open earlier image {path}: {str(e)}")
+                self.frame.after(0, lambda: self.status_label.configure(text=f"Cannot open {os.path.basename(path)}"))
+                return
+            self.frame.after(0, lambda: self._show_earlier_image(result, row))
+        
+        threading.Thread(target=load, daemon=True).start()
+    
+    def _show_earlier_image(self, result, row):
+        self._update_preview(result)
+        message = f"Showing earlier image #{row['id']} ({row['created_at']}): {row['prompt'][:60]}"
+        self.status_label.configure(text=message)
+        self.main_window.set_status(message)
+    
+    def _on_cancel(self):
+        """Handle cancel button click: cancel every queued and running job."""
+        self.job_queue.cancel_all()
+        self.status_label.configure(text="Cancelling...")
+    
+    def _on_clear_finished(self):
+        """Remove finished jobs from the queue panel."""
+        self.job_queue.clear_finished()
+        self._refresh_queue_panel()
+
+    def _run_job(self, job):
+        """Generate and save the image of one job (runs on a queue worker thread)."""
+        # Kiểm tra kích thước hợp lệ
+        valid_sizes = self._get_size_options_for_provider(self.api_client.provider)
+        size_str = f"{job.size[0]}x{job.size[1]}"
+        if size_str not in valid_sizes:
+            raise ValueError(f"Invalid size {size_str}. Allowed sizes: {', '.join(valid_sizes)}")
+        
+        # Gọi API để tạo hình ảnh
+        logger.info(f"Sending request to API for job {job.id}...")
+        started = time.perf_counter()
+        images = self.api_client.generate_images(
+            prompt=job.prompt,
+            size=job.size,
+            negative_prompt=job.negative_prompt,
+            progress=lambda received, total: self._on_download_progress(job, received, total),
+            cancel_token=job.cancel_token,
+            # Bấm Generate lại với cùng prompt phải sinh ảnh mới, không lấy lại ảnh cũ từ cache
+            use_cache=False
         )
-        thread.daemon = True
-        thread.start()
+        image = images[0] if images else None
+        
+        if image is None:
+            raise ValueError("Failed to generate image. API returned None.")
+        
+        # Lưu hình ảnh vào thư mục `generated_images`
+        save_dir = str(GENERATED_IMAGES_DIR)
+        os.makedirs(save_dir, exist_ok=True)  # Tạo thư mục nếu chưa tồn tại
+        
+        # Tên file duy nhất (prompt + thời gian + mã ngẫu nhiên) nên không bao giờ ghi đè ảnh cũ
+        writer = get_image_writer()
+        image_path = os.path.join(save_dir, unique_filename(job.prompt, writer.extension(image)))
+        metadata = {
+            "source": "generate_tab",
+            "job_id": job.id,
+            "requested_provider": self.api_client.provider,
+            "requested_size": size_str,
+            "negative_prompt": job.negative_prompt,
+            "priority": job.priority,
+            "queued_seconds": round(job.started_at - job.created_at, 3),
+            "generation_seconds": round(time.perf_counter() - started, 3),
+            "format": output_format(image),
+        }
+        
+        # Ghi ảnh ở luồng nền - preview được hiển thị ngay, không chờ mã hoá và ghi đĩa
+        submitted = time.perf_counter()
+        future = writer.submit(image, image_path)
+        future.add_done_callback(lambda f: self._on_image_written(job, image, f, metadata, submitted))
+        
+        # Giải mã và thu nhỏ ảnh preview ngay trên luồng worker, từ dữ liệu trong bộ nhớ
+        return {"image": image, "path": image_path, "preview": self._make_preview(image)}
+    
+    @staticmethod
+    def _make_preview(generated):
+        """Display-sized copy of a generated image, ready to wrap in a PhotoImage."""
+        preview = generated.loaded().copy()
+        preview.thumbnail(PREVIEW_SIZE)
+        if preview.mode not in ("RGB", "RGBA"):
+            preview = preview.convert("RGBA" if "A" in preview.getbands() or "transparency" in preview.info else "RGB")
+        return preview
 
-    def _set_ui_state(self, enabled):
-        """Enable or disable UI elements."""
-        state = "normal" if enabled else "disabled"
-        self.prompt_entry.configure(state=state)
-        self.neg_prompt_entry.configure(state=state)
-        self.size_dropdown.configure(state=state)
+    def _on_image_written(self, job, image, future, metadata, submitted):
+        """Record a written image in the history and report it (called on the writer thread)."""
+        error = future.exception()
+        if error is not None:
+            message = f"Failed to save image of job #{job.id}: {error}"
+        else:
+            path = future.result()
+            # Chỉ ghi vào lịch sử khi file đã nằm trên đĩa; các dòng được ghi DB theo lô
+            get_history_recorder().add([history_row(
+                job.prompt, path, image.provider or self.api_client.provider, image.width, image.height,
+                {**metadata, "save_seconds": round(time.perf_counter() - submitted, 3),
+                 "file_size": os.path.getsize(path)}
+            )])
+            message = f"Image saved to {path}"
+        self.frame.after(0, lambda: self._show_saved(message))
+    
+    def _show_saved(self, message):
+        self.main_window.set_status(message)
+        self.main_window.update_history()
 
-    def _generate_image_thread(self, prompt, size, negative_prompt=None):
-        """Generate image in a background thread."""
-        try:
-            # Kiểm tra kích thước hợp lệ
-            valid_sizes = self._get_size_options_for_provider(self.api_client.provider)
-            size_str = f"{size[0]}x{size[1]}"
-            if size_str not in valid_sizes:
-                raise ValueError(f"Invalid size {size_str}. Allowed sizes: {', '.join(valid_sizes)}")
-            
-            # Gọi API để tạo hình ảnh
-            logger.info("Sending request to API...")
-            image = self.api_client.generate_image(
-                prompt=prompt,
-                size=size,
-                negative_prompt=negative_prompt
-            )
-            
-            if image is None:
-                raise ValueError("Failed to generate image. API returned None.")
-            
-            # Lưu hình ảnh vào thư mục `generated_images`
-            base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
-            save_dir = os.path.join(base_dir, "generated_images")
-            os.makedirs(save_dir, exist_ok=True)  # Tạo thư mục nếu chưa tồn tại
-            
-            # Tạo tên file dựa trên prompt và kích thước
-            image_filename = f"{prompt.replace(' ', '_')[:50]}_{size[0]}x{size[1]}.png"
-            image_path = os.path.join(save_dir, image_filename)
-            
-            # Lưu ảnh
-            image.save(image_path)
-            logger.info(f"Image saved to: {image_path}")
-            
-            # Cập nhật giao diện với hình ảnh mới
-            self.frame.after(0, lambda: self._update_preview(image_path))
-            self.frame.after(0, lambda: self._set_ui_state(True))
-            self.frame.after(0, lambda: self.status_label.configure(text="Image generated successfully"))
-            self.frame.after(0, lambda: self.main_window.set_status("Image generated successfully"))
-        except Exception as e:
-            logger.exception("Error generating image")
-            self.frame.after(0, lambda: self._set_ui_state(True))
-            self.frame.after(0, lambda: self.status_label.configure(text=f"Error: {str(e)}"))
-            self.frame.after(0, lambda: self.main_window.set_status(f"Error: {str(e)}"))
-        finally:
+    def _on_job_changed(self, job):
+        """Job queue listener (called from worker threads)."""
+        self.frame.after(0, lambda: self._handle_job_change(job))
+    
+    def _handle_job_change(self, job):
+        """Update the status line, preview and queue panel after a job changed."""
+        if job.status == RUNNING:
+            self.loading_bar.grid()
+            self.loading_bar.start()
+            self.progress_var.set("Generating...")
+            self.status_label.configure(text=f"Generating job #{job.id}: {job.prompt[:40]}")
+        elif job.status == DONE:
+            self._update_preview(job.result)
+            self.status_label.configure(text=f"Job #{job.id} done")
+            self.main_window.set_status("Image generated successfully")
+        elif job.status == FAILED:
+            self.status_label.configure(text=f"Job #{job.id} error: {job.error}")
+            self.main_window.set_status(f"Error: {job.error}")
+        elif job.status == CANCELLED:
+            message = "timed out" if job.timed_out else "cancelled"
+            self.status_label.configure(text=f"Job #{job.id} {message}")
+        
+        if not any(j.status == RUNNING for j in self.job_queue.jobs()):
             # Hide loading bar
-            self.frame.after(0, lambda: self.loading_bar.stop())
-            self.frame.after(0, lambda: self.loading_bar.grid_remove())
+            self.loading_bar.stop()
+            self.loading_bar.grid_remove()
+            self.progress_var.set("")
+        
+        self._schedule_queue_refresh()
 
-    def _update_preview(self, image_path):
-        """Update the preview with the generated image."""
+    def _schedule_queue_refresh(self):
+        """Rebuild the queue panel once the current burst of job events has been handled."""
+        if not self._queue_refresh_pending:
+            self._queue_refresh_pending = True
+            self.frame.after_idle(self._refresh_queue_panel)
+    
+    def _refresh_queue_panel(self):
+        """Rebuild the queue panel from the job queue."""
+        self._queue_refresh_pending = False
+        for widget in self.queue_list.winfo_children():
+            widget.destroy()
+        self._queue_rows = {}
+        
+        jobs = self.job_queue.jobs()
+        active = sum(1 for job in jobs if not job.finished)
+        self.queue_title.configure(text=f"Queue ({active} active)" if active else "Queue")
+        self.cancel_btn.configure(state="normal" if active else "disabled")
+        
+        for row, job in enumerate(jobs):
+            self._queue_rows[job.id] = self._create_queue_row(row, job)
+    
+    def _create_queue_row(self, row, job):
+        """One line of the queue panel: prompt, status and the actions valid for the job's state."""
+        colors = {QUEUED: "gray70", RUNNING: "#3B8ED0", DONE: "#2E7D32", FAILED: "#D32F2F", CANCELLED: "gray50"}
+        
+        row_frame = ctk.CTkFrame(self.queue_list)
+        row_frame.grid(row=row, column=0, padx=2, pady=2, sticky="ew")
+        row_frame.grid_columnconfigure(0, weight=1)
+        
+        prefix = "★ " if job.priority > 0 and job.status == QUEUED else ""
+        prompt_label = ctk.CTkLabel(
+            row_frame,
+            text=f"#{job.id} {prefix}{job.prompt[:28]}",
+            font=ctk.CTkFont(size=12),
+            anchor="w"
+        )
+        prompt_label.grid(row=0, column=0, padx=5, pady=(2, 0), sticky="w")
+        
+        status_label = ctk.CTkLabel(
+            row_frame,
+            text=self._job_status_text(job),
+            text_color=colors.get(job.status),
+            font=ctk.CTkFont(size=11),
+            anchor="w"
+        )
+        status_label.grid(row=1, column=0, padx=5, pady=(0, 2), sticky="w")
+        
+        buttons = []
+        if job.status == QUEUED:
+            buttons.append(("▲", lambda: self._on_move_job(job.id, -1)))
+            buttons.append(("▼", lambda: self._on_move_job(job.id, 1)))
+        if not job.finished:
+            buttons.append(("✕", lambda: self.job_queue.cancel(job.id)))
+        for column, (text, command) in enumerate(buttons, start=1):
+            ctk.CTkButton(row_frame, text=text, width=26, height=24, command=command).grid(
+                row=0, column=column, rowspan=2, padx=(0, 4), pady=2)
+        
+        return status_label
+    
+    @staticmethod
+    def _job_status_text(job):
+        if job.status == RUNNING and job.progress is not None:
+            return f"running – {int(job.progress * 100)}%"
+        if job.status == FAILED and job.error:
+            return f"failed – {job.error[:40]}"
+        return job.status
+    
+    def _on_move_job(self, job_id, offset):
+        """Move a queued job up (-1) or down (+1)."""
+        self.job_queue.move(job_id, offset)
+
+    def _on_download_progress(self, job, received, total):
+        """Report response download progress (called from the worker thread)."""
+        if total:
+            fraction = min(received / total, 1.0)
+            text = f"Downloading... {int(fraction * 100)}%"
+        else:
+            fraction = None
+            text = f"Downloading... {received // 1024} KB"
+        job.progress = fraction
+        self.frame.after(0, lambda: self._show_download_progress(job, fraction, text))
+    
+    def _show_download_progress(self, job, fraction, text):
+        """Update the loading bar and the job's queue row with download progress."""
+        if fraction is not None:
+            self.loading_bar.stop()
+            self.loading_bar.set(fraction)
+        self.progress_var.set(text)
+        status_label = self._queue_rows.get(job.id)
+        if status_label is not None and status_label.winfo_exists():
+            status_label.configure(text=self._job_status_text(job))
+    
+    def _update_preview(self, result):
+        """Update the preview with a job's result.
+        
+        The worker already decoded and scaled the preview, so only the
+        PhotoImage is created here; the file may still be being written.
+        """
         # Clear canvas
         self.canvas.delete("all")
         
-        # Open image from path and display
         try:
-            image = Image.open(image_path)
-            image.thumbnail((512, 512))  # Resize image to fit canvas
-            self.preview_image = ImageTk.PhotoImage(image)
+            self.preview_image = ImageTk.PhotoImage(result["preview"])
             self.canvas.create_image(0, 0, anchor="nw", image=self.preview_image)
-            self.canvas.config(scrollregion=self.canvas.bbox("all"))
+            self.canvas.config(scrollregion=self.canvas.bbox("all"), cursor="hand2")
+            self.generated_image = result["image"]
+            self.generated_path = result["path"]
         except Exception as e:
             logger.exception(f"Failed to load image: {str(e)}")
             self.status_label.configure(text="Failed to load image.")
     
+    def _on_open_full_image(self, event=None):
+        """Show the last generated image at full resolution in its own window."""
+        if self.generated_image is None:
+            return
+        
+        # Ảnh gốc chỉ được giải mã đầy đủ khi người dùng mở
+        image = self.generated_image.loaded()
+        window = ctk.CTkToplevel(self.frame)
+        window.title(f"{image.width}x{image.height} - {os.path.basename(self.generated_path)}")
+        window.grid_rowconfigure(0, weight=1)
+        window.grid_columnconfigure(0, weight=1)
+        
+        # Canvas có thanh cuộn khi ảnh lớn hơn màn hình
+        width = min(image.width, int(window.winfo_screenwidth() * 0.8))
+        height = min(image.height, int(window.winfo_screenheight() * 0.8))
+        canvas = tk.Canvas(window, width=width, height=height, highlightthickness=0)
+        x_scroll = tk.Scrollbar(window, orient="horizontal", command=canvas.xview)
+        y_scroll = tk.Scrollbar(window, orient="vertical", command=canvas.yview)
+        canvas.configure(xscrollcommand=x_scroll.set, yscrollcommand=y_scroll.set)
+        canvas.grid(row=0, column=0, sticky="nsew")
+        y_scroll.grid(row=0, column=1, sticky="ns")
+        x_scroll.grid(row=1, column=0, sticky="ew")
+        
+        window.full_image = ImageTk.PhotoImage(image, master=window)  # Keep a reference
+        canvas.create_image(0, 0, anchor="nw", image=window.full_image)
+        canvas.config(scrollregion=(0, 0, image.width, image.height))
+        window.focus()
+    
     def show(self):
         """Show this tab."""
         self.frame.grid(row=0, column=0, sticky="nsew")
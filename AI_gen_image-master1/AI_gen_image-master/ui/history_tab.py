@@ -6,11 +6,18 @@ from PIL import Image, ImageTk
 import logging
 import platform
 import subprocess
-import time  # Thêm thư viện để xử lý thời gian
-from typing import Optional
+from typing import Any, Dict, Optional
+
+from core.db import get_database
 
 logger = logging.getLogger(__name__)
 
+# Số ảnh lịch sử nạp mỗi lần (mỗi lần bấm "Load more")
+PAGE_SIZE = 30
+# Số kết quả tìm kiếm tối đa và độ trễ (ms) sau lần gõ phím cuối trước khi tìm
+SEARCH_LIMIT = 100
+SEARCH_DELAY_MS = 250
+
 class HistoryTab(ctk.CTkFrame):
     """Tab for viewing and managing image generation history."""
     
@@ -19,6 +26,10 @@ class HistoryTab(ctk.CTkFrame):
         self.parent = parent
         self.main_window = main_window
         self.history_frames = []
+        self.db = get_database()
+        self.next_cursor: Optional[str] = None
+        self.load_more_btn = None
+        self._search_job = None
         
         # Create layout
         self._create_widgets()
@@ -42,6 +53,15 @@ class HistoryTab(ctk.CTkFrame):
         )
         self.refresh_btn.pack(side=tk.LEFT, padx=5)
         
+        # Ô tìm kiếm prompt: từ khóa, "cụm từ" và tiền tố*
+        self.search_entry = ctk.CTkEntry(
+            self.controls_frame,
+            placeholder_text='Search prompts (words, "phrase", prefix*)',
+            width=320
+        )
+        self.search_entry.pack(side=tk.LEFT, padx=5)
+        self.search_entry.bind("<KeyRelease>", self._on_search_changed)
+        
         # Scrollable frame for history items
         self.history_container = ctk.CTkScrollableFrame(self)
         self.history_container.grid(row=1, column=0, sticky="nsew", padx=10, pady=10)
@@ -56,14 +76,16 @@ class HistoryTab(ctk.CTkFrame):
         for frame in self.history_frames:
             frame.destroy()
         self.history_frames = []
-
-        # Automatically determine the path to the `generated_images` folder
-        base_dir = os.path.dirname(os.path.abspath(__file__))  # Current file's directory
-        image_dir = os.path.join(base_dir, "..", "generated_images")  # Path to `generated_images`
-
-        # Ensure the directory exists
-        if not os.path.exists(image_dir):
-            logger.warning(f"Directory not found: {image_dir}")
+        self.next_cursor = None
+        
+        query = self.search_entry.get().strip()
+        if query:
+            self._show_search_results(query)
+        else:
+            self._load_page()
+        
+        # If no images found, show a message
+        if not self.history_frames:
             no_items_label = ctk.CTkLabel(
                 self.history_container,
                 text="No history items found.",
@@ -72,31 +94,67 @@ class HistoryTab(ctk.CTkFrame):
             )
             no_items_label.pack(pady=20)
             self.history_frames.append(no_items_label)
-            return
-
-        # Get all image files in the directory
-        image_files = [os.path.join(image_dir, f) for f in os.listdir(image_dir) if f.lower().endswith(('.png', '.jpg', '.jpeg'))]
+    
+    def _load_page(self):
+        """Append the next page of history, newest first."""
+        if self.load_more_btn is not None:
+            self.load_more_btn.destroy()
+            self.load_more_btn = None
         
-        # If no images found, show a message
-        if not image_files:
-            no_items_label = ctk.CTkLabel(
+        # Phân trang bằng con trỏ (created_at, id), không dùng OFFSET
+        try:
+            records, self.next_cursor = self.db.get_images_page(after=self.next_cursor, page_size=PAGE_SIZE)
+        except Exception as e:
+            logger.error(f"Error loading history: {e}")
+            records, self.next_cursor = [], None
+        
+        self._add_items(records)
+        
+        # Nút nạp trang tiếp theo, chỉ hiện khi còn ảnh cũ hơn
+        if self.next_cursor is not None:
+            self.load_more_btn = ctk.CTkButton(
                 self.history_container,
-                text="No history items found.",
-                font=("Arial", 14),
-                text_color="grey" if ctk.get_appearance_mode() == "light" else "darkgrey"
+                text="Load more",
+                width=120,
+                fg_color=["#3B8ED0", "#1F6AA5"],
+                hover_color=["#36719F", "#144870"],
+                command=self._load_page
             )
-            no_items_label.pack(pady=20)
-            self.history_frames.append(no_items_label)
-            return
-
+            self.load_more_btn.pack(pady=10)
+    
+    def _show_search_results(self, query: str):
+        """Show the best prompt matches of a search instead of the pages."""
+        if self.load_more_btn is not None:
+            self.load_more_btn.destroy()
+            self.load_more_btn = None
+        
+        try:
+            records = self.db.search_images(query, SEARCH_LIMIT)
+        except Exception as e:
+            logger.error(f"Error searching history: {e}")
+            records = []
+        self._add_items(records)
+    
+    def _add_items(self, records):
         # Display each image
-        for i, filepath in enumerate(image_files):
-            frame = self._create_history_item(filepath, i)
+        for record in records:
+            frame = self._create_history_item(record, len(self.history_frames))
             frame.pack(fill=tk.X, expand=True, pady=5)
             self.history_frames.append(frame)
     
-    def _create_history_item(self, filepath: str, index: int) -> ctk.CTkFrame:
+    def _on_search_changed(self, event=None):
+        """Search once typing pauses, not on every keystroke."""
+        if self._search_job is not None:
+            self.after_cancel(self._search_job)
+        self._search_job = self.after(SEARCH_DELAY_MS, self._run_search)
+    
+    def _run_search(self):
+        self._search_job = None
+        self.refresh()
+    
+    def _create_history_item(self, record: Dict[str, Any], index: int) -> ctk.CTkFrame:
         """Create a history item widget."""
+        filepath = record["filepath"]
         frame = ctk.CTkFrame(self.history_container)
         
         # Container for image and info
@@ -152,8 +210,20 @@ class HistoryTab(ctk.CTkFrame):
         )
         filepath_label.pack(anchor="w")
         
-        # Get file creation time
-        creation_time = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(os.path.getmtime(filepath)))
+        # Prompt, or the matching part of it with the search words in [brackets]
+        prompt = record.get("snippet") or record["prompt"]
+        prompt_label = ctk.CTkLabel(
+            info_frame,
+            text=prompt[:100] + ("..." if len(prompt) > 100 else ""),
+            font=("Arial", 11),
+            anchor="w",
+            justify="left",
+            wraplength=500
+        )
+        prompt_label.pack(anchor="w")
+        
+        # Thời gian tạo, lấy từ cơ sở dữ liệu
+        creation_time = record["created_at"]
         creation_time_label = ctk.CTkLabel(
             info_frame,
             text=f"Created: {creation_time}",
@@ -183,7 +253,7 @@ class HistoryTab(ctk.CTkFrame):
             width=80,
             fg_color=["#D32F2F", "#D32F2F"],
             hover_color=["#B71C1C", "#B71C1C"],
-            command=lambda: self._on_delete(filepath)
+            command=lambda: self._on_delete(record)
         )
         delete_btn.pack(side=tk.LEFT, padx=5)
         
@@ -209,8 +279,9 @@ class HistoryTab(ctk.CTkFrame):
                 f"The file {filepath} does not exist."
             )
     
-    def _on_delete(self, filepath: str):
+    def _on_delete(self, record: Dict[str, Any]):
         """Delete an image from history."""
+        filepath = record["filepath"]
         # Confirm delete
         if not messagebox.askyesno(
             "Confirm Delete",
@@ -226,6 +297,10 @@ class HistoryTab(ctk.CTkFrame):
             except Exception as e:
                 logger.error(f"Error deleting file: {e}")
                 messagebox.showerror("Error", f"Failed to delete file: {e}")
+                return
+        
+        # Xóa cả bản ghi trong cơ sở dữ liệu
+        self.db.delete_image(record["id"])
         
         # Refresh the list
         self.refresh()
@@ -8,6 +8,7 @@ from PIL import Image, ImageTk
 
 import customtkinter as ctk
 
+from core.providers import get_provider, list_providers
 from core.settings import API_PROVIDER, AI_API_KEY, DARK_MODE, APP_CONFIG, save_setting
 
 logger = logging.getLogger(__name__)
@@ -106,7 +107,7 @@ class APISettingsDialog(ctk.CTkToplevel):
         self.provider_var = ctk.StringVar(value=self.current_provider)
         self.provider_menu = ctk.CTkOptionMenu(
             provider_frame,
-            values=["openai", "stability", "gemini"],
+            values=list_providers(),
             variable=self.provider_var,
             command=self._on_provider_change,
             width=200
@@ -191,33 +192,9 @@ class APISettingsDialog(ctk.CTkToplevel):
         self.desc_text.configure(state="normal")
         self.desc_text.delete("1.0", "end")
         
-        if provider == "openai":
-            self.desc_text.insert("1.0", (
-                "OpenAI API for DALL-E image generation.\n\n"
-                "To use this API:\n"
-                "1. Register at https://platform.openai.com/\n"
-                "2. Create an API key in your dashboard\n"
-                "3. Paste your API key here\n\n"
-                "The DALL-E models can generate high-quality images from text prompts."
-            ))
-        elif provider == "stability":
-            self.desc_text.insert("1.0", (
-                "Stability AI API for SDXL image generation.\n\n"
-                "To use this API:\n"
-                "1. Register at https://platform.stability.ai/\n"
-                "2. Create an API key in your dashboard\n"
-                "3. Paste your API key here\n\n"
-                "Stability AI offers state-of-the-art AI image generation."
-            ))
-        elif provider == "gemini":
-            self.desc_text.insert("1.0", (
-                "Google's Gemini API for image generation.\n\n"
-                "To use this API:\n"
-                "1. Register at https://aistudio.google.com/\n"
-                "2. Create an API key in your Google AI Studio\n"
-                "3. Paste your API key here\n\n"
-                "Gemini is Google's multimodal AI that can generate images from text."
-            ))
+        plugin = get_provider(provider)
+        if plugin is not None:
+            self.desc_text.insert("1.0", plugin.description)
         
         # Disable text editing again
         self.desc_text.configure(state="disabled")
@@ -249,8 +226,9 @@ class APISettingsDialog(ctk.CTkToplevel):
         provider = self.provider_var.get()
         api_key = self.key_var.get().strip()
         
-        # Validate API key
-        if not api_key:
+        # Validate API key (the local provider does not need one)
+        plugin = get_provider(provider)
+        if not api_key and (plugin is None or plugin.requires_api_key):
             self._show_error_message("API key cannot be empty.")
             return
         